@@ -0,0 +1,188 @@
+"""
+Analytics of a matching run for /api/analytics, aggregated with pandas group-bys.
+
+The payload is computed once per run and stored with it (MatchingRun.analytics),
+so the endpoint is a cache read. The matching runs build it from the matrices
+they already hold (solution_analytics); otherwise it is computed from two bulk
+queries, the run's results joined to their preference points and stored ranks and the
+school capacities (compute_analytics), the first time it is read. Saving
+preferences or the configuration clears the stored payloads (clear_analytics).
+"""
+import numpy as np
+import pandas as pd
+from database import db, School, Preference, MatchingRun, MatchingResult
+
+# Matched cells whose ranks are computed per numpy step in solution_analytics
+RANK_CHUNK_SIZE = 10000
+
+def load_run_matches(run_id):
+    """
+    DataFrame of the results of a run with the points the student gave the
+    school and its stored rank among the student's preferences (0 points and no
+    rank for a school the student has no preference row for)
+    """
+    rows = db.session.query(
+        MatchingResult.student_id, MatchingResult.school_id, MatchingResult.session_number, Preference.points,
+        Preference.rank
+    ).outerjoin(
+        Preference,
+        (Preference.student_id == MatchingResult.student_id) & (Preference.school_id == MatchingResult.school_id)
+    ).filter(MatchingResult.run_id == run_id).all()
+    
+    matches = pd.DataFrame([tuple(row) for row in rows],
+                           columns=['student_id', 'school_id', 'session_number', 'points', 'rank'])
+    matches['points'] = matches['points'].fillna(0).astype('int64')
+    return matches
+
+def solution_analytics(student_ids, school_ids, school_names, points, capacity, cells):
+    """
+    The analytics payload of a solution from the matrices of its run, or None
+    when it cannot be told from `points` which cells have a preference row (some,
+    but not all, zero-point cells have one). `cells` holds the (student index,
+    school index, session index) of every result, fallback fills included.
+    Ranks follow database.rank_preferences: points descending, ties by school id.
+    """
+    # Zero-point rows are either all absent (sparse) or all present (dense)
+    zero_rows = Preference.query.filter(Preference.points == 0).count()
+    if zero_rows == 0:
+        listed = points != 0
+    elif zero_rows == points.size - np.count_nonzero(points):
+        listed = np.ones(points.shape, dtype=bool)
+    else:
+        return None
+    
+    cells = np.asarray(cells, dtype=np.int64).reshape(-1, 3)
+    school_ids = np.asarray(school_ids, dtype=np.int64)
+    rank = np.full(len(cells), np.nan)
+    for offset in range(0, len(cells), RANK_CHUNK_SIZE):
+        i, j = cells[offset:offset + RANK_CHUNK_SIZE, 0], cells[offset:offset + RANK_CHUNK_SIZE, 1]
+        row_points, cell_points = points[i], points[i, j][:, None]
+        ahead = (row_points > cell_points) | ((row_points == cell_points) & (school_ids[None, :] < school_ids[j][:, None]))
+        chunk_rank = (ahead & listed[i]).sum(axis=1) + 1.0
+        chunk_rank[~listed[i, j]] = np.nan
+        rank[offset:offset + RANK_CHUNK_SIZE] = chunk_rank
+    
+    matches = pd.DataFrame({
+        'student_id': np.asarray(student_ids, dtype=np.int64)[cells[:, 0]],
+        'school_id': school_ids[cells[:, 1]],
+        'session_number': cells[:, 2] + 1,
+        'points': points[cells[:, 0], cells[:, 1]],
+        'rank': rank
+    })
+    schools = {
+        int(school_ids[j]): (school_names[j], int(capacity[j].sum())) for j in np.unique(cells[:, 1]).tolist()
+    }
+    return summarize(matches, schools)
+
+def _school_capacities(school_ids):
+    """
+    Name and total capacity over all sessions of each school, by id
+    """
+    from matching import session_capacity_columns
+    
+    columns = session_capacity_columns()
+    return {
+        row[0]: (row[1], sum(capacity or 0 for capacity in row[2:]))
+        for row in db.session.query(School.id, School.school_name, *(getattr(School, column) for column in columns))
+        .filter(School.id.in_(school_ids)).all()
+    }
+
+def _totals(matches, key):
+    """
+    Match count, total points and number of top 3 choices per value of `key`
+    """
+    return matches.assign(top_3=matches['rank'] <= 3).groupby(key).agg(
+        total_matches=('points', 'size'), points=('points', 'sum'), top_3=('top_3', 'sum')
+    )
+
+def compute_analytics(run_id):
+    """
+    The /api/analytics payload of a run, computed from the database
+    """
+    matches = load_run_matches(run_id)
+    return summarize(matches, _school_capacities([int(school_id) for school_id in matches['school_id'].unique()]))
+
+def summarize(matches, schools):
+    """
+    The /api/analytics payload of a run's `matches` (student_id, school_id,
+    session_number, points and rank columns): how many students got their first,
+    second, third or another choice as their best placement, and per school, per
+    session and overall match counts and average preference points. `schools`
+    maps the matched school ids to their name and total capacity.
+    """
+    total_matches = len(matches)
+    
+    best_rank = matches.groupby('student_id')['rank'].min()
+    first_choice = int((best_rank == 1).sum())
+    second_choice = int((best_rank == 2).sum())
+    third_choice = int((best_rank == 3).sum())
+    with_top_3 = first_choice + second_choice + third_choice
+    
+    analytics = {
+        'top_choices': {
+            'first_choice': first_choice,
+            'second_choice': second_choice,
+            'third_choice': third_choice,
+            'other_choice': len(best_rank) - with_top_3,
+            'total_students': len(best_rank),
+            'students_with_at_least_one_top_3': with_top_3
+        },
+        'school_stats': {},
+        'session_stats': {},
+        'overall_stats': {
+            'total_matches': total_matches,
+            'average_preference_score': 0,
+            'students_with_top_3': 0
+        }
+    }
+    if total_matches == 0:
+        return analytics
+    
+    analytics['overall_stats']['average_preference_score'] = int(matches['points'].sum()) / total_matches
+    analytics['overall_stats']['students_with_top_3'] = with_top_3
+    
+    for school_id, stats in _totals(matches, 'school_id').iterrows():
+        name, total_capacity = schools.get(school_id, (None, 0))
+        total = int(stats['total_matches'])
+        analytics['school_stats'][int(school_id)] = {
+            'name': name,
+            'total_matches': total,
+            'total_capacity': total_capacity,
+            'average_preference_score': int(stats['points']) / total,
+            'top_3_applications': int(stats['top_3']),
+            'fill_rate': (total / total_capacity) * 100 if total_capacity > 0 else 0
+        }
+    
+    for session_number, stats in _totals(matches, 'session_number').iterrows():
+        total = int(stats['total_matches'])
+        analytics['session_stats'][f"session_{session_number}"] = {
+            'total_matches': total,
+            'average_preference_score': int(stats['points']) / total
+        }
+    
+    return analytics
+
+def run_analytics(run_id):
+    """
+    The stored analytics payload of a run, computed and stored first if the run
+    has none yet. None for an unknown run (no run yet: the empty payload).
+    """
+    if run_id is None:
+        return summarize(load_run_matches(None), {})
+    run = db.session.get(MatchingRun, run_id)
+    if run is None:
+        return None
+    if run.analytics is None:
+        run.analytics = compute_analytics(run_id)
+        db.session.commit()
+    # Read back as stored, so every read returns the same JSON
+    return run.analytics
+
+def clear_analytics():
+    """
+    Forget the stored analytics payloads after a change to the preferences or
+    schools they were computed from. Part of the caller's transaction: it
+    commits along with the change.
+    """
+    MatchingRun.query.filter(MatchingRun.analytics.isnot(None))\
+        .update({MatchingRun.analytics: None}, synchronize_session=False)
@@ -1,5 +1,5 @@
 import os
-from flask import Flask, request, jsonify, send_from_directory, send_file
+from flask import Flask, Response, request, jsonify, send_from_directory, send_file, stream_with_context
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
 from dotenv import load_dotenv
@@ -25,11 +25,16 @@ app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', f'sqlite:///{d
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 # Import models from database.py
-from database import db, School, Student, Preference, MatchingResult, init_db
+from database import db, School, Student, Preference, MatchingRun, MatchingResult, init_db, bump_data_version
+from response_cache import conditional
+from compression import compress_response
 
 # Initialize the database
 init_db(app)
 
+# Compress large JSON and text responses (the cached read endpoints compress their own)
+app.after_request(compress_response)
+
 def import_preferences_from_excel(file):
     try:
         # Get file extension
@@ -310,6 +315,7 @@ def handle_schools():
         # Add new school
         new_school = School(name=data['name'])
         db.session.add(new_school)
+        bump_data_version()
         db.session.commit()
         return jsonify({'message': 'School added successfully', 'id': new_school.id})
     else:
@@ -469,160 +475,70 @@ def generate_matches():
     return jsonify({'message': 'Matching algorithm executed successfully'})
 
 # Results endpoint
+# Maximum page size of the paginated endpoints
+MAX_PAGE_SIZE = 1000
+
+# Results of a matching run (the current one by default), filtered, sorted and
+# keyset-paginated: pass the next_cursor of a page as cursor to get the next one
 @app.route('/api/results', methods=['GET'])
+@conditional
 def get_results():
     try:
-        # Get all matching results from the database
-        results = MatchingResult.query.all()
+        from matching import current_run_id, published_runs, results_page
         
-        # Convert to the format expected by the frontend
-        matches = []
-        for result in results:
-            match = {
-                'id': result.id,
-                'student_id': result.student_id,
-                'student_name': f"{result.student.first_name} {result.student.last_name}",
-                'student_email': result.student.email,  # Add email to the response
-                'school_id': result.school_id,
-                'school_name': result.school.school_name,
-                'session_number': result.session_number,
-                'preference_score': result.student.preferences.filter_by(school_id=result.school_id).first().points
-            }
-            matches.append(match)
+        run_id = request.args.get('run_id', type=int)
+        limit = request.args.get('limit', 100, type=int)
+        order = request.args.get('order', 'asc')
+        if not 1 <= limit <= MAX_PAGE_SIZE or order not in ('asc', 'desc'):
+            return jsonify({
+                'success': False,
+                'error': f"limit must be between 1 and {MAX_PAGE_SIZE} and order 'asc' or 'desc'"
+            }), 400
+        if run_id is None:
+            run_id = current_run_id()
+        elif published_runs().filter(MatchingRun.id == run_id).first() is None:
+            # Staged runs are still being written, or failed
+            return jsonify({
+                'success': False,
+                'error': f'Unknown matching run {run_id}'
+            }), 404
+        
+        try:
+            page = results_page(
+                run_id,
+                school_id=request.args.get('school_id', type=int),
+                session_number=request.args.get('session', type=int),
+                search=request.args.get('q', '').strip(),
+                min_score=request.args.get('min_score', type=int),
+                max_score=request.args.get('max_score', type=int),
+                sort=request.args.get('sort', 'id'),
+                descending=order == 'desc',
+                limit=limit,
+                cursor=request.args.get('cursor')
+            )
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
         
-        return jsonify({
-            'matches': matches
-        })
+        return jsonify(dict(success=True, limit=limit, **page))
     except Exception as e:
         return jsonify({
+            'success': False,
             'error': f'Error retrieving results: {str(e)}'
         }), 500
 
 # Analytics endpoint
 @app.route('/api/analytics', methods=['GET'])
+@conditional
 def get_analytics():
     try:
-        # Get all matches
-        matches = MatchingResult.query.all()
-        
-        # Initialize analytics data
-        analytics = {
-            'top_choices': {
-                'first_choice': 0,
-                'second_choice': 0,
-                'third_choice': 0,
-                'other_choice': 0,
-                'total_students': 0,
-                'students_with_at_least_one_top_3': 0
-            },
-            'school_stats': {},
-            'session_stats': {},
-            'overall_stats': {
-                'total_matches': len(matches),
-                'average_preference_score': 0,
-                'students_with_top_3': 0
-            }
-        }
+        from analytics import run_analytics
+        from matching import current_run_id
         
-        # Get unique student IDs
-        unique_student_ids = set(match.student_id for match in matches)
-        analytics['top_choices']['total_students'] = len(unique_student_ids)
-        
-        # Calculate best match for each student
-        for student_id in unique_student_ids:
-            # Get all matches for this student
-            student_matches = [m for m in matches if m.student_id == student_id]
-            
-            # Get student's preferences ordered by points
-            preferences = Preference.query.filter_by(student_id=student_id)\
-                .order_by(Preference.points.desc()).all()
-            
-            # Find the best rank they got across all their matches
-            best_rank = float('inf')
-            for match in student_matches:
-                for i, pref in enumerate(preferences, 1):
-                    if pref.school_id == match.school_id:
-                        best_rank = min(best_rank, i)
-                        break
-            
-            # Update top choice statistics based on best rank
-            if best_rank == 1:
-                analytics['top_choices']['first_choice'] += 1
-                analytics['top_choices']['students_with_at_least_one_top_3'] += 1
-            elif best_rank == 2:
-                analytics['top_choices']['second_choice'] += 1
-                analytics['top_choices']['students_with_at_least_one_top_3'] += 1
-            elif best_rank == 3:
-                analytics['top_choices']['third_choice'] += 1
-                analytics['top_choices']['students_with_at_least_one_top_3'] += 1
-            else:
-                analytics['top_choices']['other_choice'] += 1
-            
-            # Update school and session statistics
-            for match in student_matches:
-                school_id = match.school_id
-                if school_id not in analytics['school_stats']:
-                    school = School.query.get(school_id)
-                    # Calculate total capacity from all sessions
-                    total_capacity = (
-                        school.session1_capacity +
-                        school.session2_capacity +
-                        school.session3_capacity +
-                        school.session4_capacity +
-                        school.session5_capacity +
-                        school.session6_capacity
-                    )
-                    analytics['school_stats'][school_id] = {
-                        'name': school.school_name,
-                        'total_matches': 0,
-                        'total_capacity': total_capacity,
-                        'average_preference_score': 0,
-                        'top_3_applications': 0
-                    }
-                
-                school_stats = analytics['school_stats'][school_id]
-                school_stats['total_matches'] += 1
-                preference_score = Preference.query.filter_by(
-                    student_id=match.student_id,
-                    school_id=match.school_id
-                ).first().points
-                school_stats['average_preference_score'] += preference_score
-                
-                # Count students who ranked this school in top 3
-                top_3_schools = [p.school_id for p in preferences[:3]]
-                if school_id in top_3_schools:
-                    school_stats['top_3_applications'] += 1
-                
-                # Update session statistics
-                session_key = f"session_{match.session_number}"
-                if session_key not in analytics['session_stats']:
-                    analytics['session_stats'][session_key] = {
-                        'total_matches': 0,
-                        'average_preference_score': 0
-                    }
-                
-                session_stats = analytics['session_stats'][session_key]
-                session_stats['total_matches'] += 1
-                session_stats['average_preference_score'] += preference_score
-                
-                # Update overall statistics
-                analytics['overall_stats']['average_preference_score'] += preference_score
-        
-        # Calculate averages and percentages
-        if len(matches) > 0:
-            analytics['overall_stats']['average_preference_score'] /= len(matches)
-            analytics['overall_stats']['students_with_top_3'] = analytics['top_choices']['students_with_at_least_one_top_3']
-            
-            # Calculate school averages
-            for school_id, stats in analytics['school_stats'].items():
-                if stats['total_matches'] > 0:
-                    stats['average_preference_score'] /= stats['total_matches']
-                    stats['fill_rate'] = (stats['total_matches'] / stats['total_capacity']) * 100 if stats['total_capacity'] > 0 else 0
-            
-            # Calculate session averages
-            for session_key, stats in analytics['session_stats'].items():
-                if stats['total_matches'] > 0:
-                    stats['average_preference_score'] /= stats['total_matches']
+        # Stored with the current matching run, computed on the first read if it has none
+        analytics = run_analytics(current_run_id())
         
         return jsonify({
             'success': True,
@@ -648,9 +564,8 @@ def save_config():
         config_data = data['data']
         print(f"Processing {len(config_data)} schools")
         
-        # Clear existing schools
+        # Replace the existing schools; nothing is committed until every school is added
         School.query.delete()
-        db.session.commit()
         print("Cleared existing schools")
         
         # Add new schools
@@ -667,6 +582,10 @@ def save_config():
             )
             db.session.add(school)
         
+        # Stored analytics no longer match the schools
+        from analytics import clear_analytics
+        clear_analytics()
+        bump_data_version()
         db.session.commit()
         print("Successfully committed changes to database")
         
@@ -696,6 +615,7 @@ def save_preferences():
         school_map = {clean_school_name(school.school_name): school.id for school in schools}
         
         # Process each student's preferences
+        saved_student_ids = []
         for item in preferences_data:
             # Find or create student
             student = Student.query.filter_by(
@@ -712,6 +632,7 @@ def save_preferences():
                 )
                 db.session.add(student)
                 db.session.flush()  # Get the student ID
+            saved_student_ids.append(student.id)
             
             # Update preferences for each school
             for school_name, school_id in school_map.items():
@@ -738,6 +659,13 @@ def save_preferences():
                     )
                     db.session.add(preference)
         
+        # Re-rank the saved students' preferences; stored analytics no longer match them. Results keep
+        # the scores they were matched with.
+        from analytics import clear_analytics
+        from database import rank_preferences
+        rank_preferences(saved_student_ids)
+        clear_analytics()
+        bump_data_version()
         db.session.commit()
         
         return jsonify({
@@ -751,6 +679,7 @@ def save_preferences():
 
 # New endpoint to load configuration data
 @app.route('/api/config/load', methods=['GET'])
+@conditional
 def load_config():
     try:
         schools = School.query.all()
@@ -799,6 +728,7 @@ def load_config():
 
 # New endpoint to load preferences data
 @app.route('/api/preferences/load', methods=['GET'])
+@conditional
 def load_preferences():
     try:
         students = Student.query.all()
@@ -858,8 +788,11 @@ def load_preferences():
 @app.route('/api/config/clear', methods=['POST'])
 def clear_config():
     try:
-        # Clear all schools from the database
+        # Clear all schools from the database, stored analytics no longer match them
+        from analytics import clear_analytics
         School.query.delete()
+        clear_analytics()
+        bump_data_version()
         db.session.commit()
         
         return jsonify({
@@ -877,10 +810,12 @@ def clear_config():
 @app.route('/api/preferences/clear', methods=['POST'])
 def clear_preferences():
     try:
-        # Clear all preferences, students, and matching results from the database
+        # Clear all preferences, students, and matching runs with their results from the database
         Preference.query.delete()
         Student.query.delete()
         MatchingResult.query.delete()
+        MatchingRun.query.delete()
+        bump_data_version()
         db.session.commit()
         
         return jsonify({
@@ -894,21 +829,122 @@ def clear_preferences():
             'error': str(e)
         }), 500
 
+# Matching algorithms selectable through /api/preferences/process
+MATCHING_ALGORITHMS = ('improved_matching', 'simple_matching', 'ilp', 'min_cost_flow', 'lottery')
+
+def run_selected_matching(algorithm, options, timings=None):
+    """
+    Make a new matching run of `algorithm`, taking its settings from the
+    /api/preferences/process options. Its results become the current ones and
+    earlier runs are kept up to the retention limit. Phases are recorded in
+    `timings`.
+    """
+    # Import and run the matching algorithm
+    print("Running matching algorithm...")
+    from matching import (
+        run_matching_algorithm, run_simple_matching_algorithm, run_ilp_matching_algorithm,
+        run_flow_matching_algorithm, run_lottery_matching_algorithm, DEFAULT_PERSIST_CHUNK_SIZE,
+        DEFAULT_SIMPLE_TOP_K, DEFAULT_ILP_TIME_LIMIT, DEFAULT_ILP_GAP_TOLERANCE
+    )
+    persist_chunk_size = options.get('persist_chunk_size', DEFAULT_PERSIST_CHUNK_SIZE)
+    
+    if algorithm == 'improved_matching':
+        return run_matching_algorithm(
+            seed=options.get('seed'),
+            bid_engine=options.get('bid_engine', 'numpy'),
+            persist_chunk_size=persist_chunk_size,
+            timings=timings
+        )
+    elif algorithm == 'simple_matching':
+        return run_simple_matching_algorithm(
+            seed=options.get('seed'),
+            top_k=options.get('top_k', DEFAULT_SIMPLE_TOP_K),
+            persist_chunk_size=persist_chunk_size,
+            timings=timings
+        )
+    elif algorithm == 'lottery':
+        return run_lottery_matching_algorithm(
+            draws=options.get('draws', 8),
+            seed=options.get('seed'),
+            welfare=options.get('welfare', 'total_points'),
+            workers=options.get('workers'),
+            persist_chunk_size=persist_chunk_size,
+            timings=timings
+        )
+    elif algorithm == 'min_cost_flow':
+        return run_flow_matching_algorithm(
+            seed=options.get('seed'),
+            persist_chunk_size=persist_chunk_size,
+            timings=timings
+        )
+    else:
+        return run_ilp_matching_algorithm(
+            seed=options.get('seed'),
+            time_limit=options.get('time_limit', DEFAULT_ILP_TIME_LIMIT),
+            gap_tolerance=options.get('gap_tolerance', DEFAULT_ILP_GAP_TOLERANCE),
+            persist_chunk_size=persist_chunk_size,
+            timings=timings
+        )
+
+def _matching_job(algorithm, options):
+    """
+    Background job function for /api/preferences/process: the result points at
+    the stored results instead of carrying every match
+    """
+    def run(timings):
+        try:
+            result = run_selected_matching(algorithm, options, timings)
+        except Exception:
+            db.session.rollback()
+            raise
+        if "error" in result:
+            raise ValueError(result["error"])
+        return _run_reference(result)
+    return run
+
+def _run_reference(result):
+    """
+    What /api/preferences/process returns for a finished run: its summary
+    statistics and where to page through its results, not the matches themselves
+    """
+    run_id = result.get("statistics", {}).get("run_id")
+    return {
+        'statistics': result.get("statistics", {}),
+        'match_count': len(result.get("matches", [])),
+        'run_id': run_id,
+        'results_url': f'/api/results?run_id={run_id}'
+    }
+
 # Process preferences endpoint
 @app.route('/api/preferences/process', methods=['POST'])
 def process_preferences():
     try:
         print("Starting to process preferences...")
+        options = request.get_json(silent=True) or {}
+        algorithm = options.get('algorithm', 'improved_matching')
+        if algorithm not in MATCHING_ALGORITHMS:
+            return jsonify({
+                'success': False,
+                'error': f"Unknown matching algorithm '{algorithm}'"
+            }), 400
+        
+        # With "background": true the run is queued and polled through /api/jobs/<job_id>
+        if options.get('background'):
+            from jobs import submit_job
+            from matching import MATCHING_PHASES, expected_phase_seconds
+            job_id = submit_job(
+                app, _matching_job(algorithm, options), MATCHING_PHASES[algorithm],
+                expected_phase_seconds(algorithm), kind='matching', algorithm=algorithm
+            )
+            return jsonify({
+                'success': True,
+                'message': 'Matching job submitted',
+                'job_id': job_id,
+                'status_url': f'/api/jobs/{job_id}',
+                'events_url': f'/api/jobs/{job_id}/events'
+            }), 202
         
-        # Clear any existing matching results
-        print("Clearing existing matching results...")
-        MatchingResult.query.delete()
-        db.session.commit()
-        
-        # Import and run the matching algorithm
-        print("Running matching algorithm...")
-        from matching import run_matching_algorithm, get_students_without_top_3_picks
-        result = run_matching_algorithm()
+        result = run_selected_matching(algorithm, options)
         
         if "error" in result:
             print(f"Error in matching algorithm: {result['error']}")
@@ -917,40 +953,8 @@ def process_preferences():
                 'error': result["error"]
             }), 500
         
-        # Get the matches from the database
-        print("Fetching matches from database...")
-        matches = MatchingResult.query.all()
-        print(f"Found {len(matches)} matches")
-        
-        matches_data = []
-        for match in matches:
-            # Get the preference score using a query
-            preference = Preference.query.filter_by(
-                student_id=match.student_id,
-                school_id=match.school_id
-            ).first()
-            
-            match_data = {
-                'id': match.id,
-                'student_id': match.student_id,
-                'student_name': f"{match.student.first_name} {match.student.last_name}",
-                'student_email': match.student.email,  # Add email to the response
-                'school_id': match.school_id,
-                'school_name': match.school.school_name,
-                'session_number': match.session_number,
-                'preference_score': preference.points if preference else 0
-            }
-            matches_data.append(match_data)
-            print(f"Added match: {match_data['student_name']} -> {match_data['school_name']}")
-        
-        response = {
-            'success': True,
-            'message': 'Matching algorithm executed successfully',
-            'statistics': result.get("statistics", {}),
-            'matches': matches_data
-        }
-        print(f"Returning response with {len(matches_data)} matches")
-        return jsonify(response)
+        # The matches are paged through /api/results
+        return jsonify(dict(success=True, message='Matching algorithm executed successfully', **_run_reference(result)))
     
     except Exception as e:
         print(f"Error in process_preferences: {str(e)}")
@@ -960,6 +964,161 @@ def process_preferences():
             'error': f'Error processing preferences: {str(e)}'
         }), 500
 
+# Status of a background job: phase, percent complete, ETA and, once done, its result
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    from jobs import job_status
+    
+    status = job_status(job_id)
+    if status is None:
+        return jsonify({
+            'success': False,
+            'error': f"Unknown job '{job_id}'"
+        }), 404
+    return jsonify({'success': True, 'job': status})
+
+# The same status as a server-sent events stream, until the job is done
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def stream_job(job_id):
+    from jobs import job_status, job_events
+    
+    if job_status(job_id) is None:
+        return jsonify({
+            'success': False,
+            'error': f"Unknown job '{job_id}'"
+        }), 404
+    return Response(job_events(job_id), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# Update the improved matching results after late preference or capacity changes
+@app.route('/api/preferences/rematch', methods=['POST'])
+def rematch_preferences():
+    try:
+        from matching import rematch_incremental, DEFAULT_PERSIST_CHUNK_SIZE
+        
+        options = request.get_json(silent=True) or {}
+        student_ids = options.get('student_ids', [])
+        if not isinstance(student_ids, list):
+            return jsonify({
+                'success': False,
+                'error': 'student_ids must be a list of student ids'
+            }), 400
+        
+        result = rematch_incremental(
+            student_ids=student_ids,
+            persist_chunk_size=options.get('persist_chunk_size', DEFAULT_PERSIST_CHUNK_SIZE)
+        )
+        if "error" in result:
+            return jsonify({
+                'success': False,
+                'error': result["error"]
+            }), 400
+        
+        return jsonify({
+            'success': True,
+            'message': 'Matching results updated successfully',
+            'statistics': result['statistics'],
+            'changes': result['changes']
+        })
+    
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'error': f'Error updating matching results: {str(e)}'
+        }), 500
+
+# Per-phase timings of the recent matching runs
+@app.route('/api/metrics/matching', methods=['GET'])
+def get_matching_metrics():
+    try:
+        from matching import matching_metrics
+        
+        limit = request.args.get('limit', type=int)
+        return jsonify(dict(success=True, **matching_metrics(limit)))
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Error retrieving matching metrics: {str(e)}'
+        }), 500
+
+# Students of the current run placed at none of their top k schools, a page at a time
+@app.route('/api/results/without-top-picks', methods=['GET'])
+def get_students_without_top_picks():
+    try:
+        from matching import students_without_top_picks
+        
+        k = request.args.get('k', 3, type=int)
+        page = request.args.get('page', 1, type=int)
+        per_page = request.args.get('per_page', 100, type=int)
+        if k < 1 or page < 1 or not 1 <= per_page <= MAX_PAGE_SIZE:
+            return jsonify({
+                'success': False,
+                'error': f'k and page must be at least 1 and per_page between 1 and {MAX_PAGE_SIZE}'
+            }), 400
+        
+        result = students_without_top_picks(k, limit=per_page, offset=(page - 1) * per_page)
+        return jsonify(dict(success=True, page=page, per_page=per_page, **result))
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Error retrieving students without top picks: {str(e)}'
+        }), 500
+
+# Kept matching runs, newest first
+@app.route('/api/runs', methods=['GET'])
+def get_runs():
+    try:
+        from matching import list_runs, current_run_id
+        
+        limit = request.args.get('limit', type=int)
+        return jsonify({
+            'success': True,
+            'current_run_id': current_run_id(),
+            'runs': list_runs(limit)
+        })
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Error retrieving matching runs: {str(e)}'
+        }), 500
+
+# Differences between the results of two runs, by default the current run and the one published before it
+@app.route('/api/runs/compare', methods=['GET'])
+def compare_matching_runs():
+    try:
+        from matching import compare_runs, current_run_id, published_runs
+        
+        base = request.args.get('base', type=int)
+        other = request.args.get('other', type=int)
+        if other is None:
+            other = current_run_id()
+        if base is None and other is not None:
+            previous = published_runs().with_entities(MatchingRun.id).filter(MatchingRun.id < other).first()
+            base = previous[0] if previous else None
+        if base is None or other is None:
+            return jsonify({
+                'success': False,
+                'error': 'Two matching runs are needed for a comparison'
+            }), 400
+        
+        result = compare_runs(base, other, request.args.get('limit', type=int))
+        if "error" in result:
+            return jsonify({
+                'success': False,
+                'error': result["error"]
+            }), 404
+        return jsonify(dict(success=True, **result))
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Error comparing matching runs: {str(e)}'
+        }), 500
+
 # New endpoint to check for the existence of config data
 @app.route('/api/config/check', methods=['GET'])
 def check_config():
@@ -980,42 +1139,80 @@ def check_preferences():
     except Exception as e:
         return jsonify({'exists': False, 'error': str(e)})
 
+# New endpoint to check for the existence of matching results (of the current run)
+@app.route('/api/results/check', methods=['GET'])
+def check_results():
+    try:
+        from matching import current_results
+        
+        result = current_results().first()
+        return jsonify({'exists': result is not None})
+    except Exception as e:
+        return jsonify({'exists': False, 'error': str(e)})
+
 # Export results endpoint
+# Columns of the results export, with the match dict key of each
+EXPORT_COLUMNS = (
+    ('Student Name', 'student_name'),
+    ('Email', 'student_email'),
+    ('School', 'school_name'),
+    ('Session', 'session_number'),
+    ('Match Score', 'preference_score')
+)
+
+# Export the results of the current matching run as an Excel workbook (the
+# default) or, with format=csv, a CSV file streamed as it is read
 @app.route('/api/results/export', methods=['GET'])
 def export_results():
     try:
-        import pandas as pd
-        from io import BytesIO
-        
-        # Get all matching results from the database
-        results = MatchingResult.query.all()
+        import csv
+        import tempfile
+        from openpyxl import Workbook
+        from matching import current_run_id, iter_run_matches
         
-        # Convert to a list of dictionaries for pandas
-        data = []
-        for result in results:
-            # Get preference score using a query
-            preference = Preference.query.filter_by(
-                student_id=result.student_id,
-                school_id=result.school_id
-            ).first()
+        export_format = request.args.get('format', 'xlsx')
+        if export_format not in ('xlsx', 'csv'):
+            return jsonify({
+                'success': False,
+                'error': "format must be 'xlsx' or 'csv'"
+            }), 400
+        
+        run_id = current_run_id()
+        if export_format == 'csv':
+            def generate():
+                # The header goes out before the first query, then a chunk per 1000 rows
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                
+                def flush():
+                    chunk = buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+                    return chunk
+                
+                writer.writerow([title for title, _ in EXPORT_COLUMNS])
+                yield flush()
+                for count, match in enumerate(iter_run_matches(run_id), 1):
+                    writer.writerow([match[key] for _, key in EXPORT_COLUMNS])
+                    if count % 1000 == 0:
+                        yield flush()
+                yield flush()
             
-            data.append({
-                'Student Name': f"{result.student.first_name} {result.student.last_name}",
-                'Email': result.student.email,
-                'School': result.school.school_name,
-                'Session': result.session_number,
-                'Match Score': preference.points if preference else 0
-            })
-        
-        # Create DataFrame
-        df = pd.DataFrame(data)
-        
-        # Create Excel file in memory
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, index=False, sheet_name='Matching Results')
+            return Response(
+                stream_with_context(generate()),
+                mimetype='text/csv',
+                headers={'Content-Disposition': 'attachment; filename=matching_results.csv'}
+            )
         
-        # Prepare the response
+        # Write-only workbooks keep rows in temporary files instead of memory; the
+        # finished workbook is spooled to disk and streamed from there
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet('Matching Results')
+        sheet.append([title for title, _ in EXPORT_COLUMNS])
+        for match in iter_run_matches(run_id):
+            sheet.append([match[key] for _, key in EXPORT_COLUMNS])
+        output = tempfile.TemporaryFile()
+        workbook.save(output)
         output.seek(0)
         
         return send_file(
@@ -1024,12 +1221,33 @@ def export_results():
             as_attachment=True,
             download_name='matching_results.xlsx'
         )
-        
+    
     except Exception as e:
         return jsonify({
             'error': f'Error exporting results: {str(e)}'
         }), 500
 
+# Zip of the current run's rosters: a workbook per school with a sheet per session,
+# built by worker processes and streamed as they finish
+@app.route('/api/results/rosters', methods=['GET'])
+def export_rosters():
+    try:
+        from matching import current_run_id, session_capacity_columns
+        from rosters import roster_bundle, school_rosters
+        
+        # Read before the response starts, so a failure is an error response and not a cut-off zip
+        rosters = school_rosters(current_run_id(), len(session_capacity_columns()))
+        return Response(
+            roster_bundle(rosters),
+            mimetype='application/zip',
+            headers={'Content-Disposition': 'attachment; filename=matching_rosters.zip'}
+        )
+    
+    except Exception as e:
+        return jsonify({
+            'error': f'Error exporting rosters: {str(e)}'
+        }), 500
+
 # Serve React frontend in production
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
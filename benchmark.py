@@ -0,0 +1,217 @@
+"""
+Benchmark the matching engines and the busiest endpoints on a synthetic cohort.
+
+Each stage records wall time, peak Python memory (tracemalloc) and the number of
+SQL statements it ran. Every run is appended to a JSON history file and compared
+with the previous run on the same cohort, so regressions show up before an event.
+
+    python benchmark.py --preset medium
+    python benchmark.py --students 2000 --schools 40 --skew 1.3 --stages run_matching_algorithm,api_analytics
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+from synthetic import COHORT_PRESETS, generate_cohort, populate_database, preferences_grid
+
+DEFAULT_HISTORY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_history.json')
+
+# Stages in the order they run
+STAGES = (
+    'generate',
+    'populate',
+    'preferences_save',
+    'run_matching_algorithm',
+    'api_results',
+    'api_analytics',
+    'run_simple_matching_algorithm'
+)
+
+def measure(query_count, function, *args, **kwargs):
+    """
+    Call `function` and return its result with the wall time, peak memory and
+    number of SQL statements of the call. `query_count` returns the number of
+    statements run so far.
+    """
+    tracemalloc.reset_peak()
+    memory_before = tracemalloc.get_traced_memory()[0]
+    queries_before = query_count()
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    seconds = time.perf_counter() - start
+    return result, {
+        'seconds': seconds,
+        'peak_memory_bytes': tracemalloc.get_traced_memory()[1] - memory_before,
+        'queries': query_count() - queries_before
+    }
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def run_benchmark(cohort_options, stages=STAGES, save_students=500):
+    """
+    Generate the cohort, load it into the configured database and run `stages`.
+    The database must be empty or disposable: its contents are replaced.
+    Returns the stage records.
+    """
+    from sqlalchemy import event
+    from app import app, db
+    from matching import run_matching_algorithm, run_simple_matching_algorithm
+    
+    records = {}
+    counter = {'queries': 0}
+    
+    def count_query(*args):
+        counter['queries'] += 1
+    
+    tracemalloc.start()
+    try:
+        with app.app_context():
+            db.create_all()
+            event.listen(db.engine, 'before_cursor_execute', count_query)
+            query_count = lambda: counter['queries']
+            client = app.test_client()
+            
+            cohort, records['generate'] = measure(query_count, generate_cohort, **cohort_options)
+            records['generate']['items'] = int(cohort['points'].size)
+            _, records['populate'] = measure(query_count, populate_database, cohort)
+            records['populate']['items'] = int(cohort['points'].size)
+            
+            if 'preferences_save' in stages:
+                grid = preferences_grid(cohort, save_students)
+                response, records['preferences_save'] = measure(
+                    query_count, client.post, '/api/preferences/save', json={'data': grid}
+                )
+                records['preferences_save'].update(status=response.status_code, items=len(grid))
+            
+            for name, algorithm in (('run_matching_algorithm', run_matching_algorithm),
+                                    ('run_simple_matching_algorithm', run_simple_matching_algorithm)):
+                if name not in stages:
+                    continue
+                result, records[name] = measure(query_count, algorithm, seed=cohort_options.get('seed', 0))
+                records[name]['items'] = len(result.get('matches', []))
+                
+                # Read the endpoints against the improved matching results
+                if name == 'run_matching_algorithm':
+                    for stage, url in (('api_results', '/api/results'), ('api_analytics', '/api/analytics')):
+                        if stage in stages:
+                            response, records[stage] = measure(query_count, client.get, url)
+                            records[stage].update(status=response.status_code, bytes=len(response.data))
+            
+            event.remove(db.engine, 'before_cursor_execute', count_query)
+    finally:
+        tracemalloc.stop()
+    
+    return {stage: records[stage] for stage in STAGES if stage in records}
+
+def load_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as history_file:
+        return json.load(history_file)
+
+def compare(previous, current, threshold, min_seconds=0.05):
+    """
+    Print each stage next to the previous run on the same cohort and return the
+    stages that got slower by more than `threshold` (a fraction) and by at least
+    `min_seconds`, so timer noise on tiny stages is not reported
+    """
+    regressions = []
+    print(f"{'stage':32} {'seconds':>10} {'previous':>10} {'change':>8} {'peak MB':>9} {'queries':>9}")
+    for stage, record in current.items():
+        before = (previous or {}).get(stage)
+        change = ''
+        if before and before['seconds'] > 0:
+            ratio = record['seconds'] / before['seconds'] - 1
+            change = f'{ratio:+.0%}'
+            if ratio > threshold and record['seconds'] - before['seconds'] >= min_seconds:
+                regressions.append(stage)
+                change += ' !'
+        print(f"{stage:32} {record['seconds']:10.3f} {before['seconds'] if before else float('nan'):10.3f} "
+              f"{change:>8} {record['peak_memory_bytes'] / 2 ** 20:9.1f} {record['queries']:9d}")
+    return regressions
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark MatchWZRD on a synthetic cohort.')
+    parser.add_argument('--preset', choices=sorted(COHORT_PRESETS), default='small')
+    parser.add_argument('--students', type=int, help='number of students (overrides the preset)')
+    parser.add_argument('--schools', type=int, help='number of schools (overrides the preset)')
+    parser.add_argument('--picks', type=int, default=12, help='schools each student gives points to')
+    parser.add_argument('--skew', type=float, default=1.1, help='Zipf exponent of school popularity')
+    parser.add_argument('--seat-ratio', type=float, default=1.1, help='seats per student in each session')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--stages', default=','.join(STAGES), help='comma-separated stages to run')
+    parser.add_argument('--save-students', type=int, default=500,
+                        help='students posted to /api/preferences/save (it runs a query per cell)')
+    parser.add_argument('--database-url', help='database to benchmark against (a temporary SQLite file by default)')
+    parser.add_argument('--history', default=DEFAULT_HISTORY_PATH, help='JSON history file to append to')
+    parser.add_argument('--threshold', type=float, default=0.2, help='slowdown that counts as a regression')
+    parser.add_argument('--min-seconds', type=float, default=0.05, help='smallest slowdown that counts as a regression')
+    parser.add_argument('--fail-on-regression', action='store_true', help='exit with status 1 on a regression')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    stages = [stage.strip() for stage in args.stages.split(',') if stage.strip()]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        print(f"Unknown stages: {', '.join(sorted(unknown))}", file=sys.stderr)
+        return 2
+    
+    cohort_options = dict(COHORT_PRESETS[args.preset])
+    if args.students:
+        cohort_options['n_students'] = args.students
+    if args.schools:
+        cohort_options['n_schools'] = args.schools
+    cohort_options.update(picks=args.picks, skew=args.skew, seat_ratio=args.seat_ratio, seed=args.seed)
+    
+    # The app reads DATABASE_URL when it is imported, so set it first
+    database_file = None
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+    else:
+        handle, database_file = tempfile.mkstemp(suffix='.db', prefix='matchwzrd-benchmark-')
+        os.close(handle)
+        os.environ['DATABASE_URL'] = f'sqlite:///{database_file}'
+    
+    try:
+        records = run_benchmark(cohort_options, stages, args.save_students)
+    finally:
+        if database_file:
+            os.remove(database_file)
+    
+    history = load_history(args.history)
+    previous = next((run['stages'] for run in reversed(history) if run['cohort'] == cohort_options), None)
+    regressions = compare(previous, records, args.threshold, args.min_seconds)
+    for stage, record in records.items():
+        if record.get('status', 200) >= 400:
+            print(f"{stage} returned HTTP {record['status']}, its timing is not comparable")
+    
+    history.append({
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'commit': git_commit(),
+        'python': sys.version.split()[0],
+        'cohort': cohort_options,
+        'stages': records
+    })
+    with open(args.history, 'w') as history_file:
+        json.dump(history, history_file, indent=2)
+    
+    if regressions:
+        print(f"Slower than the previous run by more than {args.threshold:.0%}: {', '.join(regressions)}")
+        if args.fail_on_regression:
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
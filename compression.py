@@ -0,0 +1,90 @@
+"""
+Compression of the JSON and text responses: br when the brotli package (or
+brotlicffi) is installed, gzip and deflate, whichever the client prefers among
+those it accepts. Bodies under COMPRESSION_MIN_SIZE bytes, streamed responses
+and files are sent as they are.
+
+The read endpoints of response_cache compress a cached body once per encoding
+and reuse it; every other response is compressed by compress_response, an
+after_request hook. Compressed responses report the size ratio and the time the
+compression took in X-Compression-Ratio and X-Compression-Time (milliseconds).
+"""
+import gzip
+import os
+import time
+import zlib
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    try:
+        import brotlicffi as brotli
+    except ImportError:
+        brotli = None
+
+# Smallest body, in bytes, worth compressing
+COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', 1024))
+
+# gzip and deflate level (1-9) and brotli quality (0-11): favour speed, the payloads are repetitive
+COMPRESSION_LEVEL = int(os.getenv('COMPRESSION_LEVEL', 6))
+BROTLI_QUALITY = int(os.getenv('BROTLI_QUALITY', 5))
+
+COMPRESSIBLE_MIMETYPES = ('application/json', 'text/csv', 'text/plain', 'text/html', 'text/css',
+                          'application/javascript')
+
+_COMPRESSORS = {
+    'gzip': lambda data: gzip.compress(data, COMPRESSION_LEVEL, mtime=0),
+    'deflate': lambda data: zlib.compress(data, COMPRESSION_LEVEL)
+}
+if brotli is not None:
+    _COMPRESSORS['br'] = lambda data: brotli.compress(data, quality=BROTLI_QUALITY)
+
+# Encodings offered, the server's preference first when the client has none
+ENCODINGS = tuple(encoding for encoding in ('br', 'gzip', 'deflate') if encoding in _COMPRESSORS)
+
+def negotiate(size, mimetype):
+    """
+    The encoding to send a `size` byte body of `mimetype` with in answer to the
+    current request, or None to send it as it is
+    """
+    if size < COMPRESSION_MIN_SIZE or mimetype not in COMPRESSIBLE_MIMETYPES:
+        return None
+    return request.accept_encodings.best_match(ENCODINGS)
+
+def compress(data, encoding):
+    """
+    `data` compressed with `encoding`, and the seconds it took
+    """
+    start = time.perf_counter()
+    compressed = _COMPRESSORS[encoding](data)
+    return compressed, time.perf_counter() - start
+
+def encode_response(response, encoding, compressed, seconds, size):
+    """
+    Give `response` the `compressed` body of its `size` byte one, with its
+    Content-Encoding, an ETag of its own and the tuning headers
+    """
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f'{etag}-{encoding}', weak)
+    response.headers['X-Compression-Ratio'] = f'{size / max(1, len(compressed)):.2f}'
+    response.headers['X-Compression-Time'] = f'{seconds * 1000:.2f}'
+    return response
+
+def compress_response(response):
+    """
+    after_request hook compressing the responses not compressed yet
+    """
+    if response.status_code != 200 or response.direct_passthrough or response.is_streamed \
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return response
+    response.vary.add('Accept-Encoding')
+    data = response.get_data()
+    encoding = negotiate(len(data), response.mimetype)
+    if encoding is None:
+        return response
+    return encode_response(response, encoding, *compress(data, encoding), len(data))
@@ -32,6 +32,11 @@ class Student(db.Model):
     email = db.Column(db.String(255), nullable=False, unique=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    # Sorting results by student name
+    __table_args__ = (
+        db.Index('ix_students_name', 'first_name', 'last_name'),
+    )
+    
     def __repr__(self):
         return f'<Student {self.first_name} {self.last_name}>'
 
@@ -43,6 +48,8 @@ class Preference(db.Model):
     student_id = db.Column(db.Integer, db.ForeignKey('students.id'), nullable=False)
     school_id = db.Column(db.Integer, db.ForeignKey('schools.id'), nullable=False)
     points = db.Column(db.Integer, nullable=False)
+    # Position in the student's preferences: 1 for the most points, ties by school id (see rank_preferences)
+    rank = db.Column(db.Integer)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Define relationships
@@ -50,29 +57,90 @@ class Preference(db.Model):
     school = db.relationship('School', backref=db.backref('preferences', lazy=True))
     
     # Ensure unique student-school combination
-    __table_args__ = (db.UniqueConstraint('student_id', 'school_id', name='unique_student_school'),)
+    __table_args__ = (
+        db.UniqueConstraint('student_id', 'school_id', name='unique_student_school'),
+        db.Index('ix_preferences_student_rank', 'student_id', 'rank')
+    )
     
     def __repr__(self):
         return f'<Preference {self.student_id} - {self.school_id}: {self.points}>'
 
+# Define the Matching Runs model: one row per matching run, referenced by its results.
+# A run is staged (published_at is NULL) while its results are written; the most
+# recently published run is the current one.
+class MatchingRun(db.Model):
+    __tablename__ = 'matching_runs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    algorithm = db.Column(db.String(50), nullable=False)
+    seed = db.Column(db.BigInteger)
+    input_hash = db.Column(db.String(64))  # SHA-256 of ids, capacities and points
+    timings = db.Column(db.JSON)
+    summary = db.Column(db.JSON)
+    analytics = db.Column(db.JSON(none_as_null=True))  # /api/analytics payload, NULL until computed
+    # Replay state of an improved matching run (.npz bytes) for rematch_incremental, only
+    # kept on the latest run that has one and loaded on access
+    greedy_state = db.deferred(db.Column(db.LargeBinary))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    published_at = db.Column(db.DateTime, index=True)
+    
+    def __repr__(self):
+        return f'<MatchingRun {self.id} {self.algorithm}>'
+
 # Define the Matching Results model
 class MatchingResult(db.Model):
     __tablename__ = 'matching_results'
     
     id = db.Column(db.Integer, primary_key=True)
+    run_id = db.Column(db.Integer, db.ForeignKey('matching_runs.id'), index=True)
     student_id = db.Column(db.Integer, db.ForeignKey('students.id'), nullable=False)
     school_id = db.Column(db.Integer, db.ForeignKey('schools.id'), nullable=False)
     session_number = db.Column(db.Integer, nullable=False)
     algorithm_used = db.Column(db.String(50), nullable=False)
+    preference_score = db.Column(db.Integer)  # Points the student gave the school when matched, 0 without a preference
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Define relationships
     student = db.relationship('Student', backref=db.backref('matching_results', lazy=True))
     school = db.relationship('School', backref=db.backref('matching_results', lazy=True))
     
+    # Filters and sorts of the results API within a run, each ending in the row id for keyset pagination
+    __table_args__ = (
+        db.Index('ix_matching_results_run_student', 'run_id', 'student_id'),
+        db.Index('ix_matching_results_run_school', 'run_id', 'school_id', 'session_number'),
+        db.Index('ix_matching_results_run_session', 'run_id', 'session_number'),
+        db.Index('ix_matching_results_run_score', 'run_id', 'preference_score')
+    )
+    
     def __repr__(self):
         return f'<MatchingResult {self.student_id} - {self.school_id} - Session {self.session_number}>'
 
+# Single-row counter of the data behind the read endpoints: every change to the
+# schools, preferences or published matching runs increments it (bump_data_version)
+class DataVersion(db.Model):
+    __tablename__ = 'data_version'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<DataVersion {self.version}>'
+
+def data_version():
+    """
+    The current data version, 0 before the first change
+    """
+    return db.session.query(DataVersion.version).scalar() or 0
+
+def bump_data_version():
+    """
+    Increment the data version, invalidating the cached responses and ETags of the
+    read endpoints. Part of the caller's transaction: it commits along with the change.
+    """
+    table = DataVersion.__table__
+    if not db.session.execute(table.update().values(version=table.c.version + 1)).rowcount:
+        db.session.execute(table.insert().values(id=1, version=1))
+
 # Function to initialize the database
 def init_db(app):
     # Initialize the database with the app
@@ -85,4 +153,108 @@ def init_db(app):
     
     # Create all tables
     with app.app_context():
-        db.create_all() 
\ No newline at end of file
+        db.create_all()
+        upgrade_schema()
+
+def upgrade_schema():
+    """
+    Bring tables created by earlier versions up to date (create_all only adds
+    missing tables): add matching_results.run_id with its index,
+    matching_runs.published_at (runs recorded before it are published),
+    matching_runs.analytics and matching_runs.greedy_state, preferences.rank with its index (then ranked) and
+    matching_results.preference_score (then filled in), create the indexes of the
+    results API, and file result rows from before runs were recorded under one
+    published run. Must run inside an app context.
+    """
+    columns = [column['name'] for column in db.inspect(db.engine).get_columns('preferences')]
+    if 'rank' not in columns:
+        db.session.execute(db.text('ALTER TABLE preferences ADD COLUMN rank INTEGER'))
+        db.session.execute(db.text('CREATE INDEX ix_preferences_student_rank ON preferences (student_id, rank)'))
+        rank_preferences()
+        db.session.commit()
+    
+    columns = [column['name'] for column in db.inspect(db.engine).get_columns('matching_runs')]
+    if 'published_at' not in columns:
+        db.session.execute(db.text('ALTER TABLE matching_runs ADD COLUMN published_at DATETIME'))
+        db.session.execute(db.text('CREATE INDEX ix_matching_runs_published_at ON matching_runs (published_at)'))
+        db.session.execute(db.text('UPDATE matching_runs SET published_at = created_at'))
+        db.session.commit()
+    if 'analytics' not in columns:
+        db.session.execute(db.text('ALTER TABLE matching_runs ADD COLUMN analytics JSON'))
+        db.session.commit()
+    if 'greedy_state' not in columns:
+        db.session.execute(db.text('ALTER TABLE matching_runs ADD COLUMN greedy_state BLOB'))
+        db.session.commit()
+    
+    columns = [column['name'] for column in db.inspect(db.engine).get_columns('matching_results')]
+    if 'run_id' not in columns:
+        db.session.execute(db.text('ALTER TABLE matching_results ADD COLUMN run_id INTEGER REFERENCES matching_runs (id)'))
+        db.session.execute(db.text('CREATE INDEX ix_matching_results_run_id ON matching_results (run_id)'))
+        db.session.commit()
+    if 'preference_score' not in columns:
+        db.session.execute(db.text('ALTER TABLE matching_results ADD COLUMN preference_score INTEGER'))
+        fill_preference_scores()
+        db.session.commit()
+    
+    # Indexes declared on existing tables
+    for table in (Student.__table__, MatchingResult.__table__):
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+    
+    unfiled = MatchingResult.query.filter(MatchingResult.run_id.is_(None))
+    first = unfiled.first()
+    if first is not None:
+        run = MatchingRun(algorithm=first.algorithm_used.replace('_fallback', ''), summary={'rows': unfiled.count()},
+                          published_at=datetime.utcnow())
+        db.session.add(run)
+        db.session.flush()
+        unfiled.update({MatchingResult.run_id: run.id}, synchronize_session=False)
+        db.session.commit() 
+
+# Largest number of student ids per statement of rank_preferences and fill_preference_scores
+STUDENT_BATCH_SIZE = 500
+
+def rank_preferences(student_ids=None):
+    """
+    Recompute Preference.rank of the given students (all by default) in bulk,
+    one UPDATE ... FROM per batch of students over a ROW_NUMBER window: 1 for
+    the most points, ties broken by ascending school id. Pending changes are
+    flushed first; the caller commits.
+    """
+    db.session.flush()
+    table = Preference.__table__
+    if student_ids is None:
+        batches = [None]
+    else:
+        student_ids = sorted(set(student_ids))
+        batches = [student_ids[offset:offset + STUDENT_BATCH_SIZE] for offset in range(0, len(student_ids), STUDENT_BATCH_SIZE)]
+    rank = db.func.row_number().over(partition_by=table.c.student_id, order_by=(table.c.points.desc(), table.c.school_id))
+    for batch in batches:
+        ranked = db.select(table.c.id, rank.label('rank'))
+        if batch is not None:
+            ranked = ranked.where(table.c.student_id.in_(batch))
+        ranked = ranked.subquery()
+        db.session.execute(table.update().where(table.c.id == ranked.c.id).values(rank=ranked.c.rank))
+
+def fill_preference_scores(run_id=None, student_ids=None):
+    """
+    Set MatchingResult.preference_score from the preferences, 0 where there is
+    none, for the results of run `run_id` (of all runs by default) that have no
+    score yet, and for all of them of the students in `student_ids`, whose
+    points changed. Scores are a snapshot taken when the run is written, so
+    published runs only get the ones they lack. One correlated UPDATE per batch
+    of students; the caller commits.
+    """
+    table = MatchingResult.__table__
+    points = db.select(Preference.points).where(
+        Preference.student_id == table.c.student_id, Preference.school_id == table.c.school_id
+    ).scalar_subquery()
+    student_ids = sorted(set(student_ids or ()))
+    batches = [student_ids[offset:offset + STUDENT_BATCH_SIZE] for offset in range(0, len(student_ids), STUDENT_BATCH_SIZE)]
+    for batch in batches or [[]]:
+        condition = table.c.preference_score.is_(None)
+        if batch:
+            condition = condition | table.c.student_id.in_(batch)
+        if run_id is not None:
+            condition = (table.c.run_id == run_id) & condition
+        db.session.execute(table.update().where(condition).values(preference_score=db.func.coalesce(points, 0)))
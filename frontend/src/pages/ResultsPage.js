@@ -4,6 +4,9 @@ import { useNavigate } from 'react-router-dom';
 
 const ResultsPage = () => {
   const [matches, setMatches] = useState([]);
+  const [totalMatches, setTotalMatches] = useState(0);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [resultsUrl, setResultsUrl] = useState('/api/results');
   const [hasConfig, setHasConfig] = useState(false);
   const [hasPreferences, setHasPreferences] = useState(false);
   const [isLoading, setIsLoading] = useState(false);
@@ -32,6 +35,34 @@ const ResultsPage = () => {
     checkData();
   }, []);
 
+  // Load the first page of results from `url`, or the next one after `cursor`
+  const loadResults = async (url, cursor = null) => {
+    const separator = url.includes('?') ? '&' : '?';
+    const response = await fetch(cursor ? `${url}${separator}cursor=${encodeURIComponent(cursor)}` : url);
+    const data = await response.json();
+    if (!data.success) {
+      throw new Error(data.error || 'Failed to load results');
+    }
+    if (cursor) {
+      setMatches((previous) => [...previous, ...data.matches]);
+    } else {
+      setMatches(data.matches);
+      setTotalMatches(data.total);
+      setResultsUrl(url);
+    }
+    setNextCursor(data.next_cursor);
+    return data;
+  };
+
+  const handleLoadMore = async () => {
+    try {
+      await loadResults(resultsUrl, nextCursor);
+    } catch (error) {
+      console.error('Error loading results:', error);
+      alert(`Error loading results: ${error.message}`);
+    }
+  };
+
   useEffect(() => {
     const checkAndLoadResults = async () => {
       try {
@@ -40,15 +71,9 @@ const ResultsPage = () => {
         const checkData = await checkResponse.json();
         
         if (checkData.exists) {
-          // If results exist, load them
-          const response = await fetch('/api/results');
-          const data = await response.json();
-          if (data.success && data.matches && data.matches.length > 0) {
-            setMatches(data.matches);
-            setShowResults(true);
-          } else {
-            setShowResults(false);
-          }
+          // If results exist, load the first page
+          const data = await loadResults('/api/results');
+          setShowResults(data.matches.length > 0);
         } else {
           setShowResults(false);
         }
@@ -72,8 +97,8 @@ const ResultsPage = () => {
       console.log("Received response:", data);
       
       if (data.success) {
-        console.log("Processing successful, setting matches:", data.matches);
-        setMatches(data.matches);
+        // The response only references the new run, its matches are paged through results_url
+        await loadResults(data.results_url);
         setShowResults(true);
       } else {
         console.error('Error processing preferences:', data.error);
@@ -86,9 +111,9 @@ const ResultsPage = () => {
     setIsLoading(false);
   };
 
-  const handleExport = async () => {
+  const handleExport = async (url, filename) => {
     try {
-      const response = await fetch('/api/results/export');
+      const response = await fetch(url);
       
       if (!response.ok) {
         const errorData = await response.json();
@@ -99,12 +124,12 @@ const ResultsPage = () => {
       const blob = await response.blob();
       
       // Create a URL for the blob
-      const url = window.URL.createObjectURL(blob);
+      const blobUrl = window.URL.createObjectURL(blob);
       
       // Create a temporary link element
       const link = document.createElement('a');
-      link.href = url;
-      link.download = 'matching_results.xlsx';
+      link.href = blobUrl;
+      link.download = filename;
       
       // Append to body, click, and remove
       document.body.appendChild(link);
@@ -112,7 +137,7 @@ const ResultsPage = () => {
       document.body.removeChild(link);
       
       // Clean up the URL
-      window.URL.revokeObjectURL(url);
+      window.URL.revokeObjectURL(blobUrl);
     } catch (error) {
       console.error('Error exporting results:', error);
       alert(`Error exporting results: ${error.message}`);
@@ -170,13 +195,29 @@ const ResultsPage = () => {
                     {isLoading ? 'Processing...' : 'Process Preferences'}
                   </Button>
                   {showResults && matches.length > 0 && (
-                    <Button 
-                      variant="contained" 
-                      color="secondary" 
-                      onClick={handleExport}
-                    >
-                      Export Results (Excel)
-                    </Button>
+                    <>
+                      <Button 
+                        variant="contained" 
+                        color="secondary" 
+                        onClick={() => handleExport('/api/results/export', 'matching_results.xlsx')}
+                      >
+                        Export Results (Excel)
+                      </Button>
+                      <Button 
+                        variant="outlined" 
+                        color="secondary" 
+                        onClick={() => handleExport('/api/results/export?format=csv', 'matching_results.csv')}
+                      >
+                        Export Results (CSV)
+                      </Button>
+                      <Button 
+                        variant="outlined" 
+                        color="secondary" 
+                        onClick={() => handleExport('/api/results/rosters', 'matching_rosters.zip')}
+                      >
+                        Export Rosters (Zip)
+                      </Button>
+                    </>
                   )}
                 </Box>
                 {showResults && matches.length > 0 && (
@@ -205,6 +246,16 @@ const ResultsPage = () => {
                         </TableBody>
                       </Table>
                     </TableContainer>
+                    <Box sx={{ display: 'flex', justifyContent: 'center', alignItems: 'center', gap: 2, mt: 2 }}>
+                      <Typography variant="body2">
+                        Showing {matches.length} of {totalMatches} matches
+                      </Typography>
+                      {nextCursor && (
+                        <Button variant="outlined" onClick={handleLoadMore}>
+                          Load More
+                        </Button>
+                      )}
+                    </Box>
                   </>
                 )}
               </Grid>
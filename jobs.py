@@ -0,0 +1,156 @@
+"""
+Background jobs on a small in-process worker pool, so long matching runs do not
+hold a request (and a web worker) open. There is no external broker: jobs live in
+this process and are lost when it restarts.
+
+A job runs a function that records its phases in a timings dict as they finish
+({phase: {'seconds', 'items'}}, as the matching functions do). Given the phases
+the job is expected to go through, and how long each took last time, the job
+status reports the current phase, percent complete and an ETA.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+# Jobs run one at a time by default: each matching run loads and writes the whole cohort
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', 1))
+
+# Number of jobs kept for status queries, oldest finished ones are dropped first
+JOB_HISTORY = int(os.getenv('JOB_HISTORY', 100))
+
+_executor = None
+_jobs = OrderedDict()
+_jobs_lock = threading.Lock()
+
+def _pool():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix='job')
+    return _executor
+
+def submit_job(app, function, phases, expected_seconds=None, **details):
+    """
+    Queue `function(timings)` to run inside an app context of `app` and return
+    the job id. `phases` lists the phases it records in order, `expected_seconds`
+    maps them to the seconds each took in a previous run (None when unknown), and
+    `details` are reported with the job status. The function's return value
+    becomes the job result, an exception fails the job.
+    """
+    job = {
+        'id': uuid.uuid4().hex,
+        'state': 'queued',
+        'details': details,
+        'phases': list(phases),
+        'expected_seconds': expected_seconds,
+        'timings': {},
+        'submitted_at': datetime.utcnow().isoformat(),
+        'started_at': None,
+        'finished_at': None,
+        'started': None,
+        'result': None,
+        'error': None
+    }
+    with _jobs_lock:
+        _jobs[job['id']] = job
+        _forget_old_jobs()
+    _pool().submit(_run_job, app, job, function)
+    return job['id']
+
+def _forget_old_jobs():
+    finished = [job_id for job_id, job in _jobs.items() if job['state'] in ('finished', 'failed')]
+    for job_id in finished[:max(0, len(_jobs) - JOB_HISTORY)]:
+        del _jobs[job_id]
+
+def _run_job(app, job, function):
+    job['started'] = time.perf_counter()
+    job['started_at'] = datetime.utcnow().isoformat()
+    job['state'] = 'running'
+    try:
+        with app.app_context():
+            result = function(job['timings'])
+        job['result'] = result
+        job['state'] = 'finished'
+    except Exception as e:
+        job['error'] = str(e)
+        job['state'] = 'failed'
+    job['finished_at'] = datetime.utcnow().isoformat()
+
+def _progress(job):
+    """
+    Current phase, percent complete and seconds left of a running job. Phases are
+    weighted by the seconds they took last time, or equally when that is unknown
+    (no ETA then), and the phase in progress counts by the time spent in it.
+    """
+    timings = job['timings'].copy()
+    phases = job['phases']
+    known = bool(job['expected_seconds'])
+    weights = job['expected_seconds'] if known else {phase: 1 for phase in phases}
+    done = [phase for phase in phases if phase in timings]
+    current = next((phase for phase in phases if phase not in timings), None)
+    later = [phase for phase in phases if phase not in timings and phase != current]
+    
+    elapsed = time.perf_counter() - job['started']
+    in_phase = max(0, elapsed - sum(entry['seconds'] for phase, entry in timings.items() if phase != 'total'))
+    total = sum(weights.get(phase, 0) for phase in phases)
+    current_share = min(in_phase, weights.get(current, 0)) if known else 0
+    percent = 100 * (sum(weights.get(phase, 0) for phase in done) + current_share) / total if total > 0 else 0
+    
+    eta = None
+    if known:
+        eta = sum(weights.get(phase, 0) for phase in later) + max(0, weights.get(current, 0) - in_phase)
+    return current or 'finishing', min(percent, 99), eta
+
+def job_status(job_id):
+    """
+    Status of a job: its state (queued, running, finished or failed), phase,
+    percent complete, ETA in seconds (None when unknown), timings so far, and the
+    result or error once it is done. None for an unknown job id.
+    """
+    job = _jobs.get(job_id)
+    if job is None:
+        return None
+    
+    status = {
+        'id': job['id'],
+        'state': job['state'],
+        'submitted_at': job['submitted_at'],
+        'started_at': job['started_at'],
+        'finished_at': job['finished_at'],
+        'timings': job['timings'].copy(),
+        'result': job['result'],
+        'error': job['error']
+    }
+    status.update(job['details'])
+    if job['state'] == 'queued':
+        status.update(phase='queued', percent=0, eta_seconds=None)
+    elif job['state'] == 'running':
+        phase, percent, eta = _progress(job)
+        status.update(phase=phase, percent=percent, eta_seconds=eta)
+    else:
+        status.update(phase=job['state'], percent=100 if job['state'] == 'finished' else None, eta_seconds=0)
+    return status
+
+def job_events(job_id, interval=0.5):
+    """
+    Server-sent events stream of a job's status: one event whenever the state,
+    phase or percent changes, ending once the job is done
+    """
+    last = None
+    while True:
+        status = job_status(job_id)
+        if status is None:
+            yield f"event: error\ndata: {json.dumps({'error': 'Unknown job'})}\n\n"
+            return
+        
+        key = (status['state'], status['phase'], round(status['percent'] or 0))
+        if key != last:
+            last = key
+            yield f"data: {json.dumps(status, default=str)}\n\n"
+        if status['state'] in ('finished', 'failed'):
+            return
+        time.sleep(interval)
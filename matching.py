@@ -1,20 +1,97 @@
 import pandas as pd
 import numpy as np
-from database import Student, School, Preference, MatchingResult
-from app import db
-import random
+from database import (
+    db, Student, School, Preference, MatchingRun, MatchingResult, rank_preferences, fill_preference_scores,
+    bump_data_version
+)
+from matching_core import (
+    LOTTERY_WELFARE_METRICS, DEFAULT_SIMPLE_TOP_K, DEFAULT_ILP_TIME_LIMIT, DEFAULT_ILP_GAP_TOLERANCE, new_seed, record_phase,
+    draw_tiebreakers, points_matrix, replay_assignments, assign_bids, finish_greedy, solve_improved, solve_simple,
+    solve_ilp, solve_flow, solve_lottery, rematch_greedy, save_greedy_state, load_greedy_state, inputs_hash,
+    greedy_inputs_hash
+)
+from analytics import solution_analytics, clear_analytics
+from sqlalchemy import literal, select
+from collections import deque
+from datetime import datetime, timedelta
+import base64
+import io
+import json
+import os
+import time
 
-def run_matching_algorithm():
+# Number of MatchingResult rows sent per executemany batch
+DEFAULT_PERSIST_CHUNK_SIZE = 5000
+
+# Timings of the most recent matching runs, newest last, for /api/metrics/matching
+MATCHING_METRICS_HISTORY = int(os.getenv('MATCHING_METRICS_HISTORY', 50))
+recent_matching_runs = deque(maxlen=MATCHING_METRICS_HISTORY)
+
+# Greedy state of the last improved matching run read or written by this process, with
+# the database and run it belongs to. The state itself is stored with its run
+# (MatchingRun.greedy_state), so other processes (update_school.py) can use it.
+_greedy_run = None
+
+# Largest number of ids sent in one IN (...) clause
+ID_BATCH_SIZE = 500
+
+# Results read per query by iter_run_matches (exports)
+EXPORT_BATCH_SIZE = 5000
+
+# Number of published matching runs (with their results) kept in the database
+MATCHING_RUN_RETENTION = int(os.getenv('MATCHING_RUN_RETENTION', 10))
+
+# Hours after which a run still staged is taken as abandoned (its process died) and deleted
+STAGED_RUN_EXPIRY_HOURS = float(os.getenv('STAGED_RUN_EXPIRY_HOURS', 24))
+
+def load_points_matrix(students, schools):
     """
-    Improved matching algorithm that:
-    1. Creates a sorted list of all bids with random tiebreakers
-    2. Includes ALL student preferences (not just top 6)
-    3. Processes bids in order, assigning students to sessions based on capacity
-    4. Ensures every student gets exactly 6 sessions
+    Load all preferences as a dense students x schools matrix of points.
+    Rows follow the order of `students`, columns the order of `schools`.
     """
-    # Get all data from database
+    rows = db.session.query(Preference.student_id, Preference.school_id, Preference.points).all()
+    # Plain tuples: numpy converts SQLAlchemy rows through a slow per-key fallback
+    rows = [tuple(row) for row in rows]
+    return points_matrix([student.id for student in students], [school.id for school in schools], rows)
+
+def _load_inputs(timings, with_points=True):
+    """
+    Load students, schools, the points matrix (unless `with_points` is off) and
+    the capacity matrix, recording the 'load' phase
+    """
+    start = time.perf_counter()
     students = Student.query.all()
     schools = School.query.all()
+    points = load_points_matrix(students, schools) if with_points else None
+    capacity = load_capacity_matrix(schools)
+    record_phase(timings, 'load', start, len(students) * len(schools))
+    return students, schools, points, capacity
+
+def session_capacity_columns():
+    """
+    Names of the School capacity columns in session order (session1_capacity, ...)
+    """
+    columns = []
+    while hasattr(School, f'session{len(columns) + 1}_capacity'):
+        columns.append(f'session{len(columns) + 1}_capacity')
+    return columns
+
+def load_capacity_matrix(schools):
+    """
+    Build a schools x sessions matrix of capacities. Column t holds session t + 1.
+    """
+    columns = session_capacity_columns()
+    capacity = np.zeros((len(schools), len(columns)), dtype=np.int64)
+    for j, school in enumerate(schools):
+        capacity[j] = [getattr(school, column) or 0 for column in columns]
+    return capacity
+
+def _build_bid_dicts(students, schools, tiebreakers, timings=None):
+    """
+    Build and sort one dict per bid (the original bid representation), recording
+    the 'bids' and 'sort' phases in `timings`
+    """
+    start = time.perf_counter()
     preferences = Preference.query.all()
     
     # Create a dictionary to store student preferences for each school
@@ -24,138 +101,91 @@ def run_matching_algorithm():
             student_preferences[pref.student_id] = {}
         student_preferences[pref.student_id][pref.school_id] = pref.points
     
-    # Create a dictionary to map school IDs to their session capacities
-    school_capacities = {}
-    for school in schools:
-        school_capacities[school.id] = {
-            1: school.session1_capacity,
-            2: school.session2_capacity,
-            3: school.session3_capacity,
-            4: school.session4_capacity,
-            5: school.session5_capacity,
-            6: school.session6_capacity
-        }
-    
-    # Step 1: Create a list of ALL bids with random tiebreakers
+    # Create a list of ALL bids with random tiebreakers
     all_bids = []
-    for student in students:
-        for school in schools:
+    for i, student in enumerate(students):
+        for j, school in enumerate(schools):
             points = student_preferences.get(student.id, {}).get(school.id, 0)
             if points > 0:  # Only include non-zero bids
-                # Add random tiebreaker between 0 and 1
                 all_bids.append({
+                    'student_index': i,
                     'student_id': student.id,
                     'student_name': f"{student.first_name} {student.last_name}",
+                    'school_index': j,
                     'school_id': school.id,
                     'school_name': school.school_name,
                     'points': points,
-                    'tiebreaker': random.random()
+                    'tiebreaker': tiebreakers[i, j]
                 })
     
+    start = record_phase(timings, 'bids', start, len(all_bids))
+    
     # Sort bids by points (descending) and then by tiebreaker (ascending)
     all_bids.sort(key=lambda x: (-x['points'], x['tiebreaker']))
-    
-    # Step 2: Process ALL bids in order and assign to sessions
+    record_phase(timings, 'sort', start, len(all_bids))
+    return all_bids
+
+def _matches_from_assignments(students, schools, assignments):
+    """
+    Output stage: turn (student index, school index, session index, points) tuples
+    back into ids and names
+    """
     matches = []
-    session_assignments = {}  # Track which students are assigned to which sessions
-    
-    for bid in all_bids:
-        student_id = bid['student_id']
-        school_id = bid['school_id']
-        
-        # Skip if student already has 6 sessions assigned
-        if student_id in session_assignments and len(session_assignments[student_id]) >= 6:
-            continue
-        
-        # Try to assign to each session in order
-        for session_num in range(1, 7):
-            # Skip if student already has this session assigned
-            if student_id in session_assignments and session_num in session_assignments[student_id]:
-                continue
-            
-            # Check if school has capacity in this session
-            if school_capacities[school_id][session_num] > 0:
-                # Create match
-                match = {
-                    'student_id': student_id,
-                    'student_name': bid['student_name'],
-                    'school_id': school_id,
-                    'school_name': bid['school_name'],
-                    'session_number': session_num,
-                    'preference_score': bid['points']
-                }
-                matches.append(match)
-                
-                # Update capacities and assignments
-                school_capacities[school_id][session_num] -= 1
-                if student_id not in session_assignments:
-                    session_assignments[student_id] = set()
-                session_assignments[student_id].add(session_num)
-                
-                # Create Match object in database
-                db_match = MatchingResult(
-                    student_id=student_id,
-                    school_id=school_id,
-                    session_number=session_num,
-                    algorithm_used='improved_matching'
-                )
-                db.session.add(db_match)
-                break
-    
-    # Step 3: Ensure every student has exactly 6 sessions
-    for student in students:
-        student_id = student.id
-        student_sessions = session_assignments.get(student_id, set())
-        
-        # If student doesn't have 6 sessions, fill remaining slots
-        while len(student_sessions) < 6:
-            # Find the next available session number
-            for session_num in range(1, 7):
-                if session_num not in student_sessions:
-                    # Find any school with capacity in this session
-                    assigned = False
-                    for school in schools:
-                        if school_capacities[school.id][session_num] > 0:
-                            # Create fallback match
-                            match = {
-                                'student_id': student_id,
-                                'student_name': f"{student.first_name} {student.last_name}",
-                                'school_id': school.id,
-                                'school_name': school.school_name,
-                                'session_number': session_num,
-                                'preference_score': 0  # Fallback assignment
-                            }
-                            matches.append(match)
-                            
-                            # Update capacities and assignments
-                            school_capacities[school.id][session_num] -= 1
-                            student_sessions.add(session_num)
-                            
-                            # Create Match object in database
-                            db_match = MatchingResult(
-                                student_id=student_id,
-                                school_id=school.id,
-                                session_number=session_num,
-                                algorithm_used='improved_matching_fallback'
-                            )
-                            db.session.add(db_match)
-                            assigned = True
-                            break
-                    
-                    if assigned:
-                        break
-                    else:
-                        # If no school has capacity in this session, we have a problem
-                        print(f"WARNING: No capacity available for student {student_id} in session {session_num}")
-                        # Continue to next session number
-                        continue
-    
-    # Commit changes to database
+    for i, j, t, points in assignments:
+        student = students[i]
+        school = schools[j]
+        matches.append({
+            'student_id': student.id,
+            'student_name': f"{student.first_name} {student.last_name}",
+            'school_id': school.id,
+            'school_name': school.school_name,
+            'session_number': t + 1,
+            'preference_score': points
+        })
+    return matches
+
+def _result_rows(matches, algorithm_used, run_id):
+    """
+    MatchingResult column mappings for a list of matches of run `run_id`
+    """
+    return [
+        {
+            'run_id': run_id,
+            'student_id': match['student_id'],
+            'school_id': match['school_id'],
+            'session_number': match['session_number'],
+            'algorithm_used': algorithm_used,
+            'preference_score': match['preference_score']
+        }
+        for match in matches
+    ]
+
+def persist_result_rows(rows, chunk_size=DEFAULT_PERSIST_CHUNK_SIZE):
+    """
+    Write MatchingResult rows with one batched (executemany) insert per chunk of
+    `chunk_size` rows, bypassing the ORM unit of work, and commit.
+    Returns the write statistics.
+    """
+    chunk_size = max(1, int(chunk_size))
+    start = time.perf_counter()
+    insert = MatchingResult.__table__.insert()
+    for offset in range(0, len(rows), chunk_size):
+        db.session.execute(insert, rows[offset:offset + chunk_size])
     db.session.commit()
+    seconds = time.perf_counter() - start
     
-    # Calculate statistics
+    return {
+        'rows_written': len(rows),
+        'chunk_size': chunk_size,
+        'seconds': seconds,
+        'rows_per_second': len(rows) / seconds if seconds > 0 else 0
+    }
+
+def _matching_statistics(students, schools, matches, matched_students, capacity):
+    """
+    Summary statistics shared by the matching algorithms
+    """
     total_students = len(students)
-    matched_students = len(session_assignments)
     unmatched_students = total_students - matched_students
     
     # Calculate average preference score
@@ -165,10 +195,13 @@ def run_matching_algorithm():
         avg_preference = 0
     
     # Calculate fill rates for each school
+    filled = {}
+    for match in matches:
+        filled[match['school_id']] = filled.get(match['school_id'], 0) + 1
     school_fill_rates = []
-    for school in schools:
-        total_capacity = sum(school_capacities[school.id][session_num] for session_num in range(1, 7))
-        filled_slots = sum(1 for match in matches if match['school_id'] == school.id)
+    for j, school in enumerate(schools):
+        total_capacity = int(capacity[j].sum())
+        filled_slots = filled.get(school.id, 0)
         fill_rate = filled_slots / total_capacity if total_capacity > 0 else 0
         school_fill_rates.append({
             'school_id': school.id,
@@ -176,15 +209,756 @@ def run_matching_algorithm():
             'fill_rate': fill_rate
         })
     
+    return {
+        'total_students': total_students,
+        'matched_students': matched_students,
+        'unmatched_students': unmatched_students,
+        'average_preference_score': avg_preference,
+        'school_fill_rates': school_fill_rates
+    }
+
+def _inputs_hash(student_ids, school_ids, points, capacity):
+    """
+    matching_core.inputs_hash of the loaded inputs, None without a points matrix
+    (the python bid engine)
+    """
+    if points is None:
+        return None
+    return inputs_hash(points, capacity, student_ids, school_ids)
+
+def _fallback_points(students, schools, fallback, points=None):
+    """
+    The points each student of the (student index, school index, session index)
+    `fallback` fills gave its school, 0 without a preference: from the `points`
+    matrix, or read per batch of students without one (the python bid engine)
+    """
+    if points is not None:
+        return [int(points[i, j]) for i, j, _ in fallback]
+    
+    student_ids = sorted({students[i].id for i, _, _ in fallback})
+    given = {}
+    for offset in range(0, len(student_ids), ID_BATCH_SIZE):
+        given.update(
+            ((student_id, school_id), score or 0)
+            for student_id, school_id, score in db.session.query(Preference.student_id, Preference.school_id, Preference.points)
+            .filter(Preference.student_id.in_(student_ids[offset:offset + ID_BATCH_SIZE]))
+        )
+    return [given.get((students[i].id, schools[j].id), 0) for i, j, _ in fallback]
+
+def _persist_solution(students, schools, solution, persist_chunk_size, run_start, points=None, capacity=None):
+    """
+    Record a matching_core solution as a new MatchingRun with its results and
+    build the statistics. Fallback fills are stored as '<algorithm>_fallback',
+    scored like every other result with the points the student gave the school
+    (0 without a preference), which the statistics average too. The results are written to a staged run, which replaces
+    the current one only once complete (see _finish_run), so readers keep
+    seeing the previous results meanwhile. Runs beyond the last
+    MATCHING_RUN_RETENTION are deleted.
+    
+    Given the `points` and `capacity` matrices the solution was solved from, the
+    run is stored with a hash of its inputs and its analytics payload.
+    
+    The per-phase timings of the solution, with the 'persist' and 'statistics'
+    phases and the total since `run_start` added, are returned under
+    statistics.timings, stored with the run and kept in recent_matching_runs.
+    """
+    timings = solution['timings']
+    algorithm_used = solution['algorithm_used']
+    # Read before the commit expires the loaded objects
+    student_ids = [student.id for student in students]
+    school_ids = [school.id for school in schools]
+    
+    # Analytics payload, from the matrices already in memory
+    start = time.perf_counter()
+    cells = [(i, j, t) for i, j, t, _ in solution['assignments']] + list(solution['fallback'] or [])
+    analytics = None
+    if points is not None:
+        analytics = solution_analytics(student_ids, school_ids, [school.school_name for school in schools], points,
+                                       capacity, cells)
+    start = record_phase(timings, 'analytics', start, len(cells))
+    
+    # Record the run first, so its results can reference it
+    run = MatchingRun(algorithm='lottery' if 'lottery' in solution else algorithm_used, seed=solution['seed'],
+                      input_hash=_inputs_hash(student_ids, school_ids, points, capacity), analytics=analytics)
+    db.session.add(run)
+    db.session.flush()
+    run_id = run.id
+    
+    try:
+        matches = _matches_from_assignments(students, schools, solution['assignments'])
+        result_rows = _result_rows(matches, algorithm_used, run_id)
+        if solution['fallback'] is not None:
+            fallback_points = _fallback_points(students, schools, solution['fallback'], points)
+            fallback_assignments = [
+                (i, j, t, score) for (i, j, t), score in zip(solution['fallback'], fallback_points)
+            ]
+            fallback_matches = _matches_from_assignments(students, schools, fallback_assignments)
+            result_rows.extend(_result_rows(fallback_matches, f'{algorithm_used}_fallback', run_id))
+            matches.extend(fallback_matches)
+        
+        # Write all results to the database in batches
+        persistence = persist_result_rows(result_rows, persist_chunk_size)
+        start = record_phase(timings, 'persist', start, len(result_rows))
+        
+        # Calculate statistics
+        statistics = _matching_statistics(students, schools, matches, solution['matched_students'], solution['remaining'])
+        statistics['run_id'] = run_id
+        statistics['seed'] = solution['seed']
+        statistics['persistence'] = persistence
+        if solution['fallback'] is not None:
+            statistics['fallback_placements'] = len(solution['fallback'])
+            statistics['unplaced'] = [
+                {
+                    'student_id': students[i].id,
+                    'student_name': f"{students[i].first_name} {students[i].last_name}",
+                    'session_number': t + 1
+                }
+                for i, t in solution['unplaced']
+            ]
+        for key in ('optimization', 'lottery'):
+            if key in solution:
+                statistics[key] = solution[key]
+        record_phase(timings, 'statistics', start, len(matches))
+        
+        timings['total'] = {'seconds': time.perf_counter() - run_start, 'items': len(matches)}
+        statistics['timings'] = timings
+        _store_greedy_state(run, solution, student_ids, school_ids)
+        _finish_run(run, statistics, len(result_rows))
+    except Exception:
+        _discard_run(run_id)
+        raise
+    _remember_greedy_run(solution, student_ids, school_ids, run_id)
+    recent_matching_runs.append({
+        'algorithm': algorithm_used,
+        'seed': solution['seed'],
+        'finished_at': datetime.utcnow().isoformat(),
+        'students': len(students),
+        'schools': len(schools),
+        'matches': len(matches),
+        'timings': timings
+    })
+    
     return {
         'matches': matches,
-        'statistics': {
-            'total_students': total_students,
-            'matched_students': matched_students,
-            'unmatched_students': unmatched_students,
-            'average_preference_score': avg_preference,
-            'school_fill_rates': school_fill_rates
+        'statistics': statistics
+    }
+
+def _finish_run(run, statistics, rows):
+    """
+    Store the timings and summary statistics of a staged run and publish it: the
+    commit setting published_at is the single switch that makes its results the
+    current ones. Then apply the retention limit.
+    """
+    run.timings = statistics['timings']
+    run.summary = {
+        key: statistics[key]
+        for key in ('total_students', 'matched_students', 'unmatched_students', 'average_preference_score',
+                    'fallback_placements', 'mode', 'previous_run_id')
+        if key in statistics
+    }
+    run.summary['rows'] = rows
+    if 'unplaced' in statistics:
+        run.summary['unplaced'] = len(statistics['unplaced'])
+    run.published_at = datetime.utcnow()
+    bump_data_version()
+    db.session.commit()
+    prune_matching_runs()
+
+def _discard_run(run_id):
+    """
+    Roll back and delete a staged run that failed, with the results written so far
+    """
+    db.session.rollback()
+    if MatchingRun.query.filter(MatchingRun.id == run_id, MatchingRun.published_at.isnot(None)).count():
+        return  # It failed after publishing, the results are complete
+    MatchingResult.query.filter(MatchingResult.run_id == run_id).delete(synchronize_session=False)
+    MatchingRun.query.filter(MatchingRun.id == run_id).delete(synchronize_session=False)
+    db.session.commit()
+
+def prune_matching_runs(keep=None):
+    """
+    Delete all but the `keep` (MATCHING_RUN_RETENTION by default) most recently
+    published matching runs, at least one, and their results, as well as runs
+    staged for more than STAGED_RUN_EXPIRY_HOURS, and commit. Runs being written
+    are left alone. Returns the ids of the deleted runs.
+    """
+    if keep is None:
+        keep = MATCHING_RUN_RETENTION
+    old_ids = [
+        run_id for (run_id,) in published_runs().with_entities(MatchingRun.id).offset(max(1, keep))
+    ]
+    expired = datetime.utcnow() - timedelta(hours=STAGED_RUN_EXPIRY_HOURS)
+    old_ids.extend(
+        run_id for (run_id,) in db.session.query(MatchingRun.id)
+        .filter(MatchingRun.published_at.is_(None), MatchingRun.created_at < expired)
+    )
+    for offset in range(0, len(old_ids), ID_BATCH_SIZE):
+        batch = old_ids[offset:offset + ID_BATCH_SIZE]
+        MatchingResult.query.filter(MatchingResult.run_id.in_(batch)).delete(synchronize_session=False)
+        MatchingRun.query.filter(MatchingRun.id.in_(batch)).delete(synchronize_session=False)
+    if old_ids:
+        bump_data_version()
+    db.session.commit()
+    return old_ids
+
+def published_runs():
+    """
+    Query of the published matching runs, most recently published first
+    """
+    return MatchingRun.query.filter(MatchingRun.published_at.isnot(None))\
+        .order_by(MatchingRun.published_at.desc(), MatchingRun.id.desc())
+
+def current_run_id():
+    """
+    Id of the matching run whose results are current (the most recently
+    published one), or None
+    """
+    run = published_runs().with_entities(MatchingRun.id).first()
+    return run[0] if run else None
+
+def current_results():
+    """
+    Query of the MatchingResult rows of the current run
+    """
+    return MatchingResult.query.filter(MatchingResult.run_id == current_run_id())
+
+def _results_query(run_id):
+    """
+    Query of the results of run `run_id` joined to their students and schools,
+    selecting the columns of a match dict (see _match_dict)
+    """
+    return db.session.query(
+        MatchingResult.id, MatchingResult.student_id, Student.first_name, Student.last_name, Student.email,
+        MatchingResult.school_id, School.school_name, MatchingResult.session_number,
+        db.func.coalesce(MatchingResult.preference_score, 0)
+    ).join(Student, Student.id == MatchingResult.student_id)\
+        .join(School, School.id == MatchingResult.school_id)\
+        .filter(MatchingResult.run_id == run_id)
+
+def _match_dict(row):
+    result_id, student_id, first_name, last_name, email, school_id, school_name, session_number, preference_score = row[:9]
+    return {
+        'id': result_id,
+        'student_id': student_id,
+        'student_name': f"{first_name} {last_name}",
+        'student_email': email,
+        'school_id': school_id,
+        'school_name': school_name,
+        'session_number': session_number,
+        'preference_score': preference_score
+    }
+
+def run_matches(run_id):
+    """
+    The results of run `run_id` as the match dicts of the API (student name and
+    email, school name, session and preference score), read with one query
+    joining the students and schools, in result id order
+    """
+    return [_match_dict(row) for row in _results_query(run_id).order_by(MatchingResult.id).all()]
+
+def iter_run_matches(run_id, batch_size=EXPORT_BATCH_SIZE):
+    """
+    The match dicts of run_matches, read in keyset batches of `batch_size` results
+    (by id) so only one batch is held at a time
+    """
+    last_id = 0
+    while True:
+        rows = _results_query(run_id).filter(MatchingResult.id > last_id)\
+            .order_by(MatchingResult.id).limit(batch_size).all()
+        for row in rows:
+            yield _match_dict(row)
+        if len(rows) < batch_size:
+            return
+        last_id = rows[-1][0]
+
+# Sort keys of results_page and the columns each orders by, the result id breaking ties
+RESULT_SORTS = {
+    'id': (),
+    'student_name': (Student.first_name, Student.last_name),
+    'student_email': (Student.email,),
+    'school_name': (School.school_name,),
+    'session_number': (MatchingResult.session_number,),
+    'preference_score': (MatchingResult.preference_score,)
+}
+
+def _encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+def _decode_cursor(cursor, keys):
+    """
+    The values of `keys` a cursor holds, checked against the columns' types so a
+    malformed cursor is a ValueError rather than a failing comparison. Nullable
+    keys may hold None.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        values = None
+    if not isinstance(values, list) or len(values) != len(keys):
+        raise ValueError('Invalid cursor')
+    for value, key in zip(values, keys):
+        if value is None and key.nullable:
+            continue
+        if not isinstance(value, key.type.python_type) or isinstance(value, bool):
+            raise ValueError('Invalid cursor')
+    return values
+
+def _after_cursor(keys, values, descending):
+    """
+    Filter of the rows after the cursor `values` in the order of `keys`. NULLs
+    order before every value (first ascending, last descending), which a row
+    value comparison can't express, so with a nullable key the comparison is
+    spelled out key by key.
+    """
+    if not any(key.nullable for key in keys):
+        position, last = db.tuple_(*keys), db.tuple_(*values)
+        return position < last if descending else position > last
+    conditions = []
+    for k, (key, value) in enumerate(zip(keys, values)):
+        if value is None:
+            beyond = db.false() if descending else key.isnot(None)
+        else:
+            beyond = db.or_(key < value, key.is_(None)) if descending else key > value
+        equal = [previous.is_(None) if v is None else previous == v for previous, v in zip(keys[:k], values[:k])]
+        conditions.append(db.and_(*equal, beyond))
+    return db.or_(*conditions)
+
+def _sort_order(key, descending):
+    if not key.nullable:
+        return key.desc() if descending else key
+    return key.desc().nulls_last() if descending else key.asc().nulls_first()
+
+def results_page(run_id, school_id=None, session_number=None, search=None, min_score=None, max_score=None,
+                 sort='id', descending=False, limit=100, cursor=None):
+    """
+    One page of the match dicts of run `run_id`, filtered by school, session,
+    a prefix of the student's first name, last name, full name or email
+    (`search`, case-insensitive) and a preference score range, ordered by one of
+    RESULT_SORTS.
+    
+    Pages are keyset-paginated: `cursor` is the next_cursor of the previous page
+    (the sort values and id of its last row), so every page is a range read on the
+    matching_results indexes whatever its position. Returns the page with its
+    next_cursor (None on the last page) and, on the first page only, the total
+    number of matching results. Raises ValueError for an unknown sort or a
+    malformed cursor.
+    """
+    if sort not in RESULT_SORTS:
+        raise ValueError(f"Unknown sort '{sort}'")
+    
+    query = _results_query(run_id)
+    if school_id is not None:
+        query = query.filter(MatchingResult.school_id == school_id)
+    if session_number is not None:
+        query = query.filter(MatchingResult.session_number == session_number)
+    if min_score is not None:
+        query = query.filter(MatchingResult.preference_score >= min_score)
+    if max_score is not None:
+        query = query.filter(MatchingResult.preference_score <= max_score)
+    if search:
+        # The students are matched once, then their results are read through (run_id, student_id)
+        pattern = search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        students = db.session.query(Student.id).filter(db.or_(
+            Student.first_name.ilike(pattern, escape='\\'),
+            Student.last_name.ilike(pattern, escape='\\'),
+            (Student.first_name + ' ' + Student.last_name).ilike(pattern, escape='\\'),
+            Student.email.ilike(pattern, escape='\\')
+        ))
+        query = query.filter(MatchingResult.student_id.in_(students))
+    total = query.count() if cursor is None else None
+    
+    keys = RESULT_SORTS[sort] + (MatchingResult.id,)
+    if cursor is not None:
+        query = query.filter(_after_cursor(keys, _decode_cursor(cursor, keys), descending))
+    query = query.order_by(*(_sort_order(key, descending) for key in keys))
+    rows = query.add_columns(*keys[:-1]).limit(limit + 1).all()
+    
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_cursor([*rows[-1][9:], rows[-1][0]])
+    return {
+        'run_id': run_id,
+        'total': total,
+        'matches': [_match_dict(row) for row in rows],
+        'next_cursor': next_cursor
+    }
+
+def list_runs(limit=None):
+    """
+    The kept matching runs, newest first, with the number of result rows of each
+    and their status: 'current', 'published' or 'staged' (still being written)
+    """
+    counts = dict(
+        db.session.query(MatchingResult.run_id, db.func.count(MatchingResult.id)).group_by(MatchingResult.run_id).all()
+    )
+    current = current_run_id()
+    query = MatchingRun.query.order_by(MatchingRun.id.desc())
+    if limit is not None:
+        query = query.limit(max(0, int(limit)))
+    return [
+        {
+            'run_id': run.id,
+            'algorithm': run.algorithm,
+            'seed': run.seed,
+            'input_hash': run.input_hash,
+            'created_at': run.created_at.isoformat() if run.created_at else None,
+            'published_at': run.published_at.isoformat() if run.published_at else None,
+            'status': 'current' if run.id == current else 'published' if run.published_at else 'staged',
+            'results': counts.get(run.id, 0),
+            'summary': run.summary,
+            'timings': run.timings
+        }
+        for run in query.all()
+    ]
+
+def _run_seats(run_id):
+    """
+    (student id, session number, school id) of every result of a run, as a set
+    """
+    return set(
+        db.session.query(MatchingResult.student_id, MatchingResult.session_number, MatchingResult.school_id)
+        .filter(MatchingResult.run_id == run_id).all()
+    )
+
+def compare_runs(base_run_id, other_run_id, limit=None):
+    """
+    Compare the results of two runs with set operations on their (student,
+    session, school) seats: the counts of unchanged, removed and added seats, the
+    number of students with a changed seat and, per changed (student, session),
+    the school in each run (None where that run has no result). `limit` caps the
+    number of changes listed. Only published runs can be compared.
+    """
+    runs = {run.id: run for run in published_runs().filter(MatchingRun.id.in_((base_run_id, other_run_id))).all()}
+    missing = [run_id for run_id in (base_run_id, other_run_id) if run_id not in runs]
+    if missing:
+        return {'error': f"Unknown matching run {missing[0]}"}
+    
+    base = _run_seats(base_run_id)
+    other = _run_seats(other_run_id)
+    removed = base - other
+    added = other - base
+    base_schools = {(student_id, session_number): school_id for student_id, session_number, school_id in removed}
+    other_schools = {(student_id, session_number): school_id for student_id, session_number, school_id in added}
+    seats = sorted(base_schools.keys() | other_schools.keys())
+    listed = seats if limit is None else seats[:max(0, int(limit))]
+    
+    return {
+        'base_run_id': base_run_id,
+        'other_run_id': other_run_id,
+        'same_inputs': runs[base_run_id].input_hash is not None
+        and runs[base_run_id].input_hash == runs[other_run_id].input_hash,
+        'unchanged': len(base & other),
+        'removed': len(removed),
+        'added': len(added),
+        'students_changed': len({student_id for student_id, _ in seats}),
+        'changes': [
+            {
+                'student_id': student_id,
+                'session_number': session_number,
+                'base_school_id': base_schools.get((student_id, session_number)),
+                'other_school_id': other_schools.get((student_id, session_number))
+            }
+            for student_id, session_number in listed
+        ]
+    }
+
+def _store_greedy_state(run, solution, student_ids, school_ids):
+    """
+    Store the greedy state of an improved matching solution with its staged run,
+    in the same commit as publishing it, and drop the state of earlier runs.
+    Solutions of other algorithms have none.
+    """
+    if 'greedy' not in solution:
+        return
+    output = io.BytesIO()
+    save_greedy_state(output, solution['greedy'], student_ids, school_ids, run.id)
+    MatchingRun.query.filter(MatchingRun.id != run.id, MatchingRun.greedy_state.isnot(None))\
+        .update({MatchingRun.greedy_state: None}, synchronize_session=False)
+    run.greedy_state = output.getvalue()
+
+def _remember_greedy_run(solution, student_ids, school_ids, run_id):
+    """
+    Keep the greedy state of a published improved matching run in memory, so the
+    next rematch_incremental of this process does not read it back
+    """
+    global _greedy_run
+    if 'greedy' in solution:
+        _greedy_run = {
+            'database': str(db.engine.url),
+            'run_id': run_id,
+            'state': solution['greedy'],
+            'student_ids': list(student_ids),
+            'school_ids': list(school_ids)
+        }
+
+def _stored_greedy_run():
+    """
+    The greedy state of the current run, from memory or from the database, or
+    None when the current run is not an improved matching run
+    """
+    global _greedy_run
+    run_id = current_run_id()
+    if run_id is None:
+        return None
+    database = str(db.engine.url)
+    if _greedy_run is not None and _greedy_run['database'] == database and _greedy_run['run_id'] == run_id:
+        return _greedy_run
+    stored = db.session.query(MatchingRun.greedy_state).filter(MatchingRun.id == run_id).scalar()
+    if stored is None:
+        return None
+    state, student_ids, school_ids, _ = load_greedy_state(io.BytesIO(stored))
+    _greedy_run = {
+        'database': database,
+        'run_id': run_id,
+        'state': state,
+        'student_ids': student_ids.tolist(),
+        'school_ids': school_ids.tolist()
+    }
+    return _greedy_run
+
+def has_greedy_run():
+    """
+    Whether the current run is an improved matching run rematch_incremental can update
+    """
+    return db.session.query(MatchingRun.id).filter(
+        MatchingRun.id == current_run_id(), MatchingRun.greedy_state.isnot(None)
+    ).first() is not None
+
+def run_matching_algorithm(seed=None, bid_engine='numpy', persist_chunk_size=DEFAULT_PERSIST_CHUNK_SIZE, timings=None):
+    """
+    Run the improved matching algorithm (matching_core.solve_improved) on the
+    database contents and write the results.
+    
+    The tiebreakers are drawn from `seed` (a fresh one is picked when omitted and
+    reported in the statistics), so a run can be reproduced exactly.
+    `bid_engine` selects how bids are held: 'numpy' keeps them as parallel arrays
+    ordered by a single lexsort, 'python' builds one dict per bid. Both engines
+    give the same assignments for the same seed.
+    
+    Capacities are held in a schools x sessions matrix, and open sessions as
+    per-student and per-school bitmasks, so the number of sessions is whatever
+    the School capacity columns define. Results are written in batches of
+    `persist_chunk_size` rows.
+    
+    Like the other run_* functions, phases are recorded in `timings` as they
+    finish (a new dict if None), so a background job can report its progress.
+    """
+    if bid_engine not in ('numpy', 'python'):
+        return {'error': f"Unknown bid engine '{bid_engine}'"}
+    
+    if seed is None:
+        seed = new_seed()
+    
+    # Get all data from database
+    run_start = time.perf_counter()
+    if timings is None:
+        timings = {}
+    students, schools, points, capacity = _load_inputs(timings, with_points=bid_engine == 'numpy')
+    
+    if bid_engine == 'numpy':
+        solution = solve_improved(points, capacity, seed, timings)
+    else:
+        tiebreakers = draw_tiebreakers(seed, (len(students), len(schools)))
+        remaining, student_free, school_open, _ = replay_assignments([], capacity, len(students))
+        all_bids = _build_bid_dicts(students, schools, tiebreakers, timings)
+        start = time.perf_counter()
+        bid_students = [bid['student_index'] for bid in all_bids]
+        bid_schools = [bid['school_index'] for bid in all_bids]
+        assigned = assign_bids(bid_students, bid_schools, remaining, capacity.shape[1], student_free, school_open)
+        assignments = [
+            (bid_students[position], bid_schools[position], t, all_bids[position]['points'])
+            for position, t in assigned
+        ]
+        record_phase(timings, 'assignment', start, len(assignments))
+        solution = finish_greedy(assignments, capacity, len(students), 'improved_matching', seed, timings=timings)
+    
+    result = _persist_solution(students, schools, solution, persist_chunk_size, run_start, points, capacity)
+    result['statistics']['bid_engine'] = bid_engine
+    return result
+
+def rematch_incremental(student_ids=(), persist_chunk_size=DEFAULT_PERSIST_CHUNK_SIZE, timings=None):
+    """
+    Bring the stored improved matching results up to date after late changes to
+    the preferences of `student_ids` and/or to any school capacities.
+    
+    The last improved matching run is replayed with its seed and bid order by
+    matching_core.rematch_greedy, which gives exactly the results of a full run
+    with the same seed while only reading the changed students' preferences and
+    only replaying the bids from the first affected one. Writing the update is
+    not incremental: it is recorded as a new MatchingRun, so all of the previous
+    run's rows are copied to it (one INSERT ... SELECT, proportional to the size
+    of the run but without a round trip per row), then the changed rows are
+    rewritten there before it is published.
+    Only the current run can be updated, and only if it is an improved matching
+    run (see has_greedy_run). When students or schools were added or removed
+    since, a full run is made instead with the same seed.
+    
+    Returns one change per (student, session) whose school changed and the
+    statistics, with 'mode' set to 'incremental' or 'full'.
+    """
+    run = _stored_greedy_run()
+    if run is None:
+        return {'error': 'The current results are not from an improved matching run, run the matching first'}
+    
+    run_start = time.perf_counter()
+    if timings is None:
+        timings = {}
+    state = run['state']
+    students = Student.query.all()
+    schools = School.query.all()
+    algorithm_used = 'improved_matching'
+    expected_rows = int((state['sessions'] >= 0).sum()) + len(state['fallback'])
+    previous_run_id = run['run_id']
+    if (sorted(student.id for student in students) != sorted(run['student_ids'])
+            or sorted(school.id for school in schools) != sorted(run['school_ids'])):
+        result = run_matching_algorithm(seed=state['seed'], persist_chunk_size=persist_chunk_size, timings=timings)
+        if 'error' not in result:
+            result['statistics']['mode'] = 'full'
+            result['changes'] = None
+        return result
+    
+    # Students and schools in the order of the stored run
+    start = time.perf_counter()
+    students_by_id = {student.id: student for student in students}
+    schools_by_id = {school.id: school for school in schools}
+    students = [students_by_id[student_id] for student_id in run['student_ids']]
+    schools = [schools_by_id[school_id] for school_id in run['school_ids']]
+    student_index = {student_id: i for i, student_id in enumerate(run['student_ids'])}
+    school_index = {school_id: j for j, school_id in enumerate(run['school_ids'])}
+    
+    # Only the changed students' preferences are loaded
+    changed_ids = sorted({int(student_id) for student_id in student_ids if int(student_id) in student_index})
+    changed_points = {student_index[student_id]: np.zeros(len(schools), dtype=np.int64) for student_id in changed_ids}
+    for offset in range(0, len(changed_ids), ID_BATCH_SIZE):
+        rows = db.session.query(Preference.student_id, Preference.school_id, Preference.points)\
+            .filter(Preference.student_id.in_(changed_ids[offset:offset + ID_BATCH_SIZE])).all()
+        for student_id, school_id, points in rows:
+            if school_id in school_index:
+                changed_points[student_index[student_id]][school_index[school_id]] = points or 0
+    capacity = load_capacity_matrix(schools)
+    record_phase(timings, 'load', start, len(changed_ids) * len(schools))
+    
+    solution = rematch_greedy(state, changed_points, capacity, timings)
+    changes = solution['changes']
+    
+    # Seats whose school or tag changed: (student index, session index) -> (school index, algorithm)
+    fallback_used = f'{algorithm_used}_fallback'
+    previous = {(i, t): (j, algorithm_used) for i, j, t, _ in changes['assignments_removed']}
+    previous.update(((i, t), (j, fallback_used)) for i, j, t in changes['fallback_removed'])
+    current = {(i, t): (j, algorithm_used) for i, j, t, _ in changes['assignments_added']}
+    current.update(((i, t), (j, fallback_used)) for i, j, t in changes['fallback_added'])
+    seats = sorted(seat for seat in previous.keys() | current.keys() if previous.get(seat) != current.get(seat))
+    
+    # Copy all of the previous run's results to a new staged run, then rewrite the
+    # changed rows, found with one query per batch of students
+    start = time.perf_counter()
+    new_run = MatchingRun(algorithm=algorithm_used, seed=solution['seed'],
+                          input_hash=greedy_inputs_hash(solution['greedy'], run['student_ids'], run['school_ids']))
+    db.session.add(new_run)
+    db.session.flush()
+    run_id = new_run.id
+    try:
+        copied_columns = ('student_id', 'school_id', 'session_number', 'algorithm_used', 'preference_score', 'created_at')
+        table = MatchingResult.__table__
+        db.session.execute(table.insert().from_select(
+            copied_columns + ('run_id',),
+            select(*(table.c[column] for column in copied_columns), literal(run_id))
+            .where(table.c.run_id == previous_run_id)
+        ))
+        seat_keys = {(students[i].id, t + 1) for i, t in seats}
+        seat_student_ids = sorted({student_id for student_id, _ in seat_keys})
+        row_ids = []
+        for offset in range(0, len(seat_student_ids), ID_BATCH_SIZE):
+            rows = db.session.query(MatchingResult.id, MatchingResult.student_id, MatchingResult.session_number)\
+                .filter(MatchingResult.run_id == run_id,
+                        MatchingResult.student_id.in_(seat_student_ids[offset:offset + ID_BATCH_SIZE])).all()
+            row_ids.extend(row_id for row_id, student_id, session_number in rows if (student_id, session_number) in seat_keys)
+        for offset in range(0, len(row_ids), ID_BATCH_SIZE):
+            db.session.execute(MatchingResult.__table__.delete().where(
+                MatchingResult.id.in_(row_ids[offset:offset + ID_BATCH_SIZE])
+            ))
+        result_rows = [
+            {
+                'run_id': run_id,
+                'student_id': students[i].id,
+                'school_id': schools[current[i, t][0]].id,
+                'session_number': t + 1,
+                'algorithm_used': current[i, t][1],
+                'preference_score': None
+            }
+            for i, t in seats if (i, t) in current
+        ]
+        persistence = persist_result_rows(result_rows, persist_chunk_size)
+        # Scores of the new rows, and of every row of the students whose points changed
+        fill_preference_scores(run_id, changed_ids)
+        record_phase(timings, 'persist', start, len(seats))
+        
+        def seat_details(seat):
+            if seat is None:
+                return None
+            j, seat_algorithm = seat
+            return {
+                'school_id': schools[j].id,
+                'school_name': schools[j].school_name,
+                'algorithm_used': seat_algorithm
+            }
+        
+        changed_seats = [
+            {
+                'student_id': students[i].id,
+                'student_name': f"{students[i].first_name} {students[i].last_name}",
+                'session_number': t + 1,
+                'previous': seat_details(previous.get((i, t))),
+                'current': seat_details(current.get((i, t)))
+            }
+            for i, t in seats
+        ]
+        
+        timings['total'] = {'seconds': time.perf_counter() - run_start, 'items': len(seats)}
+        statistics = {
+            'mode': 'incremental',
+            'run_id': run_id,
+            'previous_run_id': previous_run_id,
+            'seed': solution['seed'],
+            'changed_students': len(changed_ids),
+            'changed_bids': changes['changed_bids'],
+            'replayed_bids': changes['replayed_bids'],
+            'total_bids': changes['total_bids'],
+            'rows_changed': len(seats),
+            'total_students': len(students),
+            'matched_students': solution['matched_students'],
+            'fallback_placements': len(solution['fallback']),
+            'unplaced': [
+                {
+                    'student_id': students[i].id,
+                    'student_name': f"{students[i].first_name} {students[i].last_name}",
+                    'session_number': t + 1
+                }
+                for i, t in solution['unplaced']
+            ],
+            'persistence': persistence,
+            'timings': timings
         }
+        _store_greedy_state(new_run, solution, run['student_ids'], run['school_ids'])
+        _finish_run(new_run, statistics, expected_rows - len(previous) + len(current))
+    except Exception:
+        _discard_run(run_id)
+        raise
+    _remember_greedy_run(solution, run['student_ids'], run['school_ids'], run_id)
+    recent_matching_runs.append({
+        'algorithm': f'{algorithm_used}_incremental',
+        'seed': solution['seed'],
+        'finished_at': datetime.utcnow().isoformat(),
+        'students': len(students),
+        'schools': len(schools),
+        'matches': expected_rows - len(previous) + len(current),
+        'timings': timings
+    })
+    
+    return {
+        'changes': changed_seats,
+        'statistics': statistics
     }
 
 def import_preferences_from_excel(file_path):
@@ -227,6 +1001,7 @@ def import_preferences_from_excel(file_path):
                     db.session.add(session)
         
         # Process each student
+        imported_student_ids = []
         for _, row in df.iterrows():
             # Check if student exists, create if not
             student = Student.query.filter_by(email=row['Email']).first()
@@ -234,6 +1009,7 @@ def import_preferences_from_excel(file_path):
                 student = Student(name=row['Name'], email=row['Email'])
                 db.session.add(student)
                 db.session.flush()  # Get ID without committing
+            imported_student_ids.append(student.id)
             
             # Process preferences for each school
             total_points = 0
@@ -264,7 +1040,11 @@ def import_preferences_from_excel(file_path):
                         pref = Preference(student_id=student.id, school_id=school_id, points=points)
                         db.session.add(pref)
         
-        # Commit all changes
+        # Commit all changes with the students re-ranked, stored analytics no longer match the
+        # preferences. Results keep the scores they were matched with.
+        rank_preferences(imported_student_ids)
+        clear_analytics()
+        bump_data_version()
         db.session.commit()
         
         return {"success": True, "message": "Preferences imported successfully"}
@@ -273,181 +1053,188 @@ def import_preferences_from_excel(file_path):
         db.session.rollback()
         return {"error": str(e)}
 
-def run_simple_matching_algorithm():
+def run_simple_matching_algorithm(seed=None, top_k=DEFAULT_SIMPLE_TOP_K, persist_chunk_size=DEFAULT_PERSIST_CHUNK_SIZE,
+                                  timings=None):
     """
-    Simple matching algorithm that:
-    1. Creates a sorted list of all bids with random tiebreakers
-    2. For each student, only considers their top 6 bids
-    3. Processes bids in order, assigning students to sessions based on capacity
+    Run the simple matching algorithm (matching_core.solve_simple, each student's
+    top `top_k` bids only) on the database contents and write the results
     """
+    if int(top_k) < 1:
+        return {'error': f'top_k must be at least 1, got {top_k}'}
+    
     # Get all data from database
-    students = Student.query.all()
-    schools = School.query.all()
-    preferences = Preference.query.all()
+    run_start = time.perf_counter()
+    if timings is None:
+        timings = {}
+    students, schools, points, capacity = _load_inputs(timings)
+    solution = solve_simple(points, capacity, seed, int(top_k), timings)
+    result = _persist_solution(students, schools, solution, persist_chunk_size, run_start, points, capacity)
+    result['statistics']['top_k'] = int(top_k)
+    return result
+
+def run_ilp_matching_algorithm(seed=None, time_limit=DEFAULT_ILP_TIME_LIMIT, gap_tolerance=DEFAULT_ILP_GAP_TOLERANCE,
+                               persist_chunk_size=DEFAULT_PERSIST_CHUNK_SIZE, timings=None):
+    """
+    Run the optimal (ILP) matching algorithm (matching_core.solve_ilp) on the
+    database contents and write the results
+    """
+    # Get all data from database
+    run_start = time.perf_counter()
+    if timings is None:
+        timings = {}
+    students, schools, points, capacity = _load_inputs(timings)
+    solution = solve_ilp(points, capacity, seed, time_limit, gap_tolerance, timings)
+    return _persist_solution(students, schools, solution, persist_chunk_size, run_start, points, capacity)
+
+def run_flow_matching_algorithm(seed=None, persist_chunk_size=DEFAULT_PERSIST_CHUNK_SIZE, timings=None):
+    """
+    Run the min-cost flow matching algorithm (matching_core.solve_flow) on the
+    database contents and write the results
+    """
+    # Get all data from database
+    run_start = time.perf_counter()
+    if timings is None:
+        timings = {}
+    students, schools, points, capacity = _load_inputs(timings)
+    solution = solve_flow(points, capacity, seed, timings)
+    return _persist_solution(students, schools, solution, persist_chunk_size, run_start, points, capacity)
+
+def run_lottery_matching_algorithm(draws=8, seed=None, welfare='total_points', workers=None,
+                                   persist_chunk_size=DEFAULT_PERSIST_CHUNK_SIZE, timings=None):
+    """
+    Run the Monte Carlo lottery (matching_core.solve_lottery) on the database
+    contents and write only the winning draw. The winner can be reproduced with
+    run_matching_algorithm(seed=winning_seed).
+    """
+    if welfare not in LOTTERY_WELFARE_METRICS:
+        return {'error': f"Unknown welfare metric '{welfare}'"}
     
-    # Create a dictionary to store student preferences for each school
-    student_preferences = {}
-    for pref in preferences:
-        if pref.student_id not in student_preferences:
-            student_preferences[pref.student_id] = {}
-        student_preferences[pref.student_id][pref.school_id] = pref.points
+    # Get all data from database
+    run_start = time.perf_counter()
+    if timings is None:
+        timings = {}
+    students, schools, points, capacity = _load_inputs(timings)
+    solution = solve_lottery(points, capacity, seed, draws, welfare, workers, timings)
+    result = _persist_solution(students, schools, solution, persist_chunk_size, run_start, points, capacity)
+    result['statistics']['bid_engine'] = 'numpy'
+    return result
+
+# Phases each algorithm records, in order (improved_matching for both bid engines)
+MATCHING_PHASES = {
+    'improved_matching': ('load', 'bids', 'sort', 'assignment', 'fallback', 'analytics', 'persist', 'statistics'),
+    'simple_matching': ('load', 'top_k', 'sort', 'assignment', 'analytics', 'persist', 'statistics'),
+    'ilp': ('load', 'bids', 'sort', 'assignment', 'model_build', 'solve', 'schedule', 'fallback', 'analytics',
+            'persist', 'statistics'),
+    'min_cost_flow': ('load', 'bids', 'sort', 'assignment', 'solve', 'schedule', 'fallback', 'analytics', 'persist',
+                      'statistics'),
+    'lottery': ('load', 'draws', 'bids', 'sort', 'assignment', 'fallback', 'analytics', 'persist', 'statistics')
+}
+
+def expected_phase_seconds(algorithm):
+    """
+    Seconds each phase of `algorithm` took in the most recent run with the same
+    phases, or None when there is none. Used to estimate the progress of a job.
+    """
+    phases = set(MATCHING_PHASES[algorithm])
+    for run in reversed(recent_matching_runs):
+        if set(run['timings']) - {'total'} == phases:
+            return {phase: run['timings'][phase]['seconds'] for phase in MATCHING_PHASES[algorithm]}
+    return None
+
+def matching_metrics(limit=None):
+    """
+    Timings of the last `limit` matching runs (all kept runs by default), newest
+    first, with the mean and max seconds of each phase across them
+    """
+    runs = list(recent_matching_runs)[::-1]
+    if limit is not None:
+        runs = runs[:max(0, int(limit))]
     
-    # Create a dictionary to map school IDs to their session capacities
-    school_capacities = {}
-    for school in schools:
-        school_capacities[school.id] = {
-            1: school.session1_capacity,
-            2: school.session2_capacity,
-            3: school.session3_capacity,
-            4: school.session4_capacity,
-            5: school.session5_capacity,
-            6: school.session6_capacity
+    phases = {}
+    for run in runs:
+        for phase, entry in run['timings'].items():
+            phases.setdefault(phase, []).append(entry['seconds'])
+    summary = {
+        phase: {
+            'runs': len(seconds),
+            'mean_seconds': sum(seconds) / len(seconds),
+            'max_seconds': max(seconds)
         }
+        for phase, seconds in phases.items()
+    }
     
-    # Step 1: Create a list of all bids with random tiebreakers
-    all_bids = []
-    for student in students:
-        for school in schools:
-            points = student_preferences.get(student.id, {}).get(school.id, 0)
-            if points > 0:  # Only include non-zero bids
-                # Add random tiebreaker between 0 and 1
-                all_bids.append({
-                    'student_id': student.id,
-                    'student_name': f"{student.first_name} {student.last_name}",
-                    'school_id': school.id,
-                    'school_name': school.school_name,
-                    'points': points,
-                    'tiebreaker': random.random()
-                })
-    
-    # Sort bids by points (descending) and then by tiebreaker (ascending)
-    all_bids.sort(key=lambda x: (-x['points'], x['tiebreaker']))
-    
-    # Step 2: For each student, keep only their top 6 bids
-    student_bid_counts = {}
-    filtered_bids = []
-    for bid in all_bids:
-        student_id = bid['student_id']
-        if student_id not in student_bid_counts:
-            student_bid_counts[student_id] = 0
-        
-        if student_bid_counts[student_id] < 6:
-            filtered_bids.append(bid)
-            student_bid_counts[student_id] += 1
-    
-    # Step 3: Process bids in order and assign to sessions
-    matches = []
-    session_assignments = {}  # Track which students are assigned to which sessions
-    
-    for bid in filtered_bids:
-        student_id = bid['student_id']
-        school_id = bid['school_id']
-        
-        # Skip if student already has 6 sessions assigned
-        if student_id in session_assignments and len(session_assignments[student_id]) >= 6:
-            continue
-        
-        # Try to assign to each session in order
-        for session_num in range(1, 7):
-            # Skip if student already has this session assigned
-            if student_id in session_assignments and session_num in session_assignments[student_id]:
-                continue
-            
-            # Check if school has capacity in this session
-            if school_capacities[school_id][session_num] > 0:
-                # Create match
-                match = {
-                    'student_id': student_id,
-                    'student_name': bid['student_name'],
-                    'school_id': school_id,
-                    'school_name': bid['school_name'],
-                    'session_number': session_num,
-                    'preference_score': bid['points']
-                }
-                matches.append(match)
-                
-                # Update capacities and assignments
-                school_capacities[school_id][session_num] -= 1
-                if student_id not in session_assignments:
-                    session_assignments[student_id] = set()
-                session_assignments[student_id].add(session_num)
-                
-                # Create Match object in database
-                db_match = MatchingResult(
-                    student_id=student_id,
-                    school_id=school_id,
-                    session_number=session_num,
-                    algorithm_used='simple_matching'
-                )
-                db.session.add(db_match)
-                break
-    
-    # Commit changes to database
-    db.session.commit()
-    
-    # Calculate statistics
-    total_students = len(students)
-    matched_students = len(session_assignments)
-    unmatched_students = total_students - matched_students
+    return {
+        'history_size': recent_matching_runs.maxlen,
+        'runs': runs,
+        'phases': summary
+    }
+
+def students_without_top_picks(k=3, limit=None, offset=0):
+    """
+    Students of the current run none of whose placements is among their top `k`
+    preferences (by Preference.rank), ordered by student id, with their top `k`
+    schools and the schools they were placed at.
     
-    # Calculate average preference score
-    if matches:
-        avg_preference = sum(match['preference_score'] for match in matches) / len(matches)
-    else:
-        avg_preference = 0
+    One query finds them all (a NOT IN over the run's results joined to the
+    preferences ranked within the top `k`); the names of the returned page of
+    `limit` students from `offset` take two more queries per ID_BATCH_SIZE of
+    them. Returns the run id, `k`, the total number of such students and the page.
+    """
+    run_id = current_run_id()
+    placed_in_top = db.session.query(MatchingResult.student_id).join(
+        Preference,
+        (Preference.student_id == MatchingResult.student_id) & (Preference.school_id == MatchingResult.school_id)
+    ).filter(MatchingResult.run_id == run_id, Preference.rank <= k)
+    query = db.session.query(Student.id, Student.first_name, Student.last_name)\
+        .filter(Student.id.notin_(placed_in_top)).order_by(Student.id)
+    total = query.count()
+    if offset:
+        query = query.offset(offset)
+    if limit is not None:
+        query = query.limit(limit)
+    students = query.all()
     
-    # Calculate fill rates for each school
-    school_fill_rates = []
-    for school in schools:
-        total_capacity = sum(school_capacities[school.id][session_num] for session_num in range(1, 7))
-        filled_slots = sum(1 for match in matches if match['school_id'] == school.id)
-        fill_rate = filled_slots / total_capacity if total_capacity > 0 else 0
-        school_fill_rates.append({
-            'school_id': school.id,
-            'school_name': school.school_name,
-            'fill_rate': fill_rate
-        })
+    top_schools = {student_id: [] for student_id, _, _ in students}
+    assigned_schools = {student_id: [] for student_id, _, _ in students}
+    student_ids = list(top_schools)
+    for position in range(0, len(student_ids), ID_BATCH_SIZE):
+        batch = student_ids[position:position + ID_BATCH_SIZE]
+        for student_id, school_name in db.session.query(Preference.student_id, School.school_name)\
+                .join(School, School.id == Preference.school_id)\
+                .filter(Preference.student_id.in_(batch), Preference.rank <= k)\
+                .order_by(Preference.student_id, Preference.rank):
+            top_schools[student_id].append(school_name)
+        for student_id, school_name in db.session.query(MatchingResult.student_id, School.school_name)\
+                .join(School, School.id == MatchingResult.school_id)\
+                .filter(MatchingResult.run_id == run_id, MatchingResult.student_id.in_(batch))\
+                .order_by(MatchingResult.student_id, MatchingResult.id):
+            assigned_schools[student_id].append(school_name)
     
     return {
-        'matches': matches,
-        'statistics': {
-            'total_students': total_students,
-            'matched_students': matched_students,
-            'unmatched_students': unmatched_students,
-            'average_preference_score': avg_preference,
-            'school_fill_rates': school_fill_rates
-        }
+        'run_id': run_id,
+        'k': k,
+        'total': total,
+        'students': [
+            {
+                'student_id': student_id,
+                'student_name': f"{first_name} {last_name}",
+                'top_schools': top_schools[student_id],
+                'assigned_schools': assigned_schools[student_id]
+            }
+            for student_id, first_name, last_name in students
+        ]
     }
 
 def get_students_without_top_3_picks():
     """
     Identify students who didn't get any of their top 3 school preferences
     """
-    from database import Student, Preference, MatchingResult
-    
-    students = Student.query.all()
-    students_without_top_3 = []
-    
-    for student in students:
-        # Get student's top 3 school preferences
-        top_3_preferences = Preference.query.filter_by(student_id=student.id)\
-            .order_by(Preference.points.desc()).limit(3).all()
-        
-        top_3_school_ids = [pref.school_id for pref in top_3_preferences]
-        
-        # Get student's actual assignments
-        student_matches = MatchingResult.query.filter_by(student_id=student.id).all()
-        assigned_school_ids = [match.school_id for match in student_matches]
-        
-        # Check if student got any of their top 3
-        got_top_3 = any(school_id in assigned_school_ids for school_id in top_3_school_ids)
-        
-        if not got_top_3:
-            students_without_top_3.append({
-                'student_id': student.id,
-                'student_name': f"{student.first_name} {student.last_name}",
-                'top_3_schools': [pref.school.school_name for pref in top_3_preferences],
-                'assigned_schools': [match.school.school_name for match in student_matches]
-            })
-    
-    return students_without_top_3
\ No newline at end of file
+    return [
+        {
+            'student_id': student['student_id'],
+            'student_name': student['student_name'],
+            'top_3_schools': student['top_schools'],
+            'assigned_schools': student['assigned_schools']
+        }
+        for student in students_without_top_picks(3)['students']
+    ]
@@ -0,0 +1,1331 @@
+"""
+Matching engines on plain arrays, with no Flask or database dependency.
+
+Every engine takes a students x schools matrix of points and a schools x sessions
+matrix of capacities and returns a solution dict holding (student index, school
+index, session index, points) assignments. matching.py runs them on the database
+contents, run_matching.py on SQLite files, CSV exports and snapshots.
+"""
+import numpy as np
+import bisect
+import hashlib
+import random
+import time
+import heapq
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+# Metrics the lottery mode can pick its winning draw by. Each one is compared
+# first, then the others in this order.
+LOTTERY_WELFARE_METRICS = ('total_points', 'fewest_fallbacks', 'top_3_students')
+
+# Bids per student the simple matching mode considers
+DEFAULT_SIMPLE_TOP_K = 6
+
+# CBC settings for the optimal (ILP) matching mode
+DEFAULT_ILP_TIME_LIMIT = 30  # seconds
+DEFAULT_ILP_GAP_TOLERANCE = 0.001  # relative MIP gap at which CBC may stop
+
+def new_seed():
+    """
+    Pick a fresh seed for a run that did not ask for one
+    """
+    return random.SystemRandom().randrange(2 ** 32)
+
+def record_phase(timings, phase, start, items=None):
+    """
+    Add the time since `start` (a time.perf_counter() reading) and `items` to
+    `phase` in the `timings` dict, and return the current reading so the next
+    phase can start from it. Does nothing but read the clock when `timings` is None.
+    """
+    now = time.perf_counter()
+    if timings is not None:
+        entry = timings.setdefault(phase, {'seconds': 0.0, 'items': 0})
+        entry['seconds'] += now - start
+        if items is not None:
+            entry['items'] += int(items)
+    return now
+
+def draw_tiebreakers(seed, shape):
+    """
+    Draw one random tiebreaker per (student, school) cell from a seeded generator,
+    so every bid engine sees the same lottery for a given seed
+    """
+    return np.random.default_rng(seed).random(shape)
+
+def tiebreaker_rows(seed, shape, rows):
+    """
+    The given student rows of draw_tiebreakers(seed, shape), without drawing the
+    whole matrix. default_rng is a PCG64 generator that spends one 64-bit step
+    per float, so it can be advanced straight to the start of each row.
+    """
+    n_schools = shape[1]
+    result = np.empty((len(rows), n_schools))
+    for k, i in enumerate(rows):
+        bit_generator = np.random.PCG64(seed)
+        bit_generator.advance(int(i) * n_schools)
+        result[k] = np.random.Generator(bit_generator).random(n_schools)
+    return result
+
+def points_matrix(student_ids, school_ids, rows):
+    """
+    Build a dense students x schools matrix of points from (student id, school id,
+    points) rows. Matrix rows follow `student_ids`, columns follow `school_ids`.
+    """
+    points = np.zeros((len(student_ids), len(school_ids)), dtype=np.int64)
+    if len(rows) == 0 or len(student_ids) == 0 or len(school_ids) == 0:
+        return points
+    
+    pref_array = np.array(rows, dtype=np.int64)
+    student_ids = np.asarray(student_ids, dtype=np.int64)
+    school_ids = np.asarray(school_ids, dtype=np.int64)
+    
+    # Map database ids to matrix positions with a binary search over the sorted ids
+    student_order = np.argsort(student_ids)
+    school_order = np.argsort(school_ids)
+    student_pos = np.searchsorted(student_ids, pref_array[:, 0], sorter=student_order)
+    school_pos = np.searchsorted(school_ids, pref_array[:, 1], sorter=school_order)
+    student_pos = np.minimum(student_pos, len(student_ids) - 1)
+    school_pos = np.minimum(school_pos, len(school_ids) - 1)
+    student_rows = student_order[student_pos]
+    school_cols = school_order[school_pos]
+    
+    # Drop preferences pointing at students or schools that no longer exist
+    known = (student_ids[student_rows] == pref_array[:, 0]) & (school_ids[school_cols] == pref_array[:, 1])
+    points[student_rows[known], school_cols[known]] = pref_array[known, 2]
+    return points
+
+def open_session_masks(capacity):
+    """
+    One bitmask per school with bit t set while session t + 1 still has capacity.
+    Python ints are used so any number of sessions fits.
+    """
+    return [sum(1 << t for t in np.flatnonzero(row > 0).tolist()) for row in capacity]
+
+def assign_bids(bid_students, bid_schools, remaining, n_sessions, student_free, school_open):
+    """
+    Greedy assignment shared by all matching algorithms.
+    
+    Walks the bids in order and gives each one the first session that both the
+    student and the school still have free. `remaining` is the capacity matrix
+    flattened row by row, `student_free` and `school_open` are the per-student and
+    per-school session bitmasks. All three are updated in place.
+    
+    Returns the (bid position, session index) pairs that were assigned.
+    """
+    assigned = []
+    for position, (i, j) in enumerate(zip(bid_students, bid_schools)):
+        # The lowest bit both masks share is the first session both have free
+        common = student_free[i] & school_open[j]
+        if not common:
+            continue
+        
+        bit = common & -common
+        t = bit.bit_length() - 1
+        cell = j * n_sessions + t
+        remaining[cell] -= 1
+        if remaining[cell] == 0:
+            school_open[j] &= ~bit
+        student_free[i] &= ~bit
+        assigned.append((position, t))
+    
+    return assigned
+
+def fill_open_sessions(student_free, school_open, remaining, n_sessions, attended):
+    """
+    Fallback phase: give every student a seat in each session they still have free.
+    
+    Each session has a queue of the schools that had capacity when the phase
+    started, in school order. A school that fills up is linked past for good
+    (a union-find "next open" pointer with path compression) and schools the
+    student already attends are skipped, so a fill costs amortized O(1). A school
+    the student already attends is only reused when nothing else is open. State
+    is updated in place like in assign_bids, and `attended` holds the set of
+    school indices of each student.
+    
+    Returns the (student index, school index, session index) fills and the
+    (student index, session index) pairs that could not be placed.
+    """
+    queues = [[j for j, mask in enumerate(school_open) if mask >> t & 1] for t in range(n_sessions)]
+    positions = [{j: k for k, j in enumerate(queue)} for queue in queues]
+    # next_open[t][k] leads to the first position >= k whose school is still open
+    next_open = [list(range(len(queue) + 1)) for queue in queues]
+    
+    def first_open(t, k):
+        links = next_open[t]
+        root = k
+        while links[root] != root:
+            root = links[root]
+        while links[k] != root:
+            links[k], k = root, links[k]
+        return root
+    
+    fills = []
+    unplaced = []
+    for i, free in enumerate(student_free):
+        while free:
+            bit = free & -free
+            t = bit.bit_length() - 1
+            free &= ~bit
+            
+            queue = queues[t]
+            k = first_open(t, 0)
+            if k == len(queue):
+                unplaced.append((i, t))
+                continue
+            
+            # Prefer an open school the student is not already attending
+            chosen = k
+            while chosen < len(queue) and queue[chosen] in attended[i]:
+                chosen = first_open(t, chosen + 1)
+            if chosen == len(queue):
+                chosen = k
+            j = queue[chosen]
+            
+            cell = j * n_sessions + t
+            remaining[cell] -= 1
+            if remaining[cell] == 0:
+                school_open[j] &= ~bit
+                next_open[t][positions[t][j]] = positions[t][j] + 1
+            student_free[i] &= ~bit
+            attended[i].add(j)
+            fills.append((i, j, t))
+    
+    return fills, unplaced
+
+def build_bid_arrays(points, tiebreakers, timings=None):
+    """
+    Turn every non-zero cell of the points matrix into a bid, held as parallel arrays
+    (student index, school index, points, tiebreaker) sorted by points (descending)
+    and then by tiebreaker (ascending). Records the 'bids' and 'sort' phases in
+    `timings`.
+    """
+    start = time.perf_counter()
+    student_idx, school_idx = np.nonzero(points > 0)
+    bid_points = points[student_idx, school_idx]
+    bid_tiebreakers = tiebreakers[student_idx, school_idx]
+    start = record_phase(timings, 'bids', start, len(bid_points))
+    
+    # lexsort uses the last key as the primary one and is stable, like list.sort
+    order = np.lexsort((bid_tiebreakers, -bid_points))
+    bids = student_idx[order], school_idx[order], bid_points[order], bid_tiebreakers[order]
+    record_phase(timings, 'sort', start, len(order))
+    return bids
+
+def greedy_bid_outcomes(points, tiebreakers, remaining, n_sessions, student_free, school_open, timings=None):
+    """
+    Run the greedy over every positive bid of the points matrix, holding bids as
+    parallel arrays. State is updated in place like in assign_bids.
+    
+    Returns the bid arrays and the session index each bid got (-1 if none).
+    """
+    bids = build_bid_arrays(points, tiebreakers, timings)
+    start = time.perf_counter()
+    assigned = assign_bids(bids[0].tolist(), bids[1].tolist(), remaining, n_sessions, student_free, school_open)
+    sessions = np.full(len(bids[0]), -1, dtype=np.int64)
+    if assigned:
+        positions, assigned_sessions = zip(*assigned)
+        sessions[list(positions)] = assigned_sessions
+    record_phase(timings, 'assignment', start, len(assigned))
+    return bids, sessions
+
+def greedy_assignments(points, tiebreakers, remaining, n_sessions, student_free, school_open, timings=None):
+    """
+    Like greedy_bid_outcomes, but returns the (student index, school index,
+    session index, points) assignments.
+    """
+    bids, sessions = greedy_bid_outcomes(points, tiebreakers, remaining, n_sessions, student_free, school_open,
+                                         timings)
+    return bid_assignments(bids, sessions)
+
+def bid_assignments(bids, sessions):
+    """
+    (student index, school index, session index, points) assignments of the bids
+    that got a session, in bid order
+    """
+    positions = np.flatnonzero(sessions >= 0)
+    return list(zip(bids[0][positions].tolist(), bids[1][positions].tolist(), sessions[positions].tolist(),
+                    bids[2][positions].tolist()))
+
+def replay_assignments(assignments, capacity, n_students):
+    """
+    Matching state (remaining, student_free, school_open, attended) left after
+    applying (student index, school index, session index, points) assignments to
+    a fresh capacity matrix
+    """
+    n_sessions = capacity.shape[1]
+    remaining = capacity.ravel().tolist()
+    student_free = [(1 << n_sessions) - 1] * n_students
+    school_open = open_session_masks(capacity)
+    attended = [set() for _ in range(n_students)]
+    for i, j, t, _ in assignments:
+        cell = j * n_sessions + t
+        remaining[cell] -= 1
+        if remaining[cell] == 0:
+            school_open[j] &= ~(1 << t)
+        student_free[i] &= ~(1 << t)
+        attended[i].add(j)
+    return remaining, student_free, school_open, attended
+
+def schedule_sessions(pairs, capacity):
+    """
+    Give every chosen (student index, school index) pair a session, such that each
+    student has at most one school per session and no school session goes over
+    capacity.
+    
+    This is bipartite edge colouring with sessions as colours. A pair is placed in
+    a session both sides have free when there is one. Otherwise a seat is freed in
+    a session the student has free (a) by moving a student of that school session
+    to a session the school has room in (b), swapping that student's other school
+    from b to a and continuing along the chain, as in the proof of Konig's
+    theorem. Pairs that still cannot be placed are returned separately.
+    
+    Returns the (student index, school index, session index) assignments and the
+    unscheduled pairs.
+    """
+    n_sessions = capacity.shape[1]
+    limit = capacity.tolist()
+    load = [[0] * n_sessions for _ in limit]
+    seats = [[set() for _ in range(n_sessions)] for _ in limit]  # school -> session -> students
+    sessions_of = {}  # student -> {session: school}
+    
+    def move(student, school, old, new):
+        seats[school][old].discard(student)
+        seats[school][new].add(student)
+        load[school][old] -= 1
+        load[school][new] += 1
+        if sessions_of[student].get(old) == school:
+            del sessions_of[student][old]
+        sessions_of[student][new] = school
+    
+    def free_seat(school, a, b, visited):
+        # Make room for one more student in (school, a), given that school has room in b
+        visited.add(school)
+        for student in list(seats[school][a]):
+            other = sessions_of[student].get(b)
+            if other is None:
+                move(student, school, a, b)
+                return True
+            if other in visited:
+                continue
+            # Swap the student's two schools between a and b
+            move(student, other, b, a)
+            move(student, school, a, b)
+            if load[other][a] <= limit[other][a] or free_seat(other, a, b, visited):
+                return True
+            move(student, school, b, a)
+            move(student, other, a, b)
+        return False
+    
+    unscheduled = []
+    for i, j in pairs:
+        taken = sessions_of.setdefault(i, {})
+        free = [t for t in range(n_sessions) if t not in taken]
+        t = next((t for t in free if load[j][t] < limit[j][t]), None)
+        if t is None:
+            rooms = [b for b in range(n_sessions) if load[j][b] < limit[j][b]]
+            t = next((a for a in free if limit[j][a] > 0
+                      for b in rooms if free_seat(j, a, b, set())), None)
+        if t is None:
+            unscheduled.append((i, j))
+            continue
+        taken[t] = j
+        seats[j][t].add(i)
+        load[j][t] += 1
+    
+    assignments = [
+        (i, j, t)
+        for i, taken in sessions_of.items()
+        for t, j in taken.items()
+    ]
+    return assignments, unscheduled
+
+def finish_greedy(assignments, capacity, n_students, algorithm_used, seed, fill=True, timings=None):
+    """
+    Package greedy (student index, school index, session index, points)
+    assignments as a solution. Unless `fill` is off, the fallback phase first gives
+    every student a seat in each session they still have free.
+    
+    A solution holds the assignments, the fallback fills and unplaced seats (None
+    without the fallback phase), the number of students with a bid assigned, the
+    capacity left per school and session, the seed and algorithm that made it and
+    the per-phase `timings` ({phase: {'seconds', 'items'}}, a new dict if None).
+    """
+    if timings is None:
+        timings = {}
+    remaining, student_free, school_open, attended = replay_assignments(assignments, capacity, n_students)
+    matched_students = len({assignment[0] for assignment in assignments})
+    
+    fallback = unplaced = None
+    if fill:
+        start = time.perf_counter()
+        fallback, unplaced = fill_open_sessions(student_free, school_open, remaining, capacity.shape[1], attended)
+        record_phase(timings, 'fallback', start, len(fallback))
+    
+    return {
+        'algorithm_used': algorithm_used,
+        'seed': seed,
+        'assignments': assignments,
+        'fallback': fallback,
+        'unplaced': unplaced,
+        'matched_students': matched_students,
+        'remaining': np.array(remaining, dtype=np.int64).reshape(capacity.shape),
+        'timings': timings
+    }
+
+def solve_improved(points, capacity, seed=None, timings=None):
+    """
+    Improved matching algorithm that:
+    1. Creates a sorted list of all bids with random tiebreakers
+    2. Includes ALL student preferences (not just top 6)
+    3. Processes bids in order, assigning students to sessions based on capacity
+    4. Ensures every student gets a seat in every session
+    """
+    if seed is None:
+        seed = new_seed()
+    if timings is None:
+        timings = {}
+    
+    tiebreakers = draw_tiebreakers(seed, points.shape)
+    remaining, student_free, school_open, _ = replay_assignments([], capacity, points.shape[0])
+    bids, sessions = greedy_bid_outcomes(points, tiebreakers, remaining, capacity.shape[1], student_free,
+                                         school_open, timings)
+    solution = finish_greedy(bid_assignments(bids, sessions), capacity, points.shape[0], 'improved_matching', seed,
+                             timings=timings)
+    
+    # Everything rematch_greedy needs to replay this run after a change
+    solution['greedy'] = {
+        'seed': seed,
+        'bids': bids,
+        'sessions': sessions,
+        'capacity': capacity.copy(),
+        'remaining': remaining,
+        'student_free': student_free,
+        'fallback': solution['fallback']
+    }
+    return solution
+
+def rematch_greedy(previous, changed_points, capacity, timings=None):
+    """
+    Incremental solve_improved after some students' points and/or the capacities
+    changed, for late changes to a large event.
+    
+    `previous` is the 'greedy' state of the last solve_improved or rematch_greedy
+    solution, `changed_points` maps student indices to their new rows of points
+    and `capacity` is the new capacity matrix. Only the changed bids move in the
+    bid order, so the greedy is replayed in lockstep with the previous run,
+    tracking just the differences in remaining capacity and free sessions. Bids
+    no difference can reach keep the session they got before and are skipped,
+    and the replay stops once no differences and no changed bids are left. The
+    fallback phase is then rerun on the final greedy state.
+    
+    Returns a solution like solve_improved without 'assignments', and with
+    'changes': the assignments and fallback fills removed and added.
+    """
+    if timings is None:
+        timings = {}
+    start = time.perf_counter()
+    seed = previous['seed']
+    old_students, old_schools, old_points, old_draws = previous['bids']
+    old_sessions = previous['sessions']
+    old_capacity = previous['capacity']
+    n_students = len(previous['student_free'])
+    n_old = len(old_students)
+    n_schools, n_sessions = capacity.shape
+    full_mask = (1 << n_sessions) - 1
+    
+    # Step 1: Bids whose points changed leave the old order, the new ones join it
+    changed_students = sorted(changed_points)
+    old_changed = np.zeros(len(old_students), dtype=bool)
+    mine = np.flatnonzero(np.isin(old_students, changed_students))
+    row_of = np.zeros(n_students, dtype=np.int64)
+    row_of[changed_students] = np.arange(len(changed_students))
+    old_rows = np.zeros((len(changed_students), n_schools), dtype=np.int64)
+    old_rows[row_of[old_students[mine]], old_schools[mine]] = old_points[mine]
+    new_rows = np.zeros_like(old_rows)
+    for k, i in enumerate(changed_students):
+        new_rows[k] = changed_points[i]
+    new_rows = np.maximum(new_rows, 0)  # only positive points are bids
+    differs = old_rows != new_rows
+    old_changed[mine] = differs[row_of[old_students[mine]], old_schools[mine]]
+    rows, add_schools = np.nonzero(differs & (new_rows > 0))
+    add_students = np.array(changed_students, dtype=np.int64)[rows]
+    add_draws = tiebreaker_rows(seed, (n_students, n_schools), changed_students)[rows, add_schools]
+    
+    keep = ~old_changed
+    new_students = np.concatenate((old_students[keep], add_students))
+    new_schools = np.concatenate((old_schools[keep], add_schools))
+    new_points = np.concatenate((old_points[keep], new_rows[rows, add_schools]))
+    new_draws = np.concatenate((old_draws[keep], add_draws))
+    new_changed = np.concatenate((np.zeros(keep.sum(), dtype=bool), np.ones(len(rows), dtype=bool)))
+    new_sessions = np.concatenate((old_sessions[keep], np.full(len(rows), -1, dtype=np.int64)))
+    # build_bid_arrays breaks full ties by cell order (np.nonzero is row-major and lexsort stable)
+    order = np.lexsort((new_students * n_schools + new_schools, new_draws, -new_points))
+    new_students, new_schools, new_points, new_draws = (
+        new_students[order], new_schools[order], new_points[order], new_draws[order]
+    )
+    new_changed = new_changed[order]
+    new_sessions = new_sessions[order]
+    
+    # Unchanged bids keep their relative order: rank = unchanged bids before a position
+    old_rank = np.cumsum(keep) - keep
+    new_rank = np.cumsum(~new_changed) - ~new_changed
+    old_changed_positions = np.flatnonzero(old_changed).tolist()
+    new_changed_positions = np.flatnonzero(new_changed).tolist()
+    start = record_phase(timings, 'bids', start, len(old_changed_positions) + len(new_changed_positions))
+    
+    # Step 2: State of the previous run before old position a, computed lazily
+    # from the positions of its bids and assignments per student, school and cell
+    def grouped(keys, n_groups):
+        order = np.argsort(keys, kind='stable')
+        return order, np.searchsorted(keys[order], np.arange(n_groups + 1)).tolist()
+    
+    def group(cache, positions, order, bounds, key):
+        if key not in cache:
+            cache[key] = positions[order[bounds[key]:bounds[key + 1]]].tolist()
+        return cache[key]
+    
+    assigned = np.flatnonzero(old_sessions >= 0)
+    by_cell = grouped(old_schools[assigned] * n_sessions + old_sessions[assigned], n_schools * n_sessions)
+    by_student = grouped(old_students, n_students)
+    by_school = grouped(old_schools, n_schools)
+    all_positions = np.arange(n_old)
+    cell_taken, student_bids, school_bids = {}, {}, {}
+    old_session_list = old_sessions.tolist()
+    old_ranks = old_rank.tolist()
+    new_ranks = new_rank.tolist()
+    old_capacity_cells = old_capacity.ravel().tolist()
+    
+    def old_left(c, a):
+        return old_capacity_cells[c] - bisect.bisect_left(group(cell_taken, assigned, *by_cell, c), a)
+    
+    def old_free(i, a):
+        mask = full_mask
+        for position in group(student_bids, all_positions, *by_student, i):
+            if position >= a:
+                break
+            if old_session_list[position] >= 0:
+                mask &= ~(1 << old_session_list[position])
+        return mask
+    
+    def next_rank(positions, a):
+        k = bisect.bisect_left(positions, a)
+        return old_ranks[positions[k]] if k < len(positions) else None
+    
+    # The new run's state is the old one plus these differences
+    capacity_change = (capacity - old_capacity).ravel()
+    diff_cells = {c: int(capacity_change[c]) for c in np.flatnonzero(capacity_change).tolist()}
+    diff_free = {}  # student -> new free mask ^ old free mask
+    
+    def place(i, j, a):
+        # Session the new run gives bid (i, j) when the previous run is at position a
+        free = old_free(i, a) ^ diff_free.get(i, 0)
+        for t in range(n_sessions):
+            c = j * n_sessions + t
+            if free >> t & 1 and old_left(c, a) + diff_cells.get(c, 0) > 0:
+                return t
+        return -1
+    
+    def shift(i, j, t, seat):
+        # Record a seat taken (seat = -1) or not taken (seat = +1) by the new run only
+        if t < 0:
+            return
+        c = j * n_sessions + t
+        diff_cells[c] = diff_cells.get(c, 0) + seat
+        if not diff_cells[c]:
+            del diff_cells[c]
+        diff_free[i] = diff_free.get(i, 0) ^ (1 << t)
+        if not diff_free[i]:
+            del diff_free[i]
+    
+    def difference_rank(kind, key, a):
+        # Rank of the next unchanged bid a difference can affect. A bid's outcome
+        # only depends on the student's free sessions and the school's open ones:
+        # a student whose free sessions differ can differ at their next bid, a
+        # school session open in one run only at the school's next bid, and a
+        # session whose remaining capacity differs at the next seat it gives out.
+        if kind == 0:
+            return next_rank(group(student_bids, all_positions, *by_student, key), a) if key in diff_free else None
+        if key not in diff_cells:
+            return None
+        left = old_left(key, a)
+        if (left > 0) != (left + diff_cells[key] > 0):
+            return next_rank(group(school_bids, all_positions, *by_school, key // n_sessions), a)
+        return next_rank(group(cell_taken, assigned, *by_cell, key), a)
+    
+    # Heap of (rank, kind, key) differences. Only the entry in `scheduled` is live
+    # for each difference, and it is checked again when it reaches the top.
+    differences = []
+    scheduled = {}
+    
+    def track(kind, key, a):
+        rank = difference_rank(kind, key, a)
+        if rank is None:
+            scheduled.pop((kind, key), None)
+        elif scheduled.get((kind, key)) != rank:
+            scheduled[kind, key] = rank
+            heapq.heappush(differences, (rank, kind, key))
+    
+    for c in diff_cells:
+        track(1, c, 0)
+    
+    def next_difference(a, b):
+        targets = []
+        for positions, ranks, position in ((old_changed_positions, old_ranks, a),
+                                           (new_changed_positions, new_ranks, b)):
+            k = bisect.bisect_left(positions, position)
+            if k < len(positions):
+                targets.append(ranks[positions[k]])
+        while differences:
+            rank, kind, key = differences[0]
+            if scheduled.get((kind, key)) == rank:
+                if difference_rank(kind, key, a) == rank:
+                    targets.append(rank)
+                    break
+                heapq.heappop(differences)
+                track(kind, key, a)
+            else:
+                heapq.heappop(differences)
+        return min(targets) if targets else None
+    
+    # Step 3: Lockstep replay, skipping to the next bid that can differ each time
+    removed = []
+    added = []
+    replayed = 0
+    a = b = 0
+    n_new = len(new_students)
+    while True:
+        target = next_difference(a, b)
+        if target is None:
+            break
+        a = max(a, bisect.bisect_left(old_ranks, target))
+        b = max(b, bisect.bisect_left(new_ranks, target))
+        if a == n_old and b == n_new:
+            break
+        
+        if a < n_old and old_changed[a]:
+            i, j, t = int(old_students[a]), int(old_schools[a]), int(old_sessions[a])
+            shift(i, j, t, 1)
+            if t >= 0:
+                removed.append((i, j, t, int(old_points[a])))
+            a += 1
+        elif b < n_new and new_changed[b]:
+            i, j = int(new_students[b]), int(new_schools[b])
+            t = place(i, j, a)
+            shift(i, j, t, -1)
+            if t >= 0:
+                new_sessions[b] = t
+                added.append((i, j, t, int(new_points[b])))
+            b += 1
+        else:
+            i, j, old_t = int(old_students[a]), int(old_schools[a]), int(old_sessions[a])
+            t = place(i, j, a)
+            if t != old_t:
+                shift(i, j, old_t, 1)
+                shift(i, j, t, -1)
+                new_sessions[b] = t
+                if old_t >= 0:
+                    removed.append((i, j, old_t, int(old_points[a])))
+                if t >= 0:
+                    added.append((i, j, t, int(new_points[b])))
+            a += 1
+            b += 1
+        replayed += 1
+        track(0, i, a)
+        for t in range(n_sessions):
+            track(1, j * n_sessions + t, a)
+    start = record_phase(timings, 'assignment', start, replayed)
+    
+    # Step 4: Final greedy state, then the fallback phase over it
+    remaining = list(previous['remaining'])
+    for c in np.flatnonzero(capacity_change).tolist():
+        remaining[c] += int(capacity_change[c])
+    student_free = list(previous['student_free'])
+    for i, j, t, _ in removed:
+        remaining[j * n_sessions + t] += 1
+        student_free[i] |= 1 << t
+    for i, j, t, _ in added:
+        remaining[j * n_sessions + t] -= 1
+        student_free[i] &= ~(1 << t)
+    greedy_state = {
+        'seed': seed,
+        'bids': (new_students, new_schools, new_points, new_draws),
+        'sessions': new_sessions,
+        'capacity': capacity.copy(),
+        'remaining': remaining,
+        'student_free': student_free
+    }
+    
+    remaining = list(remaining)
+    student_free = list(student_free)
+    school_open = open_session_masks(np.array(remaining, dtype=np.int64).reshape(capacity.shape))
+    attended = [None] * n_students
+    open_students = [i for i, free in enumerate(student_free) if free]
+    for i in open_students:
+        attended[i] = set()
+    picks = np.flatnonzero((new_sessions >= 0) & np.isin(new_students, open_students))
+    for i, j in zip(new_students[picks].tolist(), new_schools[picks].tolist()):
+        attended[i].add(j)
+    fallback, unplaced = fill_open_sessions(student_free, school_open, remaining, n_sessions, attended)
+    greedy_state['fallback'] = fallback
+    record_phase(timings, 'fallback', start, len(fallback))
+    
+    old_fallback = set(previous['fallback'])
+    new_fallback = set(fallback)
+    return {
+        'algorithm_used': 'improved_matching',
+        'seed': seed,
+        'fallback': fallback,
+        'unplaced': unplaced,
+        'matched_students': sum(1 for free in greedy_state['student_free'] if free != full_mask),
+        'remaining': np.array(remaining, dtype=np.int64).reshape(capacity.shape),
+        'timings': timings,
+        'greedy': greedy_state,
+        'changes': {
+            'assignments_removed': removed,
+            'assignments_added': added,
+            'fallback_removed': sorted(old_fallback - new_fallback),
+            'fallback_added': sorted(new_fallback - old_fallback),
+            'changed_bids': len(old_changed_positions) + len(new_changed_positions),
+            'replayed_bids': replayed,
+            'total_bids': n_new
+        }
+    }
+
+def top_k_bid_arrays(points, tiebreakers, k, timings=None):
+    """
+    Like build_bid_arrays, but only each student's first `k` bids in bid order.
+    
+    Two row-wise partial selections (np.partition) replace the global sort: the
+    first finds each student's k-th highest points, the second the smallest
+    tiebreakers among the bids tied at that value. Only the k bids per student
+    that survive are sorted into bid order. Records the 'top_k' and 'sort' phases
+    in `timings`.
+    """
+    start = time.perf_counter()
+    n_students, n_schools = points.shape
+    k = max(0, min(int(k), n_schools))
+    if k == 0 or points.size == 0:
+        keep = np.zeros(points.shape, dtype=bool)
+    else:
+        positive = np.where(points > 0, points, 0)
+        kth_points = -np.partition(-positive, k - 1, axis=1)[:, k - 1][:, np.newaxis]
+        above = positive > kth_points
+        tied = (positive > 0) & (positive == kth_points)
+        
+        # Of the bids tied at the k-th points, keep the ones with the smallest tiebreakers
+        need = k - above.sum(axis=1)
+        tied_draws = np.where(tied, tiebreakers, np.inf)
+        smallest = np.partition(tied_draws, np.arange(k), axis=1)
+        cutoff = smallest[np.arange(n_students), need - 1][:, np.newaxis]
+        keep = above | (tied & (tied_draws <= cutoff))
+    
+    student_idx, school_idx = np.nonzero(keep)
+    bid_points = points[student_idx, school_idx]
+    bid_tiebreakers = tiebreakers[student_idx, school_idx]
+    start = record_phase(timings, 'top_k', start, len(bid_points))
+    
+    # lexsort uses the last key as the primary one and is stable, like list.sort
+    order = np.lexsort((bid_tiebreakers, -bid_points))
+    bids = student_idx[order], school_idx[order], bid_points[order], bid_tiebreakers[order]
+    record_phase(timings, 'sort', start, len(order))
+    return bids
+
+def solve_simple(points, capacity, seed=None, top_k=DEFAULT_SIMPLE_TOP_K, timings=None):
+    """
+    Simple matching algorithm that:
+    1. Selects each student's top `top_k` bids (by points, then random tiebreaker)
+    2. Sorts only those bids by points and tiebreaker
+    3. Processes bids in order, assigning students to sessions based on capacity
+    """
+    if seed is None:
+        seed = new_seed()
+    if timings is None:
+        timings = {}
+    
+    n_students = points.shape[0]
+    tiebreakers = draw_tiebreakers(seed, points.shape)
+    bid_students, bid_schools, bid_points, _ = top_k_bid_arrays(points, tiebreakers, top_k, timings)
+    
+    start = time.perf_counter()
+    bid_students = bid_students.tolist()
+    bid_schools = bid_schools.tolist()
+    bid_points = bid_points.tolist()
+    remaining, student_free, school_open, _ = replay_assignments([], capacity, n_students)
+    assigned = assign_bids(bid_students, bid_schools, remaining, capacity.shape[1], student_free, school_open)
+    assignments = [
+        (bid_students[position], bid_schools[position], t, bid_points[position])
+        for position, t in assigned
+    ]
+    record_phase(timings, 'assignment', start, len(assignments))
+    return finish_greedy(assignments, capacity, n_students, 'simple_matching', seed, fill=False, timings=timings)
+
+def finish_visit_matching(points, tiebreakers, capacity, chosen, greedy, algorithm_used, seed, timings=None):
+    """
+    Shared tail of the engines that first choose which schools each student visits:
+    1. Schedules the chosen visits into sessions, then offers the seats left open
+       to the remaining bids in greedy order
+    2. Keeps the greedy assignments instead if they score higher
+    3. Fills the sessions left empty the same way as solve_improved
+    
+    The solution carries an `optimization` summary next to the greedy baseline.
+    """
+    n_students = points.shape[0]
+    n_sessions = capacity.shape[1]
+    greedy_objective = sum(assignment[3] for assignment in greedy)
+    upper_bound = sum(int(points[i, j]) for i, j in chosen)
+    
+    # Step 1: Schedule and repair
+    schedule_start = time.perf_counter()
+    scheduled, unscheduled = schedule_sessions(chosen, capacity)
+    assignments = [(i, j, t, int(points[i, j])) for i, j, t in scheduled]
+    remaining, student_free, school_open, attended = replay_assignments(assignments, capacity, n_students)
+    if unscheduled:
+        bid_students, bid_schools, bid_points, _ = build_bid_arrays(points, tiebreakers)
+        leftover = [
+            k for k, (i, j) in enumerate(zip(bid_students.tolist(), bid_schools.tolist()))
+            if j not in attended[i]
+        ]
+        repair_students = bid_students[leftover].tolist()
+        repair_schools = bid_schools[leftover].tolist()
+        for position, t in assign_bids(repair_students, repair_schools, remaining, n_sessions, student_free, school_open):
+            i, j = repair_students[position], repair_schools[position]
+            assignments.append((i, j, t, int(points[i, j])))
+    schedule_seconds = time.perf_counter() - schedule_start
+    record_phase(timings, 'schedule', schedule_start, len(assignments))
+    
+    # Step 2: Compare with the greedy baseline
+    objective = sum(assignment[3] for assignment in assignments)
+    solution_source = algorithm_used
+    if objective < greedy_objective:
+        assignments = greedy
+        objective = greedy_objective
+        solution_source = 'greedy'
+    
+    # Step 3: Ensure every student has a seat in every session
+    solution = finish_greedy(assignments, capacity, n_students, algorithm_used, seed, timings=timings)
+    solution['optimization'] = {
+        'solution_source': solution_source,
+        'objective': objective,
+        'upper_bound': upper_bound,
+        'unscheduled_visits': len(unscheduled),
+        'greedy_objective': greedy_objective,
+        'improvement': objective - greedy_objective,
+        'improvement_ratio': (objective - greedy_objective) / greedy_objective if greedy_objective else 0,
+        'schedule_seconds': schedule_seconds
+    }
+    return solution
+
+def _greedy_baseline(points, tiebreakers, capacity, timings=None):
+    remaining, student_free, school_open, _ = replay_assignments([], capacity, points.shape[0])
+    return greedy_assignments(points, tiebreakers, remaining, capacity.shape[1], student_free, school_open, timings)
+
+def solve_ilp(points, capacity, seed=None, time_limit=DEFAULT_ILP_TIME_LIMIT, gap_tolerance=DEFAULT_ILP_GAP_TOLERANCE,
+              timings=None):
+    """
+    Optimal matching algorithm that:
+    1. Runs the greedy for the same seed as a baseline and warm start
+    2. Solves an integer program with CBC choosing which schools each student
+       visits, maximizing total preference points with at most one school per
+       session for each student, at most the school's total capacity and at most
+       the number of seats all sessions offer
+    3. Schedules the chosen visits into sessions within the session capacities
+    4. Fills the sessions left empty the same way as solve_improved
+    
+    Step 2 is a bipartite assignment problem, so its LP relaxation is already
+    integral and CBC proves it optimal at the root. It is an upper bound on any
+    matching, so when step 3 places every visit the result is optimal.
+    CBC stops after `time_limit` seconds or once within `gap_tolerance` of the
+    optimum. The optimization summary reports the objective next to the greedy
+    baseline, and the greedy assignments are kept if the ILP result does not beat
+    them. PuLP is only imported here, so the other engines run without it.
+    """
+    import pulp
+    
+    if seed is None:
+        seed = new_seed()
+    
+    n_students = points.shape[0]
+    n_sessions = capacity.shape[1]
+    tiebreakers = draw_tiebreakers(seed, points.shape)
+    
+    # Step 1: Greedy baseline, used as the warm start
+    if timings is None:
+        timings = {}
+    greedy = _greedy_baseline(points, tiebreakers, capacity, timings)
+    greedy_pairs = {(i, j) for i, j, _, _ in greedy}
+    
+    # Step 2: One binary variable per bid on a school with any capacity
+    build_start = time.perf_counter()
+    school_capacity = capacity.sum(axis=1)
+    bid_students, bid_schools = np.nonzero((points > 0) & (school_capacity > 0)[np.newaxis, :])
+    pairs = list(zip(bid_students.tolist(), bid_schools.tolist()))
+    
+    problem = pulp.LpProblem('matching', pulp.LpMaximize)
+    variables = [pulp.LpVariable(f'x{k}', 0, 1, pulp.LpInteger) for k in range(len(pairs))]
+    problem += pulp.LpAffineExpression(
+        [(variables[k], int(points[i, j])) for k, (i, j) in enumerate(pairs)]
+    )
+    
+    by_student = {}
+    by_school = {}
+    for k, (i, j) in enumerate(pairs):
+        by_student.setdefault(i, []).append(k)
+        by_school.setdefault(j, []).append(k)
+    
+    # At most one school per session for each student
+    for ks in by_student.values():
+        if len(ks) > n_sessions:
+            problem += pulp.lpSum(variables[k] for k in ks) <= n_sessions
+    # Total capacity of each school over all sessions
+    for j, ks in by_school.items():
+        if len(ks) > school_capacity[j]:
+            problem += pulp.lpSum(variables[k] for k in ks) <= int(school_capacity[j])
+    # Seats available in each session across all schools
+    session_seats = int(np.minimum(capacity.sum(axis=0), n_students).sum())
+    if len(pairs) > session_seats:
+        problem += pulp.lpSum(variables) <= session_seats
+    
+    for k, pair in enumerate(pairs):
+        variables[k].setInitialValue(1 if pair in greedy_pairs else 0)
+    build_seconds = time.perf_counter() - build_start
+    solve_start = record_phase(timings, 'model_build', build_start, len(variables))
+    
+    solver = pulp.PULP_CBC_CMD(msg=False, timeLimit=time_limit, gapRel=gap_tolerance, warmStart=True)
+    status = problem.solve(solver)
+    solve_seconds = time.perf_counter() - solve_start
+    
+    chosen = [
+        pair
+        for pair, variable in zip(pairs, variables)
+        if variable.varValue is not None and variable.varValue > 0.5
+    ]
+    record_phase(timings, 'solve', solve_start, len(chosen))
+    
+    # Steps 3 and 4: Schedule and fill
+    solution = finish_visit_matching(points, tiebreakers, capacity, chosen, greedy, 'ilp', seed, timings)
+    optimization = solution['optimization']
+    optimization['solver_status'] = pulp.LpStatus[status]
+    optimization['proven_optimal'] = (
+        pulp.LpStatus[status] == 'Optimal' and optimization['solution_source'] == 'ilp'
+        and not optimization['unscheduled_visits']
+    )
+    optimization['variables'] = len(variables)
+    optimization['constraints'] = len(problem.constraints)
+    optimization['build_seconds'] = build_seconds
+    optimization['solve_seconds'] = solve_seconds
+    optimization['time_limit'] = time_limit
+    optimization['gap_tolerance'] = gap_tolerance
+    
+    return solution
+
+def max_weight_visits(points, tiebreakers, school_capacity, visits_per_student, max_visits):
+    """
+    Choose which schools each student visits to maximize total points, solved as a
+    min-cost flow on the network
+    
+        source -> student (capacity visits_per_student)
+               -> school (capacity 1, cost -points)
+               -> sink (capacity school_capacity)
+    
+    with at most `max_visits` units of flow, using successive shortest paths.
+    
+    Student nodes are condensed away. A path reaches a school either from the
+    source through a student with visits left (cost -p_ik), or from another school
+    j by moving one of its students over (cost p_ij - p_ik). The cheapest such move
+    for every pair of schools sits at the top of a lazily invalidated heap, so each
+    shortest path is a Dijkstra over schools only, with Johnson potentials keeping
+    reduced costs non-negative. Each augmentation is polynomial in the number of
+    schools and the run stops at the first path with no gain. Ties between equal
+    moves are broken by `tiebreakers`.
+    
+    Returns the chosen (student index, school index) pairs and the number of
+    augmenting paths.
+    """
+    n_students, n_schools = points.shape
+    gains = points.tolist()
+    draws = tiebreakers.tolist()
+    bids = [np.flatnonzero(row > 0).tolist() for row in points]
+    capacity = [int(c) for c in school_capacity]
+    load = [0] * n_schools
+    visits_left = [visits_per_student] * n_students
+    visiting = [set() for _ in range(n_students)]
+    
+    # entries[k]: students that could start visiting k, as (-points, tiebreaker, student)
+    entries = [[] for _ in range(n_schools)]
+    for i, row in enumerate(bids):
+        for k in row:
+            entries[k].append((-gains[i][k], draws[i][k], i))
+    for heap in entries:
+        heapq.heapify(heap)
+    # moves[(j, k)]: students visiting j that could visit k instead
+    moves = {}
+    
+    def add_visit(i, j):
+        visiting[i].add(j)
+        for k in bids[i]:
+            if k not in visiting[i]:
+                heapq.heappush(moves.setdefault((j, k), []), (gains[i][j] - gains[i][k], draws[i][k], i))
+    
+    def drop_visit(i, k):
+        visiting[i].discard(k)
+        for j in visiting[i]:
+            heapq.heappush(moves.setdefault((j, k), []), (gains[i][j] - gains[i][k], draws[i][k], i))
+        if visits_left[i] > 0:
+            heapq.heappush(entries[k], (-gains[i][k], draws[i][k], i))
+    
+    def best_entry(k):
+        heap = entries[k]
+        while heap and (visits_left[heap[0][2]] == 0 or k in visiting[heap[0][2]]):
+            heapq.heappop(heap)
+        return heap[0] if heap else None
+    
+    def best_move(j, k):
+        heap = moves.get((j, k))
+        while heap and (j not in visiting[heap[0][2]] or k in visiting[heap[0][2]]):
+            heapq.heappop(heap)
+        return heap[0] if heap else None
+    
+    # Initial potentials: the cheapest arc into each school, and below all of them for the sink
+    potential = [0] * n_schools
+    for k in range(n_schools):
+        top = best_entry(k)
+        potential[k] = top[0] if top else 0
+    sink = n_schools
+    sink_potential = min(potential, default=0)
+    
+    flow = 0
+    augmentations = 0
+    infinity = float('inf')
+    while flow < max_visits:
+        # Dijkstra over schools on reduced costs, stopping once the sink is settled
+        dist = [infinity] * n_schools
+        previous = [None] * n_schools  # (previous school or None for the source, student)
+        settled = [False] * n_schools
+        queue = []
+        for k in range(n_schools):
+            top = best_entry(k)
+            if top is not None:
+                dist[k] = top[0] - potential[k]
+                previous[k] = (None, top[2])
+                queue.append((dist[k], k))
+        heapq.heapify(queue)
+        sink_dist = infinity
+        last_school = None
+        
+        while queue:
+            d, u = heapq.heappop(queue)
+            if u == sink:
+                break
+            if settled[u] or d > dist[u]:
+                continue
+            settled[u] = True
+            if load[u] < capacity[u]:
+                nd = d + potential[u] - sink_potential
+                if nd < sink_dist:
+                    sink_dist = nd
+                    last_school = u
+                    heapq.heappush(queue, (nd, sink))
+            for k in range(n_schools):
+                if settled[k] or k == u:
+                    continue
+                top = best_move(u, k)
+                if top is None:
+                    continue
+                nd = d + top[0] + potential[u] - potential[k]
+                if nd < dist[k]:
+                    dist[k] = nd
+                    previous[k] = (u, top[2])
+                    heapq.heappush(queue, (nd, k))
+        
+        # Stop when no path is left or the best one no longer gains points
+        if last_school is None or sink_dist + sink_potential >= 0:
+            break
+        
+        for k in range(n_schools):
+            potential[k] += min(dist[k], sink_dist)
+        sink_potential += sink_dist
+        
+        # Augment one unit along the path, walking back from the sink
+        load[last_school] += 1
+        k = last_school
+        while True:
+            j, i = previous[k]
+            if j is None:
+                visits_left[i] -= 1
+                add_visit(i, k)
+                break
+            drop_visit(i, j)
+            add_visit(i, k)
+            k = j
+        flow += 1
+        augmentations += 1
+    
+    pairs = [(i, j) for i in range(n_students) for j in sorted(visiting[i])]
+    return pairs, augmentations
+
+def solve_flow(points, capacity, seed=None, timings=None):
+    """
+    Min-cost flow matching algorithm that:
+    1. Chooses which schools each student visits with max_weight_visits, an exact
+       network flow over students and schools that maximizes total preference
+       points within each school's total capacity
+    2. Schedules the chosen visits into sessions within the session capacities
+    3. Fills the sessions left empty the same way as solve_improved
+    
+    Step 1 is the same relaxation the ILP mode solves with CBC, solved here in
+    polynomial time without a solver. When step 2 places every visit the result
+    is optimal. The greedy result for the same seed is the baseline in the
+    optimization summary and is kept if it scores higher.
+    """
+    if seed is None:
+        seed = new_seed()
+    
+    if timings is None:
+        timings = {}
+    tiebreakers = draw_tiebreakers(seed, points.shape)
+    greedy = _greedy_baseline(points, tiebreakers, capacity, timings)
+    
+    # Step 1: Choose the visits
+    solve_start = time.perf_counter()
+    session_seats = int(np.minimum(capacity.sum(axis=0), points.shape[0]).sum())
+    chosen, augmentations = max_weight_visits(points, tiebreakers, capacity.sum(axis=1), capacity.shape[1], session_seats)
+    solve_seconds = time.perf_counter() - solve_start
+    record_phase(timings, 'solve', solve_start, augmentations)
+    
+    # Steps 2 and 3: Schedule and fill
+    solution = finish_visit_matching(points, tiebreakers, capacity, chosen, greedy, 'min_cost_flow', seed, timings)
+    optimization = solution['optimization']
+    optimization['proven_optimal'] = (
+        optimization['solution_source'] == 'min_cost_flow' and not optimization['unscheduled_visits']
+    )
+    optimization['augmenting_paths'] = augmentations
+    optimization['solve_seconds'] = solve_seconds
+    
+    return solution
+
+def top_choice_matrix(points, k=3):
+    """
+    Boolean students x schools matrix marking each student's top `k` schools by
+    points. Equal points are ranked by school order.
+    """
+    top = np.zeros(points.shape, dtype=bool)
+    if points.size == 0:
+        return top
+    k = min(k, points.shape[1])
+    order = np.argsort(-points, axis=1, kind='stable')[:, :k]
+    rows = np.arange(points.shape[0])[:, np.newaxis]
+    top[rows, order] = points[rows, order] > 0
+    return top
+
+def lottery_draw(points, capacity, top_choices, seed):
+    """
+    Run the greedy and fallback phases of solve_improved for one seed and
+    return its welfare metrics
+    """
+    n_sessions = capacity.shape[1]
+    remaining, student_free, school_open, _ = replay_assignments([], capacity, points.shape[0])
+    tiebreakers = draw_tiebreakers(seed, points.shape)
+    assignments = greedy_assignments(points, tiebreakers, remaining, n_sessions, student_free, school_open)
+    
+    attended = [set() for _ in range(points.shape[0])]
+    for i, j, t, _ in assignments:
+        attended[i].add(j)
+    fallback, unplaced = fill_open_sessions(student_free, school_open, remaining, n_sessions, attended)
+    
+    top_3_students = set(i for i, j, t, _ in assignments if top_choices[i, j])
+    return {
+        'seed': seed,
+        'total_points': sum(assignment[3] for assignment in assignments),
+        'fallback_placements': len(fallback),
+        'unplaced': len(unplaced),
+        'top_3_students': len(top_3_students)
+    }
+
+# Read-only inputs of the lottery worker processes, set once per worker
+_lottery_snapshot = None
+
+def _init_lottery_worker(points, capacity, top_choices):
+    global _lottery_snapshot
+    _lottery_snapshot = (points, capacity, top_choices)
+
+def _run_lottery_draw(seed):
+    points, capacity, top_choices = _lottery_snapshot
+    return lottery_draw(points, capacity, top_choices, seed)
+
+def _welfare_key(draw, welfare):
+    """
+    Sort key that puts the best draw first for the chosen welfare metric
+    """
+    keys = {
+        'total_points': -draw['total_points'],
+        'fewest_fallbacks': draw['fallback_placements'] + draw['unplaced'],
+        'top_3_students': -draw['top_3_students']
+    }
+    return tuple([keys[welfare]] + [keys[metric] for metric in LOTTERY_WELFARE_METRICS if metric != welfare])
+
+def solve_lottery(points, capacity, seed=None, draws=8, welfare='total_points', workers=None, timings=None):
+    """
+    Monte Carlo lottery matching algorithm that:
+    1. Derives `draws` seeds from `seed` (a fresh one is picked when omitted)
+    2. Runs the greedy of solve_improved once per seed in a pool of `workers`
+       processes (all cores by default), each holding one read-only copy of the
+       points and capacity matrices
+    3. Keeps the draw that scores best on `welfare` and returns solve_improved
+       for its seed
+    
+    Every draw's seed and metrics are reported under `lottery`, so the winner can
+    be reproduced with solve_improved(seed=winning_seed).
+    """
+    if welfare not in LOTTERY_WELFARE_METRICS:
+        raise ValueError(f"Unknown welfare metric '{welfare}'")
+    
+    if seed is None:
+        seed = new_seed()
+    draws = max(1, int(draws))
+    seeds = [int(s) for s in np.random.SeedSequence(seed).generate_state(draws)]
+    workers = max(1, min(int(workers or os.cpu_count() or 1), draws))
+    top_choices = top_choice_matrix(points, 3)
+    
+    # Run the draws
+    lottery_start = time.perf_counter()
+    if workers == 1:
+        results = [lottery_draw(points, capacity, top_choices, draw_seed) for draw_seed in seeds]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_lottery_worker,
+                                 initargs=(points, capacity, top_choices)) as pool:
+            results = list(pool.map(_run_lottery_draw, seeds))
+    lottery_seconds = time.perf_counter() - lottery_start
+    if timings is None:
+        timings = {}
+    record_phase(timings, 'draws', lottery_start, draws)
+    
+    winner = min(results, key=lambda draw: _welfare_key(draw, welfare))
+    
+    solution = solve_improved(points, capacity, winner['seed'], timings)
+    solution['lottery'] = {
+        'base_seed': seed,
+        'welfare': welfare,
+        'winning_seed': winner['seed'],
+        'winner': winner,
+        'draws': results,
+        'workers': workers,
+        'seconds': lottery_seconds
+    }
+    return solution
+
+# Engines by the algorithm name /api/preferences/process and run_matching.py accept
+ENGINES = {
+    'improved_matching': solve_improved,
+    'simple_matching': solve_simple,
+    'ilp': solve_ilp,
+    'min_cost_flow': solve_flow,
+    'lottery': solve_lottery
+}
+
+def solve(algorithm, points, capacity, **options):
+    """
+    Run the engine registered under `algorithm` with its keyword options
+    """
+    if algorithm not in ENGINES:
+        raise ValueError(f"Unknown matching algorithm '{algorithm}'")
+    return ENGINES[algorithm](points, capacity, **options)
+
+def inputs_hash(points, capacity, student_ids, school_ids):
+    """
+    SHA-256 of the inputs of a run: the student and school ids, the capacities and
+    the positive points (the only ones that make bids), as a hex string
+    """
+    student_idx, school_idx = np.nonzero(points > 0)
+    return _hash_arrays(student_ids, school_ids, capacity, student_idx, school_idx, points[student_idx, school_idx])
+
+def greedy_inputs_hash(state, student_ids, school_ids):
+    """
+    inputs_hash of the inputs a 'greedy' state was solved from, taken from its
+    bids put back in cell order
+    """
+    bid_students, bid_schools, bid_points, _ = state['bids']
+    order = np.lexsort((bid_schools, bid_students))
+    return _hash_arrays(student_ids, school_ids, state['capacity'], bid_students[order], bid_schools[order],
+                        bid_points[order])
+
+def _hash_arrays(*arrays):
+    digest = hashlib.sha256()
+    for array in arrays:
+        array = np.ascontiguousarray(array, dtype=np.int64)
+        digest.update(str(array.shape).encode())
+        digest.update(array.tobytes())
+    return digest.hexdigest()
+
+def save_snapshot(path, points, capacity, student_ids, school_ids, student_names=None, school_names=None):
+    """
+    Write the inputs of a matching run to a compressed .npz file, so it can be
+    rerun later without the database
+    """
+    arrays = {
+        'points': points,
+        'capacity': capacity,
+        'student_ids': np.asarray(student_ids, dtype=np.int64),
+        'school_ids': np.asarray(school_ids, dtype=np.int64)
+    }
+    if student_names is not None:
+        arrays['student_names'] = np.asarray(student_names, dtype=str)
+    if school_names is not None:
+        arrays['school_names'] = np.asarray(school_names, dtype=str)
+    np.savez_compressed(path, **arrays)
+
+def load_snapshot(path):
+    """
+    Read a snapshot written by save_snapshot back into a dict of arrays
+    """
+    with np.load(path) as data:
+        return {key: data[key] for key in data.files}
+
+def save_greedy_state(path, state, student_ids, school_ids, run_id=None):
+    """
+    Write the 'greedy' state of a solve_improved or rematch_greedy solution to an
+    .npz file (a path or a binary file object), with the student and school ids its indices stand for and the id
+    of the stored run it produced
+    """
+    bid_students, bid_schools, bid_points, bid_tiebreakers = state['bids']
+    np.savez(
+        path,
+        seed=np.array(state['seed'], dtype=np.int64),
+        bid_students=bid_students,
+        bid_schools=bid_schools,
+        bid_points=bid_points,
+        bid_tiebreakers=bid_tiebreakers,
+        sessions=state['sessions'],
+        capacity=state['capacity'],
+        fallback=np.array(state['fallback'], dtype=np.int64).reshape(-1, 3),
+        student_ids=np.asarray(student_ids, dtype=np.int64),
+        school_ids=np.asarray(school_ids, dtype=np.int64),
+        run_id=np.array(-1 if run_id is None else run_id, dtype=np.int64)
+    )
+
+def load_greedy_state(path):
+    """
+    Read a state written by save_greedy_state. The greedy's remaining capacity and
+    free sessions are rebuilt from the assignments.
+    
+    Returns the state, the student ids, the school ids and the run id (None if
+    it was not given).
+    """
+    with np.load(path) as data:
+        arrays = {key: data[key] for key in data.files}
+    bids = (arrays['bid_students'], arrays['bid_schools'], arrays['bid_points'], arrays['bid_tiebreakers'])
+    sessions = arrays['sessions']
+    remaining, student_free, _, _ = replay_assignments(
+        bid_assignments(bids, sessions), arrays['capacity'], len(arrays['student_ids'])
+    )
+    state = {
+        'seed': int(arrays['seed']),
+        'bids': bids,
+        'sessions': sessions,
+        'capacity': arrays['capacity'],
+        'remaining': remaining,
+        'student_free': student_free,
+        'fallback': [tuple(fill) for fill in arrays['fallback'].tolist()]
+    }
+    run_id = int(arrays['run_id']) if 'run_id' in arrays else -1
+    return state, arrays['student_ids'], arrays['school_ids'], None if run_id < 0 else run_id
@@ -0,0 +1,93 @@
+"""
+Conditional GET for the read endpoints. Their responses only change when the
+data does, and every change increments the data version (database.DataVersion),
+so the version is a strong ETag for all of them: a request whose If-None-Match
+holds it gets a 304 without the view running.
+
+Otherwise the serialized body is kept in an in-process cache, keyed by the
+request path and query string, and served as is until the version moves on.
+The version lives in the database, so changes made by other processes (the
+command line, update_school.py) invalidate the cache too. Compressed bodies are
+kept with the cached one, so each is compressed once per version.
+"""
+import os
+import threading
+from collections import OrderedDict
+from functools import wraps
+from flask import Response, make_response, request
+from compression import COMPRESSIBLE_MIMETYPES, ENCODINGS, compress, encode_response, negotiate
+from database import data_version
+
+# Number of serialized responses kept, least recently used ones are dropped first
+RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', 256))
+
+_responses = OrderedDict()
+_responses_lock = threading.Lock()
+
+def _cached(key, version):
+    with _responses_lock:
+        entry = _responses.get(key)
+        if entry is None or entry[0] != version:
+            return None
+        _responses.move_to_end(key)
+        return entry
+
+def _store(key, version, response):
+    entry = (version, response.get_data(), response.mimetype, {})
+    with _responses_lock:
+        _responses[key] = entry
+        _responses.move_to_end(key)
+        while len(_responses) > RESPONSE_CACHE_SIZE:
+            _responses.popitem(last=False)
+    return entry
+
+def _encoded(entry, encoding):
+    """
+    The body of a cache entry compressed with `encoding` and the seconds that
+    took, compressed on first use and kept with the entry
+    """
+    with _responses_lock:
+        encoded = entry[3].get(encoding)
+    if encoded is None:
+        encoded = compress(entry[1], encoding)
+        with _responses_lock:
+            entry[3][encoding] = encoded
+    return encoded
+
+def conditional(view):
+    """
+    Decorate a GET view with the data version ETag: 304 on a matching
+    If-None-Match, the cached body while the version is unchanged, and the view
+    otherwise. Only 200 responses are cached, each compressed body with them
+    (the ETag then gets the encoding as a suffix); clients revalidate every time
+    (Cache-Control: no-cache).
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        version = data_version()
+        etags = [str(version)] + [f'{version}-{encoding}' for encoding in ENCODINGS]
+        matched = next((etag for etag in etags if request.if_none_match.contains(etag)), None)
+        if matched is not None:
+            response = Response(status=304)
+            response.set_etag(matched)
+            response.vary.add('Accept-Encoding')
+        else:
+            key = request.full_path
+            entry = _cached(key, version)
+            if entry is None:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                entry = _store(key, version, response)
+            
+            response = Response(entry[1], mimetype=entry[2])
+            response.set_etag(etags[0])
+            encoding = negotiate(len(entry[1]), entry[2])
+            if encoding is not None:
+                encode_response(response, encoding, *_encoded(entry, encoding), len(entry[1]))
+            elif entry[2] in COMPRESSIBLE_MIMETYPES:
+                response.vary.add('Accept-Encoding')
+        
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    return wrapper
@@ -0,0 +1,144 @@
+"""
+Roster bundle of a matching run for /api/results/rosters: a zip with one
+workbook per school and one sheet per session listing the students placed there.
+
+The results are read in one pass, ordered by school and session, and grouped
+per school before the response starts, so a failing query is an error response
+rather than a truncated zip. The schools' workbooks are then built by a pool of
+worker processes, shared by all requests, and added to the zip in the order they
+finish. The zip is streamed as it grows, so the first schools reach the client
+while the others are still being built.
+"""
+import io
+import itertools
+import os
+import threading
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from openpyxl import Workbook
+from werkzeug.utils import secure_filename
+from database import db, Student, School, MatchingResult
+
+# Worker processes building the workbooks (1 builds them in the request's process)
+ROSTER_WORKERS = int(os.getenv('ROSTER_WORKERS', os.cpu_count() or 1))
+
+# Result rows fetched per round trip of the grouped pass
+ROSTER_FETCH_SIZE = 5000
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _workers_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=ROSTER_WORKERS)
+        return _pool
+
+ROSTER_COLUMNS = ('Student Name', 'Email', 'Match Score')
+
+def roster_workbook(sessions):
+    """
+    The xlsx bytes of one school's roster: a sheet per session of `sessions`
+    (session number, rows of ROSTER_COLUMNS values), in order. Runs in the workers.
+    """
+    workbook = Workbook(write_only=True)
+    for session_number, rows in sessions:
+        sheet = workbook.create_sheet(f'Session {session_number}')
+        sheet.append(ROSTER_COLUMNS)
+        for row in rows:
+            sheet.append(row)
+    output = io.BytesIO()
+    workbook.save(output)
+    return output.getvalue()
+
+def school_rosters(run_id, session_count):
+    """
+    (zip file name, sessions) of every school placed in run `run_id`, from one
+    query ordered by school, session and student name. `sessions` has an entry,
+    empty or not, for each of the `session_count` sessions.
+    """
+    rows = db.session.query(
+        MatchingResult.school_id, School.school_name, MatchingResult.session_number,
+        Student.first_name, Student.last_name, Student.email, db.func.coalesce(MatchingResult.preference_score, 0)
+    ).join(Student, Student.id == MatchingResult.student_id)\
+        .join(School, School.id == MatchingResult.school_id)\
+        .filter(MatchingResult.run_id == run_id)\
+        .order_by(School.school_name, MatchingResult.school_id, MatchingResult.session_number,
+                  Student.last_name, Student.first_name, MatchingResult.id)\
+        .yield_per(ROSTER_FETCH_SIZE)
+    
+    rosters = []
+    used = set()
+    for (school_id, school_name), school_rows in itertools.groupby(rows, key=lambda row: (row[0], row[1])):
+        placed = {session_number: [] for session_number in range(1, session_count + 1)}
+        for _, _, session_number, first_name, last_name, email, points in school_rows:
+            placed.setdefault(session_number, []).append((f"{first_name} {last_name}", email, points))
+        rosters.append((_filename(school_id, school_name, used), sorted(placed.items())))
+    return rosters
+
+class _ZipStream:
+    """
+    Write-only, unseekable file collecting what zipfile writes until it is taken
+    (zipfile then writes data descriptors instead of seeking back)
+    """
+    def __init__(self):
+        self.chunks = []
+    
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+    
+    def flush(self):
+        pass
+    
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def _filename(school_id, school_name, used):
+    name = secure_filename(school_name) or f'school_{school_id}'
+    if name in used:
+        name = f'{name}_{school_id}'
+    used.add(name)
+    return f'{name}.xlsx'
+
+def roster_bundle(rosters):
+    """
+    Generator of the bytes of the zip of `rosters` (see school_rosters), yielding
+    each time a workbook has been added. Workbooks are already compressed, so they
+    are stored as they are. At most twice ROSTER_WORKERS schools are in the
+    shared pool per request at a time.
+    """
+    stream = _ZipStream()
+    bundle = zipfile.ZipFile(stream, 'w', zipfile.ZIP_STORED)
+    
+    def add(filename, data):
+        bundle.writestr(filename, data)
+        return stream.take()
+    
+    if ROSTER_WORKERS <= 1:
+        for filename, sessions in rosters:
+            yield add(filename, roster_workbook(sessions))
+    else:
+        pool = _workers_pool()
+        pending = {}
+        try:
+            for filename, sessions in rosters:
+                pending[pool.submit(roster_workbook, sessions)] = filename
+                if len(pending) >= 2 * ROSTER_WORKERS:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield add(pending.pop(future), future.result())
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield add(pending.pop(future), future.result())
+        finally:
+            # A client that went away leaves nothing queued in the shared pool
+            for future in pending:
+                future.cancel()
+    
+    bundle.close()
+    yield stream.take()
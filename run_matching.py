@@ -0,0 +1,302 @@
+"""
+Run a matching engine from the command line without starting the Flask app.
+
+Inputs come from the SQLite database, from the configuration and preferences CSV
+files the web pages accept, or from a snapshot written with --save-snapshot.
+Results are written as CSV and, for a database input, can be recorded as a new
+matching run that becomes the current one.
+
+    python run_matching.py --db matchWZRD.db --algorithm min_cost_flow --seed 7 --output results.csv
+    python run_matching.py --config config.csv --preferences preferences.csv --output results.csv
+"""
+import argparse
+import csv
+import json
+import os
+import re
+import sqlite3
+import sys
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+from matching_core import (
+    ENGINES, LOTTERY_WELFARE_METRICS, DEFAULT_SIMPLE_TOP_K, DEFAULT_ILP_TIME_LIMIT, DEFAULT_ILP_GAP_TOLERANCE, points_matrix, solve,
+    save_snapshot, load_snapshot, inputs_hash
+)
+
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'matchWZRD.db')
+
+# Columns of the CSV files, as used by the configuration and preferences pages
+SCHOOL_NAME_COLUMN = 'School Name'
+SESSION_CAPACITY_COLUMN = re.compile(r'^Capacity Breakout Session (\d+)$')
+STUDENT_COLUMNS = ('First Name', 'Last Name', 'Email', 'Total')
+
+def load_sqlite(path):
+    """
+    Read students, schools and preferences straight from the SQLite database
+    """
+    connection = sqlite3.connect(path)
+    try:
+        session_columns = sorted(
+            (int(match.group(1)), name)
+            for _, name, *_ in connection.execute('PRAGMA table_info(schools)')
+            for match in [re.match(r'^session(\d+)_capacity$', name)] if match
+        )
+        columns = ', '.join(name for _, name in session_columns)
+        schools = connection.execute(f'SELECT id, school_name, {columns} FROM schools ORDER BY id').fetchall()
+        students = connection.execute(
+            'SELECT id, first_name, last_name, email FROM students ORDER BY id'
+        ).fetchall()
+        rows = connection.execute('SELECT student_id, school_id, points FROM preferences').fetchall()
+    finally:
+        connection.close()
+    
+    student_ids = [student[0] for student in students]
+    school_ids = [school[0] for school in schools]
+    return {
+        'points': points_matrix(student_ids, school_ids, rows),
+        'capacity': np.array([[value or 0 for value in school[2:]] for school in schools], dtype=np.int64)
+        .reshape(len(schools), len(session_columns)),
+        'student_ids': np.array(student_ids, dtype=np.int64),
+        'school_ids': np.array(school_ids, dtype=np.int64),
+        'student_names': np.array([f"{student[1]} {student[2]}" for student in students], dtype=str),
+        'school_names': np.array([school[1] for school in schools], dtype=str)
+    }
+
+def _number(value):
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return 0
+
+def load_csv(config_path, preferences_path):
+    """
+    Read schools from a configuration CSV (School Name, Capacity Breakout Session N)
+    and students from a preferences CSV (First Name, Last Name, Email and one points
+    column per school name). Ids are the row numbers, starting at 1.
+    """
+    with open(config_path, newline='', encoding='utf-8-sig') as config_file:
+        reader = csv.DictReader(config_file)
+        session_columns = sorted(
+            (int(match.group(1)), name)
+            for name in reader.fieldnames
+            for match in [SESSION_CAPACITY_COLUMN.match(name.strip())] if match
+        )
+        schools = [row for row in reader if (row.get(SCHOOL_NAME_COLUMN) or '').strip()]
+    school_names = [' '.join(row[SCHOOL_NAME_COLUMN].split()) for row in schools]
+    capacity = np.array(
+        [[_number(row[name]) for _, name in session_columns] for row in schools], dtype=np.int64
+    ).reshape(len(schools), len(session_columns))
+    
+    with open(preferences_path, newline='', encoding='utf-8-sig') as preferences_file:
+        reader = csv.DictReader(preferences_file)
+        school_positions = {name: j for j, name in enumerate(school_names)}
+        school_columns = [
+            (column, school_positions[' '.join(column.split())])
+            for column in reader.fieldnames
+            if column not in STUDENT_COLUMNS and ' '.join(column.split()) in school_positions
+        ]
+        students = list(reader)
+    
+    points = np.zeros((len(students), len(schools)), dtype=np.int64)
+    for i, row in enumerate(students):
+        for column, j in school_columns:
+            points[i, j] = _number(row[column])
+    
+    return {
+        'points': points,
+        'capacity': capacity,
+        'student_ids': np.arange(1, len(students) + 1, dtype=np.int64),
+        'school_ids': np.arange(1, len(schools) + 1, dtype=np.int64),
+        'student_names': np.array([f"{row.get('First Name', '')} {row.get('Last Name', '')}" for row in students], dtype=str),
+        'school_names': np.array(school_names, dtype=str)
+    }
+
+def result_rows(inputs, solution):
+    """
+    (student id, school id, session number, points, algorithm) rows of a solution,
+    with fallback fills tagged '<algorithm>_fallback' and scored with the points
+    the student gave the school (0 without a preference), as the export does
+    """
+    student_ids = inputs['student_ids'].tolist()
+    points = inputs['points']
+    school_ids = inputs['school_ids'].tolist()
+    algorithm_used = solution['algorithm_used']
+    rows = [
+        (student_ids[i], school_ids[j], t + 1, points, algorithm_used)
+        for i, j, t, points in solution['assignments']
+    ]
+    rows.extend(
+        (student_ids[i], school_ids[j], t + 1, int(points[i, j]), f'{algorithm_used}_fallback')
+        for i, j, t in solution['fallback'] or []
+    )
+    return rows
+
+def write_csv(path, inputs, rows):
+    student_names = dict(zip(inputs['student_ids'].tolist(), inputs['student_names'].tolist())) if 'student_names' in inputs else {}
+    school_names = dict(zip(inputs['school_ids'].tolist(), inputs['school_names'].tolist())) if 'school_names' in inputs else {}
+    with open(path, 'w', newline='', encoding='utf-8') as output:
+        writer = csv.writer(output)
+        writer.writerow(['Student ID', 'Student Name', 'School ID', 'School', 'Session', 'Match Score', 'Algorithm'])
+        for student_id, school_id, session_number, points, algorithm_used in rows:
+            writer.writerow([student_id, student_names.get(student_id, ''), school_id,
+                             school_names.get(school_id, ''), session_number, points, algorithm_used])
+
+def write_sqlite(path, rows, solution, input_hash=None):
+    """
+    Record `rows` of `solution` in the SQLite database as a new matching run,
+    which becomes the current one, and delete the runs beyond the last
+    MATCHING_RUN_RETENTION. A database from before runs were recorded has its
+    matching_results replaced instead.
+    """
+    created_at = str(datetime.now(timezone.utc).replace(tzinfo=None))  # naive UTC, like the ORM default
+    connection = sqlite3.connect(path)
+    try:
+        with connection:
+            columns = [name for _, name, *_ in connection.execute('PRAGMA table_info(matching_results)')]
+            if 'run_id' not in columns:
+                connection.execute('DELETE FROM matching_results')
+                connection.executemany(
+                    'INSERT INTO matching_results (student_id, school_id, session_number, algorithm_used, created_at) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    [(student_id, school_id, session_number, algorithm_used, created_at)
+                     for student_id, school_id, session_number, _, algorithm_used in rows]
+                )
+                return
+            
+            # One transaction: the run is published together with its results
+            run_id = connection.execute(
+                'INSERT INTO matching_runs (algorithm, seed, input_hash, timings, summary, created_at, published_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                ('lottery' if 'lottery' in solution else solution['algorithm_used'], solution['seed'], input_hash,
+                 json.dumps(solution['timings'], default=str), json.dumps({'rows': len(rows)}), created_at, created_at)
+            ).lastrowid
+            if 'preference_score' in columns:
+                connection.executemany(
+                    'INSERT INTO matching_results '
+                    '(run_id, student_id, school_id, session_number, algorithm_used, preference_score, created_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    [(run_id, student_id, school_id, session_number, algorithm_used, points, created_at)
+                     for student_id, school_id, session_number, points, algorithm_used in rows]
+                )
+            else:
+                connection.executemany(
+                    'INSERT INTO matching_results (run_id, student_id, school_id, session_number, algorithm_used, created_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    [(run_id, student_id, school_id, session_number, algorithm_used, created_at)
+                     for student_id, school_id, session_number, _, algorithm_used in rows]
+                )
+            keep = max(1, int(os.getenv('MATCHING_RUN_RETENTION', 10)))
+            old_runs = ('SELECT id FROM matching_runs WHERE published_at IS NOT NULL '
+                        'ORDER BY published_at DESC, id DESC LIMIT -1 OFFSET ?')
+            connection.execute(f'DELETE FROM matching_results WHERE run_id IN ({old_runs})', (keep,))
+            connection.execute(f'DELETE FROM matching_runs WHERE id IN ({old_runs})', (keep,))
+            # Invalidate the web app's cached responses, as database.bump_data_version does
+            if connection.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'data_version'").fetchone():
+                if not connection.execute('UPDATE data_version SET version = version + 1').rowcount:
+                    connection.execute('INSERT INTO data_version (id, version) VALUES (1, 1)')
+    finally:
+        connection.close()
+
+def engine_options(args):
+    """
+    Keyword options of the chosen engine taken from the command line
+    """
+    options = {'seed': args.seed}
+    if args.algorithm == 'simple_matching':
+        options.update(top_k=args.top_k)
+    elif args.algorithm == 'ilp':
+        options.update(time_limit=args.time_limit, gap_tolerance=args.gap_tolerance)
+    elif args.algorithm == 'lottery':
+        options.update(draws=args.draws, welfare=args.welfare, workers=args.workers)
+    return options
+
+def summary(solution, rows, seconds):
+    """
+    JSON-friendly summary of a run printed at the end
+    """
+    result = {
+        'algorithm': solution['algorithm_used'],
+        'seed': solution['seed'],
+        'assignments': len(solution['assignments']),
+        'total_points': sum(assignment[3] for assignment in solution['assignments']),
+        'matched_students': solution['matched_students'],
+        'rows': len(rows),
+        'seconds': seconds
+    }
+    if solution['fallback'] is not None:
+        result['fallback_placements'] = len(solution['fallback'])
+        result['unplaced'] = len(solution['unplaced'])
+    for key in ('optimization', 'lottery'):
+        if key in solution:
+            result[key] = solution[key]
+    result['timings'] = solution['timings']
+    return result
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Run a MatchWZRD matching engine without the web app.')
+    source = parser.add_argument_group('input (one of)')
+    source.add_argument('--db', help=f'SQLite database to read (default {DEFAULT_DB_PATH})')
+    source.add_argument('--config', help='configuration CSV (School Name, Capacity Breakout Session N)')
+    source.add_argument('--preferences', help='preferences CSV (First Name, Last Name, Email, one column per school)')
+    source.add_argument('--snapshot', help='snapshot .npz written with --save-snapshot')
+    
+    parser.add_argument('--algorithm', choices=sorted(ENGINES), default='improved_matching')
+    parser.add_argument('--seed', type=int, help='tiebreaker seed (a fresh one is picked when omitted)')
+    parser.add_argument('--top-k', type=int, default=DEFAULT_SIMPLE_TOP_K, help='simple_matching: bids kept per student')
+    parser.add_argument('--time-limit', type=float, default=DEFAULT_ILP_TIME_LIMIT, help='ilp: CBC time limit in seconds')
+    parser.add_argument('--gap-tolerance', type=float, default=DEFAULT_ILP_GAP_TOLERANCE, help='ilp: relative MIP gap')
+    parser.add_argument('--draws', type=int, default=8, help='lottery: number of seeded draws')
+    parser.add_argument('--welfare', choices=LOTTERY_WELFARE_METRICS, default='total_points', help='lottery: winning metric')
+    parser.add_argument('--workers', type=int, help='lottery: worker processes (all cores by default)')
+    
+    parser.add_argument('--output', help='write the results to this CSV file')
+    parser.add_argument('--write-db', action='store_true', help='record the results as a new matching run in --db')
+    parser.add_argument('--save-snapshot', help='write the loaded inputs to this .npz file')
+    
+    args = parser.parse_args(argv)
+    if bool(args.config) != bool(args.preferences):
+        parser.error('--config and --preferences must be given together')
+    if sum(bool(source) for source in (args.db, args.config, args.snapshot)) > 1:
+        parser.error('choose one input: --db, --config/--preferences or --snapshot')
+    if not (args.config or args.snapshot):
+        args.db = args.db or DEFAULT_DB_PATH
+    if args.write_db and not args.db:
+        parser.error('--write-db needs a --db input')
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    
+    if args.snapshot:
+        inputs = load_snapshot(args.snapshot)
+    elif args.config:
+        inputs = load_csv(args.config, args.preferences)
+    else:
+        if not os.path.exists(args.db):
+            print(f'Database not found: {args.db}', file=sys.stderr)
+            return 1
+        inputs = load_sqlite(args.db)
+    
+    if args.save_snapshot:
+        save_snapshot(args.save_snapshot, inputs['points'], inputs['capacity'], inputs['student_ids'],
+                      inputs['school_ids'], inputs.get('student_names'), inputs.get('school_names'))
+    
+    start = time.perf_counter()
+    solution = solve(args.algorithm, inputs['points'], inputs['capacity'], **engine_options(args))
+    seconds = time.perf_counter() - start
+    rows = result_rows(inputs, solution)
+    
+    if args.output:
+        write_csv(args.output, inputs, rows)
+    if args.write_db:
+        write_sqlite(args.db, rows, solution, inputs_hash(inputs['points'], inputs['capacity'],
+                                                          inputs['student_ids'], inputs['school_ids']))
+    
+    print(json.dumps(summary(solution, rows, seconds), indent=2, default=str))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,132 @@
+"""
+Seeded synthetic cohorts for benchmarking the matching engines and endpoints.
+
+A cohort has the same shape as real event data: every student spreads a budget
+of points over a handful of schools, school popularity follows a Zipf-like law so
+a few schools draw most of the points, and session capacities give roughly
+`seat_ratio` seats per student in each session, weighted towards popular schools.
+"""
+import numpy as np
+
+# Cohort sizes used by benchmark.py
+COHORT_PRESETS = {
+    'small': {'n_students': 500, 'n_schools': 10},
+    'medium': {'n_students': 5000, 'n_schools': 50},
+    'large': {'n_students': 20000, 'n_schools': 300}
+}
+
+def generate_cohort(n_students=500, n_schools=10, n_sessions=6, picks=12, skew=1.1, budget=1000,
+                    seat_ratio=1.1, seed=0):
+    """
+    Generate a cohort as plain arrays:
+    1. School popularity is proportional to 1 / rank ** `skew`
+    2. Each student picks up to `picks` distinct schools, drawn by popularity
+    3. The student's `budget` points are split over the picks with decreasing,
+       randomly sized shares, rounded to multiples of 10
+    4. Each session has about `seat_ratio` seats per student, split over the
+       schools half evenly and half by popularity
+    
+    Returns a dict with the students x schools points matrix, the schools x
+    sessions capacity matrix and student and school details, all reproducible
+    from `seed`.
+    """
+    rng = np.random.default_rng(seed)
+    picks = min(picks, n_schools)
+    
+    # Step 1: Zipf-like popularity, shuffled so school order says nothing
+    popularity = 1.0 / np.arange(1, n_schools + 1) ** skew
+    popularity = rng.permutation(popularity / popularity.sum())
+    
+    # Step 2: Weighted sampling without replacement (Gumbel top-k over log weights)
+    keys = np.log(popularity)[np.newaxis, :] + rng.gumbel(size=(n_students, n_schools))
+    chosen = np.argsort(-keys, axis=1)[:, :picks]
+    
+    # Step 3: Decreasing random shares of the budget
+    shares = -np.sort(-rng.dirichlet(np.ones(picks), size=n_students), axis=1)
+    allotted = np.round(shares * budget / 10).astype(np.int64) * 10
+    points = np.zeros((n_students, n_schools), dtype=np.int64)
+    points[np.arange(n_students)[:, np.newaxis], chosen] = allotted
+    
+    # Step 4: Capacities
+    weights = 0.5 / n_schools + 0.5 * popularity
+    seats = seat_ratio * n_students * weights[:, np.newaxis] * rng.uniform(0.8, 1.2, size=(n_schools, n_sessions))
+    capacity = np.maximum(np.round(seats), 1).astype(np.int64)
+    
+    return {
+        'points': points,
+        'capacity': capacity,
+        'first_names': [f'Student{i + 1}' for i in range(n_students)],
+        'last_names': [f'Cohort{seed}' for _ in range(n_students)],
+        'emails': [f'student{i + 1}.cohort{seed}@example.com' for i in range(n_students)],
+        'school_names': [f'School {j + 1}' for j in range(n_schools)]
+    }
+
+def populate_database(cohort, dense=True):
+    """
+    Replace the schools, students, preferences and matching results in the
+    database with `cohort`, using batched inserts. Must run inside an app context.
+    
+    With `dense` every (student, school) pair gets a Preference row, zero points
+    included, as /api/preferences/save stores them; otherwise only non-zero ones.
+    """
+    from database import db, School, Student, Preference, MatchingRun, MatchingResult, bump_data_version
+    
+    n_students, n_schools = cohort['points'].shape
+    db.session.execute(MatchingResult.__table__.delete())
+    db.session.execute(MatchingRun.__table__.delete())
+    db.session.execute(Preference.__table__.delete())
+    db.session.execute(Student.__table__.delete())
+    db.session.execute(School.__table__.delete())
+    
+    capacity = cohort['capacity'].tolist()
+    db.session.execute(School.__table__.insert(), [
+        dict(
+            {'id': j + 1, 'school_name': cohort['school_names'][j]},
+            **{f'session{t + 1}_capacity': capacity[j][t] for t in range(len(capacity[j]))}
+        )
+        for j in range(n_schools)
+    ])
+    db.session.execute(Student.__table__.insert(), [
+        {
+            'id': i + 1,
+            'first_name': cohort['first_names'][i],
+            'last_name': cohort['last_names'][i],
+            'email': cohort['emails'][i]
+        }
+        for i in range(n_students)
+    ])
+    
+    points = cohort['points']
+    student_idx, school_idx = np.nonzero(np.ones_like(points, dtype=bool) if dense else points > 0)
+    values = points[student_idx, school_idx]
+    
+    # Ranks as database.rank_preferences sets them: points descending, ties by school id
+    order = np.lexsort((school_idx, -values, student_idx))
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order)) - np.searchsorted(student_idx[order], student_idx[order]) + 1
+    rows = [
+        {'student_id': i + 1, 'school_id': j + 1, 'points': p, 'rank': r}
+        for i, j, p, r in zip(student_idx.tolist(), school_idx.tolist(), values.tolist(), rank.tolist())
+    ]
+    for offset in range(0, len(rows), 50000):
+        db.session.execute(Preference.__table__.insert(), rows[offset:offset + 50000])
+    bump_data_version()
+    db.session.commit()
+
+def preferences_grid(cohort, limit=None):
+    """
+    Preference rows in the shape the preferences page posts to
+    /api/preferences/save, for the first `limit` students
+    """
+    points = cohort['points'] if limit is None else cohort['points'][:limit]
+    grid = []
+    for i, row in enumerate(points.tolist()):
+        item = {
+            'First Name': cohort['first_names'][i],
+            'Last Name': cohort['last_names'][i],
+            'Email': cohort['emails'][i]
+        }
+        item.update(zip(cohort['school_names'], row))
+        item['Total'] = sum(row)
+        grid.append(item)
+    return grid
@@ -0,0 +1,29 @@
+"""
+Shared fixtures. The app reads DATABASE_URL when it is imported, so it is
+pointed at a temporary SQLite database before any test imports it.
+"""
+import os
+import shutil
+import tempfile
+import pytest
+
+_database_dir = tempfile.mkdtemp(prefix='matchwzrd-tests-')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(_database_dir, 'test.db')
+
+def pytest_unconfigure(config):
+    shutil.rmtree(_database_dir, ignore_errors=True)
+
+@pytest.fixture
+def app_context():
+    """
+    An app context on an empty database, with no cached responses: a new database
+    starts from the same data version
+    """
+    from app import app, db
+    from response_cache import _responses
+    _responses.clear()
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        yield app
+        db.session.remove()
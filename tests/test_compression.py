@@ -0,0 +1,67 @@
+"""
+Response compression: the encoding is negotiated from Accept-Encoding, bodies
+round-trip, the X-Compression-* headers are set, and small, streamed or
+non-text responses are sent as they are.
+"""
+import gzip
+import zlib
+import pytest
+from flask import Response
+from compression import COMPRESSION_MIN_SIZE, ENCODINGS, brotli, compress_response
+from synthetic import generate_cohort, populate_database
+
+DECODERS = {'gzip': gzip.decompress, 'deflate': zlib.decompress}
+if brotli is not None:
+    DECODERS['br'] = brotli.decompress
+
+@pytest.fixture
+def client(app_context):
+    from matching import run_matching_algorithm
+    populate_database(generate_cohort(n_students=60, n_schools=5, picks=3, seed=6))
+    run_matching_algorithm(seed=6)
+    return app_context.test_client()
+
+@pytest.mark.parametrize('encoding', ENCODINGS)
+def test_cached_endpoint_round_trip(client, encoding):
+    plain = client.get('/api/results?limit=1000')
+    assert 'Content-Encoding' not in plain.headers
+    assert 'Accept-Encoding' in plain.headers['Vary']
+    
+    response = client.get('/api/results?limit=1000', headers={'Accept-Encoding': encoding})
+    assert response.headers['Content-Encoding'] == encoding
+    assert DECODERS[encoding](response.data) == plain.data
+    assert float(response.headers['X-Compression-Ratio']) == pytest.approx(len(plain.data) / len(response.data), abs=0.01)
+    assert float(response.headers['X-Compression-Time']) >= 0
+    version = plain.headers['ETag'].strip('"')
+    assert response.headers['ETag'] == f'"{version}-{encoding}"'
+    
+    # Revalidating with the encoded ETag
+    assert client.get('/api/results?limit=1000', headers={
+        'Accept-Encoding': encoding, 'If-None-Match': response.headers['ETag']
+    }).status_code == 304
+
+def test_client_preference_wins(client):
+    response = client.get('/api/results?limit=1000', headers={'Accept-Encoding': 'gzip;q=0.5, deflate'})
+    assert response.headers['Content-Encoding'] == 'deflate'
+    response = client.get('/api/results?limit=1000', headers={'Accept-Encoding': 'identity'})
+    assert 'Content-Encoding' not in response.headers
+
+def test_small_and_streamed_responses_are_not_compressed(client):
+    small = client.get('/api/config/check', headers={'Accept-Encoding': 'gzip'})
+    assert len(small.data) < COMPRESSION_MIN_SIZE
+    assert 'Content-Encoding' not in small.headers
+    export = client.get('/api/results/export?format=csv', headers={'Accept-Encoding': 'gzip'})
+    assert export.status_code == 200
+    assert 'Content-Encoding' not in export.headers
+
+def test_after_request_hook(app_context):
+    body = b'{"rows": [' + b'1, ' * 2000 + b'1]}'
+    with app_context.test_request_context(headers={'Accept-Encoding': 'gzip'}):
+        response = compress_response(Response(body, mimetype='application/json'))
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert gzip.decompress(response.get_data()) == body
+        assert 'X-Compression-Ratio' in response.headers
+        
+        image = compress_response(Response(body, mimetype='image/png'))
+        assert 'Content-Encoding' not in image.headers
+        assert image.get_data() == body
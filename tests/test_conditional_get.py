@@ -0,0 +1,60 @@
+"""
+Conditional GET of the read endpoints: the data version is the ETag, a matching
+If-None-Match is a 304, and every change moves the version on so cached bodies
+and ETags stop matching.
+"""
+import pytest
+from synthetic import generate_cohort, populate_database
+
+READ_URLS = ['/api/results', '/api/analytics', '/api/config/load', '/api/preferences/load']
+
+@pytest.fixture
+def client(app_context):
+    from matching import run_matching_algorithm
+    populate_database(generate_cohort(n_students=30, n_schools=4, picks=3, seed=4))
+    run_matching_algorithm(seed=4)
+    return app_context.test_client()
+
+def _config_row(name):
+    return {'School Name': name, **{f'Capacity Breakout Session {t}': 5 for t in range(1, 7)}}
+
+@pytest.mark.parametrize('url', READ_URLS)
+def test_matching_etag_is_not_modified(client, url):
+    from database import data_version
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.headers['Cache-Control'] == 'no-cache'
+    etag = response.headers['ETag'].strip('"')
+    assert etag == str(data_version())
+    
+    again = client.get(url, headers={'If-None-Match': f'"{etag}"'})
+    assert again.status_code == 304
+    assert again.data == b''
+    assert client.get(url, headers={'If-None-Match': '"stale"'}).status_code == 200
+
+@pytest.mark.parametrize('url', READ_URLS)
+def test_cached_body_is_served_until_the_version_moves(client, url):
+    first = client.get(url)
+    assert client.get(url).data == first.data
+    assert client.post('/api/config/save', json={'data': [_config_row('Only School')]}).status_code == 200
+    changed = client.get(url, headers={'If-None-Match': first.headers['ETag']})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != first.headers['ETag']
+
+def test_new_run_invalidates_results(client):
+    from matching import run_matching_algorithm
+    first = client.get('/api/results')
+    run_id = run_matching_algorithm(seed=5)['statistics']['run_id']
+    response = client.get('/api/results', headers={'If-None-Match': first.headers['ETag']})
+    assert response.status_code == 200
+    assert response.get_json()['run_id'] == run_id
+
+def test_failed_save_changes_nothing(client):
+    from database import School
+    before = client.get('/api/config/load')
+    incomplete = _config_row('Half School')
+    del incomplete['Capacity Breakout Session 6']
+    response = client.post('/api/config/save', json={'data': [_config_row('New School'), incomplete]})
+    assert response.status_code == 500
+    assert School.query.count() == 4
+    assert client.get('/api/config/load', headers={'If-None-Match': before.headers['ETag']}).status_code == 304
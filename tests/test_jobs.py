@@ -0,0 +1,116 @@
+"""
+Background jobs: status moves from queued through each phase to finished or
+failed with its progress, the events stream reports the same, and matching runs
+submitted with "background" are polled to their result.
+"""
+import json
+import threading
+import time
+import pytest
+from jobs import job_events, job_status, submit_job
+
+def _wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+class _Steps:
+    """
+    Job function recording its phases one at a time, each once released
+    """
+    def __init__(self, phases, fail=False):
+        self.phases = phases
+        self.fail = fail
+        self.released = {phase: threading.Event() for phase in phases}
+    
+    def __call__(self, timings):
+        for phase in self.phases:
+            assert self.released[phase].wait(10)
+            timings[phase] = {'seconds': 0.01, 'items': 1}
+        if self.fail:
+            raise RuntimeError('solver crashed')
+        return {'phases': len(self.phases)}
+    
+    def release(self, phase=None):
+        for name in ([phase] if phase else self.phases):
+            self.released[name].set()
+
+@pytest.fixture
+def steps(app_context):
+    created = []
+    
+    def make(phases, fail=False):
+        created.append(_Steps(phases, fail))
+        return created[-1]
+    yield make
+    for step in created:
+        step.release()
+
+def test_status_follows_the_phases(app_context, steps):
+    job = steps(['load', 'solve', 'persist'])
+    job_id = submit_job(app_context, job, job.phases, {'load': 1.0, 'solve': 3.0, 'persist': 1.0}, kind='test')
+    _wait_for(lambda: job_status(job_id)['state'] == 'running')
+    status = job_status(job_id)
+    assert (status['phase'], status['kind']) == ('load', 'test')
+    assert status['eta_seconds'] <= 5.0
+    
+    job.release('load')
+    _wait_for(lambda: job_status(job_id)['phase'] == 'solve')
+    status = job_status(job_id)
+    assert 20 <= status['percent'] < 100
+    assert status['eta_seconds'] <= 4.0
+    assert list(status['timings']) == ['load']
+    
+    job.release()
+    _wait_for(lambda: job_status(job_id)['state'] == 'finished')
+    status = job_status(job_id)
+    assert (status['phase'], status['percent'], status['eta_seconds']) == ('finished', 100, 0)
+    assert status['result'] == {'phases': 3}
+
+def test_failed_job(app_context, steps):
+    job = steps(['load'], fail=True)
+    job.release()
+    job_id = submit_job(app_context, job, job.phases)
+    _wait_for(lambda: job_status(job_id)['state'] == 'failed')
+    status = job_status(job_id)
+    assert (status['error'], status['percent'], status['result']) == ('solver crashed', None, None)
+
+def _events(stream):
+    return [json.loads(event[len('data: '):]) for event in stream.split('\n\n') if event.startswith('data: ')]
+
+def test_events_stream(app_context, steps):
+    job = steps(['load', 'solve'])
+    job_id = submit_job(app_context, job, job.phases)
+    events = job_events(job_id, interval=0.01)
+    first = json.loads(next(events)[len('data: '):])
+    assert first['state'] in ('queued', 'running')
+    job.release()
+    statuses = [first] + _events(''.join(events))
+    assert statuses[-1]['state'] == 'finished'
+    states = [['queued', 'running', 'finished'].index(status['state']) for status in statuses]
+    assert states == sorted(states)
+
+def test_unknown_job(app_context):
+    client = app_context.test_client()
+    assert client.get('/api/jobs/missing').status_code == 404
+    assert client.get('/api/jobs/missing/events').status_code == 404
+    assert next(job_events('missing')).startswith('event: error')
+
+def test_background_matching(app_context):
+    from matching import current_run_id
+    from synthetic import generate_cohort, populate_database
+    populate_database(generate_cohort(n_students=40, n_schools=4, picks=3, seed=9))
+    client = app_context.test_client()
+    response = client.post('/api/preferences/process', json={'background': True, 'seed': 9})
+    assert response.status_code == 202
+    submitted = response.get_json()
+    
+    stream = client.get(submitted['events_url'])
+    assert stream.mimetype == 'text/event-stream'
+    statuses = _events(stream.get_data(as_text=True))
+    assert statuses[-1]['state'] == 'finished'
+    
+    job = client.get(submitted['status_url']).get_json()['job']
+    assert (job['state'], job['algorithm'], job['percent']) == ('finished', 'improved_matching', 100)
+    assert job['result']['run_id'] == current_run_id()
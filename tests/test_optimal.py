@@ -0,0 +1,35 @@
+"""
+solve_flow and solve_ilp both find the optimal visits, so their objectives agree
+and neither does worse than the greedy.
+"""
+import numpy as np
+import pytest
+from matching_core import solve_flow, solve_ilp
+from synthetic import generate_cohort
+
+def _cohorts():
+    for seed in range(3):
+        cohort = generate_cohort(n_students=60, n_schools=6, picks=4, seat_ratio=0.9, seed=seed)
+        yield pytest.param(cohort['points'], cohort['capacity'], seed, id=f'synthetic-{seed}')
+    # Tied points and scarce seats, where the optimum is far from unique
+    rng = np.random.default_rng(5)
+    points = rng.choice([0, 0, 100, 200], size=(40, 5)).astype(np.int64)
+    capacity = rng.integers(2, 8, size=(5, 6)).astype(np.int64)
+    yield pytest.param(points, capacity, 5, id='tied')
+
+def _seats_used(solution, shape):
+    used = np.zeros(shape, dtype=np.int64)
+    for _, j, t, _ in solution['assignments']:
+        used[j, t] += 1
+    return used
+
+@pytest.mark.parametrize('points, capacity, seed', list(_cohorts()))
+def test_flow_and_ilp_objectives_agree(points, capacity, seed):
+    flow = solve_flow(points, capacity, seed=seed)
+    ilp = solve_ilp(points, capacity, seed=seed, time_limit=60, gap_tolerance=0)
+    assert flow['optimization']['proven_optimal'] and ilp['optimization']['proven_optimal']
+    assert flow['optimization']['objective'] == ilp['optimization']['objective']
+    assert flow['optimization']['objective'] >= flow['optimization']['greedy_objective']
+    for solution in (flow, ilp):
+        assert (_seats_used(solution, capacity.shape) <= capacity).all()
+        assert sum(assignment[3] for assignment in solution['assignments']) == solution['optimization']['objective']
@@ -0,0 +1,30 @@
+"""
+MatchingResult.preference_score is a snapshot of the points at match time:
+editing preferences leaves the published runs as they were, and the next run
+scores its results with the new points.
+"""
+from synthetic import generate_cohort, populate_database, preferences_grid
+
+def _scores(run_id):
+    from database import MatchingResult
+    return sorted(
+        (row.student_id, row.school_id, row.session_number, row.preference_score)
+        for row in MatchingResult.query.filter(MatchingResult.run_id == run_id)
+    )
+
+def test_published_scores_survive_a_preference_edit(app_context):
+    from database import Preference
+    from matching import run_matching_algorithm
+    cohort = generate_cohort(n_students=60, n_schools=6, picks=4, seed=2)
+    populate_database(cohort)
+    run_id = run_matching_algorithm(seed=2)['statistics']['run_id']
+    before = _scores(run_id)
+    
+    cohort['points'] = cohort['points'] * 2 + 10
+    response = app_context.test_client().post('/api/preferences/save', json={'data': preferences_grid(cohort, 20)})
+    assert response.status_code == 200
+    assert _scores(run_id) == before
+    
+    rerun = run_matching_algorithm(seed=2)['statistics']['run_id']
+    points = {(row.student_id, row.school_id): row.points for row in Preference.query}
+    assert all(score == points.get((student_id, school_id), 0) for student_id, school_id, _, score in _scores(rerun))
@@ -0,0 +1,58 @@
+"""
+rematch_greedy gives the results of a full solve_improved run with the same seed
+after randomized edits to points and capacities.
+"""
+import io
+import numpy as np
+import pytest
+from matching_core import bid_assignments, load_greedy_state, rematch_greedy, save_greedy_state, solve_improved
+from synthetic import generate_cohort
+
+def _placements(solution):
+    # rematch_greedy solutions have no 'assignments', both have the greedy state
+    greedy = solution['greedy']
+    return (
+        bid_assignments(greedy['bids'], greedy['sessions']),
+        sorted(tuple(fill) for fill in solution['fallback']),
+        sorted(tuple(seat) for seat in solution['unplaced']),
+        solution['matched_students']
+    )
+
+def _edit(rng, points, capacity):
+    """
+    New points rows for a few random students and a few changed capacities
+    """
+    changed_points = {}
+    for i in rng.choice(points.shape[0], size=rng.integers(0, 6), replace=False).tolist():
+        row = np.where(rng.random(points.shape[1]) < 0.4, rng.choice([100, 200, 300], size=points.shape[1]), 0)
+        points[i] = row
+        changed_points[i] = row.astype(np.int64)
+    for _ in range(rng.integers(0, 3)):
+        j, t = rng.integers(capacity.shape[0]), rng.integers(capacity.shape[1])
+        capacity[j, t] = max(0, capacity[j, t] + rng.integers(-5, 6))
+    return changed_points
+
+@pytest.mark.parametrize('seed', range(4))
+def test_matches_full_rerun_over_randomized_edits(seed):
+    cohort = generate_cohort(n_students=120, n_schools=8, picks=5, seat_ratio=0.95, seed=seed)
+    points, capacity = cohort['points'].copy(), cohort['capacity'].copy()
+    rng = np.random.default_rng(seed)
+    solution = solve_improved(points, capacity, seed=seed)
+    for _ in range(6):
+        changed_points = _edit(rng, points, capacity)
+        solution = rematch_greedy(solution['greedy'], changed_points, capacity.copy())
+        assert _placements(solution) == _placements(solve_improved(points, capacity, seed=seed))
+
+def test_state_round_trip():
+    cohort = generate_cohort(n_students=80, n_schools=6, picks=4, seed=7)
+    points, capacity = cohort['points'].copy(), cohort['capacity'].copy()
+    solution = solve_improved(points, capacity, seed=7)
+    stored = io.BytesIO()
+    save_greedy_state(stored, solution['greedy'], list(range(80)), list(range(6)), run_id=3)
+    stored.seek(0)
+    state, student_ids, school_ids, run_id = load_greedy_state(stored)
+    assert (student_ids.tolist(), school_ids.tolist(), run_id) == (list(range(80)), list(range(6)), 3)
+    
+    changed_points = _edit(np.random.default_rng(7), points, capacity)
+    assert _placements(rematch_greedy(state, changed_points, capacity)) == \
+        _placements(solve_improved(points, capacity, seed=7))
@@ -0,0 +1,89 @@
+"""
+Keyset pagination of /api/results: following next_cursor visits every result
+once, in the requested order, whatever the ties and NULL scores; malformed
+cursors are a 400.
+"""
+import base64
+import json
+import numpy as np
+import pytest
+from synthetic import generate_cohort, populate_database
+
+@pytest.fixture
+def client(app_context):
+    from database import db, MatchingResult
+    from matching import run_matching_algorithm
+    # Few distinct points and names, so every sort has long runs of ties
+    cohort = generate_cohort(n_students=40, n_schools=4, picks=3, seed=1)
+    cohort['points'] = np.where(cohort['points'] > 0, 100, 0)
+    cohort['first_names'] = [f'Student{i % 3}' for i in range(40)]
+    populate_database(cohort)
+    run_id = run_matching_algorithm(seed=1)['statistics']['run_id']
+    # Results written before scores were stored have none
+    db.session.execute(MatchingResult.__table__.update()
+                       .where(MatchingResult.run_id == run_id, MatchingResult.id % 7 == 0)
+                       .values(preference_score=None))
+    db.session.commit()
+    return app_context.test_client()
+
+def _expected(sort, order):
+    from database import MatchingResult, School, Student
+    rows = MatchingResult.query.join(Student).join(School).all()
+    keys = {
+        'id': lambda row: (),
+        'student_name': lambda row: (row.student.first_name, row.student.last_name),
+        'school_name': lambda row: (row.school.school_name,),
+        'session_number': lambda row: (row.session_number,),
+        # NULLs first ascending, last descending
+        'preference_score': lambda row: (row.preference_score is not None, row.preference_score or 0)
+    }
+    ordered = sorted(rows, key=lambda row: keys[sort](row) + (row.id,), reverse=order == 'desc')
+    return [row.id for row in ordered]
+
+def _pages(client, **params):
+    ids, cursor = [], None
+    while True:
+        query = dict(params, **({'cursor': cursor} if cursor else {}))
+        response = client.get('/api/results', query_string=query)
+        assert response.status_code == 200
+        page = response.get_json()
+        ids.extend(match['id'] for match in page['matches'])
+        cursor = page['next_cursor']
+        if cursor is None:
+            return ids
+
+def _session(result_id):
+    from database import db, MatchingResult
+    return db.session.get(MatchingResult, result_id).session_number
+
+@pytest.mark.parametrize('sort', ['id', 'student_name', 'school_name', 'session_number', 'preference_score'])
+@pytest.mark.parametrize('order', ['asc', 'desc'])
+def test_pages_follow_the_order(client, sort, order):
+    assert _pages(client, sort=sort, order=order, limit=7) == _expected(sort, order)
+
+def test_filtered_pages(client):
+    ids = _pages(client, sort='preference_score', order='desc', session=2, limit=3)
+    assert ids == [result_id for result_id in _expected('preference_score', 'desc')
+                   if _session(result_id) == 2]
+
+def _cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+@pytest.mark.parametrize('sort, cursor', [
+    ('id', 'not a cursor'),
+    ('id', _cursor([1, 2])),
+    ('id', _cursor(['1'])),
+    ('id', _cursor([True])),
+    ('id', _cursor([None])),
+    ('school_name', _cursor([3, 4])),
+    ('preference_score', _cursor(['high', 4]))
+])
+def test_bad_cursors(client, sort, cursor):
+    response = client.get('/api/results', query_string={'sort': sort, 'cursor': cursor})
+    assert response.status_code == 400
+    assert response.get_json()['success'] is False
+
+def test_unknown_sort_and_limits(client):
+    assert client.get('/api/results?sort=rank').status_code == 400
+    assert client.get('/api/results?limit=0').status_code == 400
+    assert client.get('/api/results?order=up').status_code == 400
@@ -0,0 +1,76 @@
+"""
+Staged runs: a run's results stay hidden from the read endpoints until it is
+published, and a run that fails while being written is discarded, leaving the
+current one in place.
+"""
+from datetime import datetime, timedelta
+import pytest
+import matching
+from synthetic import generate_cohort, populate_database
+
+@pytest.fixture
+def client(app_context):
+    populate_database(generate_cohort(n_students=30, n_schools=4, picks=3, seed=8))
+    return app_context.test_client()
+
+def _result_ids(client, **params):
+    response = client.get('/api/results', query_string=dict(params, limit=1000))
+    return response.status_code, [match['id'] for match in response.get_json().get('matches', [])]
+
+def test_run_is_hidden_until_published(client, monkeypatch):
+    from database import MatchingResult
+    current = matching.run_matching_algorithm(seed=1)['statistics']['run_id']
+    _, current_ids = _result_ids(client)
+    seen = {}
+    finish_run = matching._finish_run
+    
+    def inspect_then_finish(run, statistics, rows):
+        # The staged rows are committed, but readers still get the current run
+        seen['staged_rows'] = MatchingResult.query.filter(MatchingResult.run_id == run.id).count()
+        seen['current'] = matching.current_run_id()
+        seen['default'] = _result_ids(client)
+        seen['by_id'] = _result_ids(client, run_id=run.id)[0]
+        seen['compare'] = client.get(f'/api/runs/compare?base={current}&other={run.id}').status_code
+        seen['status'] = {item['run_id']: item['status'] for item in matching.list_runs()}[run.id]
+        finish_run(run, statistics, rows)
+    
+    monkeypatch.setattr(matching, '_finish_run', inspect_then_finish)
+    staged = matching.run_matching_algorithm(seed=2)['statistics']['run_id']
+    assert seen.pop('staged_rows') > 0
+    assert seen == {
+        'current': current,
+        'default': (200, current_ids),
+        'by_id': 404,
+        'compare': 404,
+        'status': 'staged'
+    }
+    assert matching.current_run_id() == staged
+    assert client.get(f'/api/results?run_id={staged}').status_code == 200
+
+def test_failed_run_is_discarded(client, monkeypatch):
+    from database import MatchingResult, MatchingRun
+    current = matching.run_matching_algorithm(seed=1)['statistics']['run_id']
+    persist = matching.persist_result_rows
+    
+    def persist_then_fail(rows, chunk_size):
+        persist(rows, chunk_size)
+        raise RuntimeError('connection lost')
+    
+    monkeypatch.setattr(matching, 'persist_result_rows', persist_then_fail)
+    with pytest.raises(RuntimeError):
+        matching.run_matching_algorithm(seed=2)
+    assert matching.current_run_id() == current
+    assert [run.id for run in MatchingRun.query] == [current]
+    assert MatchingResult.query.filter(MatchingResult.run_id != current).count() == 0
+
+def test_expired_staged_runs_are_pruned(client):
+    from database import db, MatchingRun
+    current = matching.run_matching_algorithm(seed=1)['statistics']['run_id']
+    old = MatchingRun(algorithm='improved_matching',
+                      created_at=datetime.utcnow() - timedelta(hours=matching.STAGED_RUN_EXPIRY_HOURS + 1))
+    recent = MatchingRun(algorithm='improved_matching')
+    db.session.add_all([old, recent])
+    db.session.commit()
+    old_id, recent_id = old.id, recent.id
+    assert matching.prune_matching_runs() == [old_id]
+    assert sorted(run.id for run in MatchingRun.query) == sorted([current, recent_id])
@@ -0,0 +1,39 @@
+"""
+top_k_bid_arrays keeps the same bids, in the same order, as filtering every
+student's first k bids out of build_bid_arrays.
+"""
+import numpy as np
+import pytest
+from matching_core import build_bid_arrays, draw_tiebreakers, top_k_bid_arrays
+
+def _first_k_bids(points, tiebreakers, k):
+    bids = build_bid_arrays(points, tiebreakers)
+    taken = np.zeros(points.shape[0], dtype=np.int64)
+    keep = np.zeros(len(bids[0]), dtype=bool)
+    for position, i in enumerate(bids[0].tolist()):
+        if taken[i] < k:
+            taken[i] += 1
+            keep[position] = True
+    return tuple(array[keep] for array in bids)
+
+def _tied_points(seed, n_students, n_schools, values):
+    rng = np.random.default_rng(seed)
+    return rng.choice(values, size=(n_students, n_schools)).astype(np.int64)
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('k', [1, 2, 3, 6, 12])
+def test_matches_full_bid_filter_on_tied_cohorts(seed, k):
+    points = _tied_points(seed, 200, 10, [0, 0, 100, 100, 100, 200, 300])
+    tiebreakers = draw_tiebreakers(seed, points.shape)
+    expected = _first_k_bids(points, tiebreakers, k)
+    for actual, wanted in zip(top_k_bid_arrays(points, tiebreakers, k), expected):
+        np.testing.assert_array_equal(actual, wanted)
+
+@pytest.mark.parametrize('k', [0, 1, 4])
+def test_students_without_enough_bids(k):
+    # A student with no points, one with a single bid and one where every bid ties
+    points = np.array([[0, 0, 0, 0], [0, 50, 0, 0], [70, 70, 70, 70]], dtype=np.int64)
+    tiebreakers = draw_tiebreakers(9, points.shape)
+    expected = _first_k_bids(points, tiebreakers, k)
+    for actual, wanted in zip(top_k_bid_arrays(points, tiebreakers, k), expected):
+        np.testing.assert_array_equal(actual, wanted)
@@ -1,7 +1,8 @@
+import sys
 from app import app, db
-from database import School
+from database import School, bump_data_version
 
-def update_school_capacity(school_name, session_number, new_capacity):
+def update_school_capacity(school_name, session_number, new_capacity, rematch=False):
     with app.app_context():
         # Find the school
         school = School.query.filter_by(school_name=school_name).first()
@@ -24,8 +25,24 @@ def update_school_capacity(school_name, session_number, new_capacity):
         else:
             return False
         
-        # Commit the changes
+        # Commit the changes, stored analytics no longer match the capacities
+        from analytics import clear_analytics
+        clear_analytics()
+        bump_data_version()
         db.session.commit()
+        
+        # With `rematch`, replay the current improved matching run against the new
+        # capacity, so only the results the change affects are rewritten
+        from matching import has_greedy_run, rematch_incremental
+        if not rematch:
+            print("The matching results no longer reflect this capacity, run the matching again to update them")
+        elif not has_greedy_run():
+            print("The current matching results are not from an improved matching run and cannot be "
+                  "updated in place, they no longer reflect this capacity: run the matching again")
+        else:
+            result = rematch_incremental()
+            if "error" in result:
+                print(f"Error updating matching results: {result['error']}")
         return True
 
 if __name__ == "__main__":
@@ -34,4 +51,4 @@ if __name__ == "__main__":
     session_number = 1  # First session
     new_capacity = 100
     
-    update_school_capacity(school_name, session_number, new_capacity) 
\ No newline at end of file
+    update_school_capacity(school_name, session_number, new_capacity, rematch="--rematch" in sys.argv) 
\ No newline at end of file